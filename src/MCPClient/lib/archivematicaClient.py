@@ -37,6 +37,7 @@ import cPickle
 import gearman
 import logging
 import os
+import shlex
 import time
 from socket import gethostname
 import sys
@@ -61,7 +62,9 @@ sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from django_mysqlpool import auto_close_db
 from custom_handlers import GroupWriteRotatingFileHandler
 import databaseFunctions
-from executeOrRunSubProcess import executeOrRun
+from executeOrRunSubProcess import executeOrRun, purgeOutputFiles
+from scriptRunner import ScriptRunner
+from workerSupervisor import WorkerSupervisor
 
 
 LOGGING_CONFIG = {
@@ -111,6 +114,12 @@ replacementDic = {
     "%clientScriptsDirectory%": config.get('MCPClient', "clientScriptsDirectory")
 }
 supportedModules = {}
+# Commands whose scripts may be run in the worker processes of scriptRunner
+inProcessModules = set()
+scriptRunner = None
+supervisor = None
+# Library paths client scripts expect to find on their path
+lib_paths = ['/usr/share/archivematica/dashboard/', '/usr/lib/archivematica/archivematicaCommon']
 
 def loadSupportedModulesSupport(key, value):
     for key2, value2 in replacementDic.items():
@@ -131,6 +140,46 @@ def loadSupportedModules(file):
         for key, value in supportedModulesConfig.items('supportedCommandsSpecial'):
             loadSupportedModulesSupport(key, value)
 
+    try:
+        for key, _ in supportedModulesConfig.items('inProcessCommands'):
+            if not supportedModulesConfig.getboolean('inProcessCommands', key):
+                continue
+            if key not in supportedModules:
+                continue
+            if not supportedModules[key].strip().endswith('.py'):
+                logger.warning('Not running %s in process: only Python scripts can be', key)
+                continue
+            inProcessModules.add(key)
+    except ConfigParser.NoSectionError:
+        pass
+
+
+def getOutputLimits(taskUUID):
+    """
+    Return the maximum number of bytes of a command's standard output and
+    error to send back to the server, and where to save them in full when
+    they are longer, if anywhere.
+    """
+    try:
+        limit = config.getint('MCPClient', "taskOutputLimit")
+    except ConfigParser.NoOptionError:
+        limit = 0
+    try:
+        directory = config.get('MCPClient', "taskOutputDirectory")
+    except ConfigParser.NoOptionError:
+        directory = ""
+    if not limit or not directory:
+        return limit, None
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another thread in the meantime
+            if not os.path.isdir(directory):
+                raise
+    return limit, (os.path.join(directory, taskUUID + ".stdout"),
+                   os.path.join(directory, taskUUID + ".stderr"))
+
 
 @auto_close_db
 def executeCommand(gearman_worker, gearman_job):
@@ -175,8 +224,15 @@ Unable to determine if it completed successfully."""
         value = gearman_job.unique.__str__()
         arguments = arguments.replace(key, value)
 
+        if scriptRunner is not None and execute in inProcessModules:
+            logger.info('<processingCommand>{%s}%s %s</processingCommand>', gearman_job.unique, command.strip(), arguments)
+            results = scriptRunner.run(command.strip(), shlex.split(arguments))
+            if results is not None:
+                exitCode, stdOut, stdError = results
+                return cPickle.dumps({"exitCode": exitCode, "stdOut": stdOut, "stdError": stdError})
+            logger.warning('%s does not provide call(); running it as a command', command.strip())
+
         # Add useful environment vars for client scripts
-        lib_paths = ['/usr/share/archivematica/dashboard/', '/usr/lib/archivematica/archivematicaCommon']
         env_updates = {
             'PYTHONPATH': os.pathsep.join(lib_paths),
             'DJANGO_SETTINGS_MODULE': config.get('MCPClient', 'django_settings_module')
@@ -185,7 +241,8 @@ Unable to determine if it completed successfully."""
         # Execute command
         command += " " + arguments
         logger.info('<processingCommand>{%s}%s</processingCommand>', gearman_job.unique, command)
-        exitCode, stdOut, stdError = executeOrRun("command", command, sInput, printing=False, env_updates=env_updates)
+        outputLimit, outputPaths = getOutputLimits(gearman_job.unique)
+        exitCode, stdOut, stdError = executeOrRun("command", command, sInput, printing=False, env_updates=env_updates, output_limit=outputLimit, output_paths=outputPaths)
         return cPickle.dumps({"exitCode": exitCode, "stdOut": stdOut, "stdError": stdError})
     except OSError as ose:
         logger.exception('Execution failed')
@@ -198,22 +255,22 @@ Unable to determine if it completed successfully."""
         return cPickle.dumps({"exitCode": -1, "stdOut": output[0], "stdError": output[1]})
 
 
-@auto_close_db
-def startThread(threadNumber):
-    """Setup a gearman client, for the thread."""
-    gm_worker = gearman.GearmanWorker([config.get('MCPClient', "MCPArchivematicaServer")])
-    hostID = gethostname() + "_" + threadNumber.__str__()
-    gm_worker.set_client_id(hostID)
+def registerTasks(gm_worker, clientID):
+    gm_worker.set_client_id(clientID)
     for key in supportedModules.keys():
         logger.info('Registering: %s', key)
         gm_worker.register_task(key, executeCommand)
 
+
+def work(gm_worker):
+    """Run the worker's loop until it returns, retrying while the server is unavailable."""
     failMaxSleep = 30
     failSleep = 1
     failSleepIncrementor = 2
     while True:
         try:
             gm_worker.work()
+            return
         except gearman.errors.ServerUnavailable as inst:
             logger.error('Gearman server is unavailable: %s. Retrying in %d seconds.', inst.args, failSleep)
             time.sleep(failSleep)
@@ -221,6 +278,116 @@ def startThread(threadNumber):
                 failSleep += failSleepIncrementor
 
 
+@auto_close_db
+def startThread(threadNumber):
+    """Setup a gearman client, for the thread."""
+    gm_worker = gearman.GearmanWorker([config.get('MCPClient', "MCPArchivematicaServer")])
+    registerTasks(gm_worker, gethostname() + "_" + threadNumber.__str__())
+    work(gm_worker)
+
+
+class SupervisedGearmanWorker(gearman.GearmanWorker):
+    """GearmanWorker reporting to a WorkerState, which stops once it is retired."""
+
+    def __init__(self, host_list, state):
+        super(SupervisedGearmanWorker, self).__init__(host_list)
+        self.state = state
+
+    def on_job_execute(self, current_job):
+        self.state.task_started()
+        try:
+            return super(SupervisedGearmanWorker, self).on_job_execute(current_job)
+        finally:
+            self.state.task_finished()
+
+    def after_poll(self, any_activity):
+        return not self.state.retiring
+
+
+@auto_close_db
+def startWorkerProcess(state):
+    """Setup a gearman client, for a worker process started by the supervisor."""
+    global scriptRunner
+    if inProcessScriptsEnabled():
+        # Each worker process runs one task at a time
+        scriptRunner = ScriptRunner(0, getScriptPaths())
+    gm_worker = SupervisedGearmanWorker([config.get('MCPClient', "MCPArchivematicaServer")], state)
+    registerTasks(gm_worker, gethostname() + "_" + state.number.__str__())
+    state.ready()
+    work(gm_worker)
+
+
+def getNumberOfTasks():
+    """Return the number of tasks to run at once: one per core if numberOfTasks is 0."""
+    t = config.getint('MCPClient', "numberOfTasks")
+    if t == 0:
+        from externals.detectCores import detectCPUs
+        t = detectCPUs()
+    return t
+
+
+def getOption(getter, option, default):
+    try:
+        return getter('MCPClient', option)
+    except ConfigParser.NoOptionError:
+        return default
+
+
+def inProcessScriptsEnabled():
+    return getOption(config.getboolean, "inProcessScripts", False) and bool(inProcessModules)
+
+
+def getScriptPaths():
+    # Scripts import their siblings from the client scripts directory
+    return lib_paths + [config.get('MCPClient', "clientScriptsDirectory")]
+
+
+def startScriptRunner(t):
+    """Start the worker processes for in-process commands, if enabled."""
+    global scriptRunner
+    if not inProcessScriptsEnabled():
+        return
+    logger.info('Running %s in %d worker processes', ', '.join(sorted(inProcessModules)), t)
+    scriptRunner = ScriptRunner(t, getScriptPaths())
+
+
+def startSupervisor(t):
+    """Start a worker process for each task, and supervise them until interrupted."""
+    global supervisor
+    supervisor = WorkerSupervisor(
+        startWorkerProcess, t,
+        max_tasks=getOption(config.getint, "maxTasksPerWorker", 0),
+        max_memory=getOption(config.getint, "maxWorkerMemory", 0) * 2 ** 20,
+        status_file=getOption(config.get, "workerStatusFile", "") or None)
+    supervisor.start()
+    supervisor.supervise()
+
+
+def purgeTaskOutput(max_age):
+    """Delete the saved task output older than max_age days, once an hour."""
+    while True:
+        directory = getOption(config.get, "taskOutputDirectory", "")
+        if os.path.isdir(directory):
+            try:
+                deleted = purgeOutputFiles(directory, max_age * 24 * 60 * 60)
+            except OSError:
+                logger.exception('Error deleting old task output from %s', directory)
+            else:
+                if deleted:
+                    logger.info('Deleted %d old task output files from %s', deleted, directory)
+        time.sleep(60 * 60)
+
+
+def startTaskOutputPurge():
+    """Start deleting old saved task output in the background, if enabled."""
+    max_age = getOption(config.getint, "taskOutputMaxAge", 0)
+    if not max_age or not getOption(config.getint, "taskOutputLimit", 0):
+        return
+    t = threading.Thread(target=purgeTaskOutput, args=(max_age, ))
+    t.daemon = True
+    t.start()
+
+
 def startThreads(t=1):
     """Start a processing thread for each core (t=0), or a specified number of threads."""
     if t == 0:
@@ -235,8 +402,18 @@ def startThreads(t=1):
 if __name__ == '__main__':
     try:
         loadSupportedModules(config.get('MCPClient', "archivematicaClientModules"))
-        startThreads(config.getint('MCPClient', "numberOfTasks"))
-        while True:
-            time.sleep(100)
+        numberOfTasks = getNumberOfTasks()
+        startTaskOutputPurge()
+        if getOption(config.getboolean, "workerProcesses", False):
+            startSupervisor(numberOfTasks)
+        else:
+            startScriptRunner(numberOfTasks)
+            startThreads(numberOfTasks)
+            while True:
+                time.sleep(100)
     except (KeyboardInterrupt, SystemExit):
         logger.info('Received keyboard interrupt, quitting threads.')
+        if supervisor is not None:
+            supervisor.stop()
+        if scriptRunner is not None:
+            scriptRunner.close()
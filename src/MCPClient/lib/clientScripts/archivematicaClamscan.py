@@ -36,17 +36,13 @@ from custom_handlers import get_script_logger
 from executeOrRunSubProcess import executeOrRun
 from databaseFunctions import insertIntoEvents
 
-if __name__ == '__main__':
-    logger = get_script_logger("archivematica.mcp.client.clamscan")
-    fileUUID = sys.argv[1]
-    target = sys.argv[2]
-    date = sys.argv[3]
 
+def main(fileUUID, target, date):
     # Check if scan event already exists for this file - if so abort early
     count = Event.objects.filter(file_uuid_id=fileUUID, event_type='virus check').count()
     if count >= 1:
         print('Virus scan already performed, not running scan again')
-        sys.exit(0)
+        return 0
 
     command = ['clamdscan', '-']
     print('Clamscan command:', ' '.join(command), '<', target)
@@ -63,7 +59,7 @@ if __name__ == '__main__':
             print('Version RC:', version_rc, file=sys.stderr)
             print('Version Standard output:', version_stdout, file=sys.stderr)
             print('Version Standard error:', version_stderr, file=sys.stderr)
-            sys.exit(2)
+            return 2
         else:
             eventOutcome = "Fail"
 
@@ -83,4 +79,17 @@ if __name__ == '__main__':
     if fileUUID != "None":
         insertIntoEvents(fileUUID=fileUUID, eventIdentifierUUID=str(uuid.uuid4()), eventType="virus check", eventDateTime=date, eventDetail=eventDetailText, eventOutcome=eventOutcome, eventOutcomeDetailNote="")
     if eventOutcome != "Pass":
-        sys.exit(3)
+        return 3
+    return 0
+
+
+def call(args):
+    fileUUID = args[0]
+    target = args[1]
+    date = args[2]
+    return main(fileUUID, target, date)
+
+
+if __name__ == '__main__':
+    logger = get_script_logger("archivematica.mcp.client.clamscan")
+    sys.exit(call(sys.argv[1:]))
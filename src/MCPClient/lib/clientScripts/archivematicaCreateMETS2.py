@@ -42,12 +42,14 @@ from main.models import Agent, Derivation, DublinCore, Event, File, FileID, FPCo
 
 import archivematicaCreateMETSReingest
 from archivematicaCreateMETSMetadataCSV import parseMetadata
+from archivematicaCreateMETSPrefetch import MetadataPrefetch
 from archivematicaCreateMETSRights import archivematicaGetRights
 from archivematicaCreateMETSRightsDspaceMDRef import archivematicaCreateMETSRightsDspaceMDRef
 from archivematicaCreateMETSTrim import getTrimDmdSec
 from archivematicaCreateMETSTrim import getTrimFileDmdSec
 from archivematicaCreateMETSTrim import getTrimAmdSec
 from archivematicaCreateMETSTrim import getTrimFileAmdSec
+from archivematicaCreateMETSWriter import SectionSpool, write_mets
 # archivematicaCommon
 from archivematicaFunctions import escape
 from archivematicaFunctions import strToUnicode
@@ -70,7 +72,7 @@ for use in globalFileGrpsUses:
 
 ##counters
 global amdSecs
-amdSecs = []
+amdSecs = SectionSpool()
 global dmdSecs
 dmdSecs = []
 global globalDmdSecCounter
@@ -95,6 +97,16 @@ trimStructMapObjects = None
 
 CSV_METADATA = {}
 
+# MetadataPrefetch of the unit, if its metadata was loaded in bulk
+global prefetch
+prefetch = None
+
+def _prefetched(fileUUID):
+    """ Returns the MetadataPrefetch holding the metadata of fileUUID, or None. """
+    if prefetch is not None and prefetch.has_file(fileUUID):
+        return prefetch
+    return None
+
 #move to common
 def newChild(parent, tag, text=None, tailText=None, sets=[]):
     # TODO convert sets to a dict, and use **dict
@@ -359,7 +371,10 @@ def create_premis_object(fileUUID):
     :param str fileUUID: UUID of the File to create an object for
     :return: premis:object Element, suitable for inserting into mets:xmlData
     """
-    f = File.objects.get(uuid=fileUUID)
+    if _prefetched(fileUUID):
+        f = prefetch.get_file_by_uuid(fileUUID)
+    else:
+        f = File.objects.get(uuid=fileUUID)
     # PREMIS:OBJECT
     object_elem = etree.Element(ns.premisBNS + "object", nsmap={'premis': ns.premisNS})
     object_elem.set(ns.xsiBNS+"type", "premis:file")
@@ -393,14 +408,17 @@ def create_premis_object(fileUUID):
 
 
 def create_premis_object_formats(fileUUID):
-    files = FileID.objects.filter(file_id=fileUUID)
+    if _prefetched(fileUUID):
+        rows = prefetch.format_ids.get(fileUUID, [])
+    else:
+        rows = FileID.objects.filter(file_id=fileUUID).values_list('format_name', 'format_version', 'format_registry_name', 'format_registry_key')
     elements = []
-    if not files.exists():
+    if not rows:
         fmt = etree.Element(ns.premisBNS + "format")
         formatDesignation = etree.SubElement(fmt, ns.premisBNS + "formatDesignation")
         etree.SubElement(formatDesignation, ns.premisBNS + "formatName").text = "Unknown"
         elements.append(fmt)
-    for row in files.values_list('format_name', 'format_version', 'format_registry_name', 'format_registry_key'):
+    for row in rows:
         fmt = etree.Element(ns.premisBNS + "format")
 
         formatDesignation = etree.SubElement(fmt, ns.premisBNS + "formatDesignation")
@@ -420,8 +438,12 @@ def create_premis_object_characteristics_extensions(fileUUID):
     elements = [objectCharacteristicsExtension]
 
     parser = etree.XMLParser(remove_blank_text=True)
-    documents = FPCommandOutput.objects.filter(file_id=fileUUID, rule__purpose__in=['characterization', 'default_characterization']).values_list('content')
-    for document, in documents:
+    documents = None
+    if _prefetched(fileUUID):
+        documents = prefetch.get_characterization(fileUUID)
+    if documents is None:
+        documents = FPCommandOutput.objects.filter(file_id=fileUUID, rule__purpose__in=['characterization', 'default_characterization']).values_list('content', flat=True)
+    for document in documents:
         # This needs to be converted into an str because lxml doesn't accept
         # XML documents in unicode strings if the document contains an
         # encoding declaration.
@@ -433,7 +455,10 @@ def create_premis_object_characteristics_extensions(fileUUID):
 def create_premis_object_derivations(fileUUID):
     elements = []
     # Derivations
-    derivations = Derivation.objects.filter(source_file_id=fileUUID, event__isnull=False)
+    if _prefetched(fileUUID):
+        derivations = [d for d in prefetch.derivations_from.get(fileUUID, []) if d.event_id is not None]
+    else:
+        derivations = Derivation.objects.filter(source_file_id=fileUUID, event__isnull=False)
     for derivation in derivations:
         relationship = etree.Element(ns.premisBNS + "relationship")
         etree.SubElement(relationship, ns.premisBNS + "relationshipType").text = "derivation"
@@ -449,7 +474,10 @@ def create_premis_object_derivations(fileUUID):
 
         elements.append(relationship)
 
-    derivations = Derivation.objects.filter(derived_file_id=fileUUID, event__isnull=False)
+    if _prefetched(fileUUID):
+        derivations = [d for d in prefetch.derivations_to.get(fileUUID, []) if d.event_id is not None]
+    else:
+        derivations = Derivation.objects.filter(derived_file_id=fileUUID, event__isnull=False)
     for derivation in derivations:
         relationship = etree.Element(ns.premisBNS + "relationship")
         etree.SubElement(relationship, ns.premisBNS + "relationshipType").text = "derivation"
@@ -474,7 +502,10 @@ def createDigiprovMD(fileUUID):
     global globalDigiprovMDCounter
     ret = []
 
-    events = Event.objects.filter(file_uuid_id=fileUUID)
+    if _prefetched(fileUUID):
+        events = prefetch.events.get(fileUUID, [])
+    else:
+        events = Event.objects.filter(file_uuid_id=fileUUID)
     for event_record in events:
         globalDigiprovMDCounter += 1
         digiprovMD = etree.Element(ns.metsBNS + "digiprovMD", ID='digiprovMD_' + str(globalDigiprovMDCounter))
@@ -482,9 +513,15 @@ def createDigiprovMD(fileUUID):
 
         mdWrap = etree.SubElement(digiprovMD, ns.metsBNS + "mdWrap", MDTYPE="PREMIS:EVENT")
         xmlData = etree.SubElement(mdWrap, ns.metsBNS + "xmlData")
-        xmlData.append(createEvent(event_record))
+        if _prefetched(fileUUID):
+            xmlData.append(createEvent(event_record, prefetch.event_agents[event_record.id]))
+        else:
+            xmlData.append(createEvent(event_record))
 
-    agents = Agent.objects.filter(event__file_uuid_id=fileUUID).distinct()
+    if _prefetched(fileUUID):
+        agents = prefetch.agents.get(fileUUID, [])
+    else:
+        agents = Agent.objects.filter(event__file_uuid_id=fileUUID).distinct()
     for agent in agents:
         globalDigiprovMDCounter += 1
         digiprovMD = etree.Element(ns.metsBNS + "digiprovMD", ID='digiprovMD_' + str(globalDigiprovMDCounter))
@@ -496,8 +533,10 @@ def createDigiprovMD(fileUUID):
 
     return ret
 
-def createEvent(event_record):
-    """ Returns a PREMIS Event. """
+def createEvent(event_record, agents=None):
+    """ Returns a PREMIS Event. `agents` are the event's linking agents, if already fetched. """
+    if agents is None:
+        agents = event_record.agents.all()
     event = etree.Element(ns.premisBNS + "event", nsmap={'premis': ns.premisNS})
     event.set(ns.xsiBNS + "schemaLocation", ns.premisNS + " http://www.loc.gov/standards/premis/v2/premis-v2-2.xsd")
     event.set("version", "2.2")
@@ -516,7 +555,7 @@ def createEvent(event_record):
     etree.SubElement(eventOutcomeDetail, ns.premisBNS + "eventOutcomeDetailNote").text = escape(event_record.event_outcome_detail)
 
     # linkingAgentIdentifier
-    for agent in event_record.agents.all():
+    for agent in agents:
         linkingAgentIdentifier = etree.SubElement(event, ns.premisBNS + "linkingAgentIdentifier")
         etree.SubElement(linkingAgentIdentifier, ns.premisBNS + "linkingAgentIdentifierType").text = agent.identifiertype
         etree.SubElement(linkingAgentIdentifier, ns.premisBNS + "linkingAgentIdentifierValue").text = agent.identifiervalue
@@ -566,6 +605,9 @@ def getAMDSec(fileUUID, filePath, use, type, sip_uuid, transferUUID, itemdirecto
 
     if use == "original":
         metadataAppliesToList = [(fileUUID, FileMetadataAppliesToType), (sip_uuid, SIPMetadataAppliesToType), (transferUUID, TransferMetadataAppliesToType)]
+        if _prefetched(fileUUID):
+            # Only look up the rights of those that have any
+            metadataAppliesToList = [m for m in metadataAppliesToList if prefetch.has_rights(*m)]
         for a in archivematicaGetRights(metadataAppliesToList, fileUUID):
             globalRightsMDCounter +=1
             rightsMD = etree.SubElement(AMD, ns.metsBNS + "rightsMD")
@@ -672,6 +714,14 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
     if DMDIDS:
         structMapDiv.set("DMDID", DMDIDS)
 
+    if prefetch is not None and includeAmdSec:
+        # Fetch the characterization output of this directory's files at once
+        uuids = []
+        for item in directoryContents:
+            location = os.path.join(directoryPath, item).replace(baseDirectoryPath, baseDirectoryName, 1)
+            uuids.extend(f.uuid for f in prefetch.files.get(location, []))
+        prefetch.load_characterization(uuids)
+
     for item in directoryContents:
         itemdirectoryPath = os.path.join(directoryPath, item)
         if os.path.isdir(itemdirectoryPath):
@@ -684,10 +734,12 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
             kwargs = {
                 "removedtime__isnull": True,
                 fileGroupType: fileGroupIdentifier,
-                "currentlocation": directoryPathSTR
             }
             try:
-                f = File.objects.get(**kwargs)
+                if prefetch is not None:
+                    f = prefetch.get_file(directoryPathSTR)
+                else:
+                    f = File.objects.at_location(directoryPathSTR).get(**kwargs)
             except File.DoesNotExist:
                 print("No uuid for file: \"", directoryPathSTR, "\"", file=sys.stderr)
                 sharedVariablesAcrossModules.globalErrorCount += 1
@@ -713,7 +765,6 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
 
                 trimAmdSec = etree.Element(ns.metsBNS + "amdSec")
                 globalAmdSecCounter += 1
-                amdSecs.append(trimAmdSec)
                 ID = "amdSec_" + globalAmdSecCounter.__str__()
                 trimAmdSec.set("ID", ID)
 
@@ -722,6 +773,7 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
                 digiprovMD.set("ID", "digiprovMD_" + str(globalDigiprovMDCounter))
 
                 trimAmdSec.append(digiprovMD)
+                amdSecs.append(trimAmdSec)
 
                 trimStructMapObjects.set("ADMID", ID)
 
@@ -774,14 +826,20 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
                     "originallocation__startswith": os.path.dirname(f.originallocation)
                 }
                 try:
-                    original_file = File.objects.get(**kwargs)
+                    if prefetch is not None:
+                        original_file = prefetch.get_original('originallocation', kwargs['originallocation__startswith'])
+                    else:
+                        original_file = File.objects.get(**kwargs)
                     GROUPID = 'Group-' + original_file.uuid
                 except (File.DoesNotExist, File.MultipleObjectsReturned):
                     pass
 
             elif use in ("preservation", "text/ocr"):
                 # Derived files should be in the original file's group
-                d = Derivation.objects.get(derived_file_id=f.uuid)
+                if prefetch is not None:
+                    d = prefetch.get_derivation_to(f.uuid)
+                else:
+                    d = Derivation.objects.get(derived_file_id=f.uuid)
                 GROUPID = "Group-" + d.source_file_id
 
             elif use == "service":
@@ -796,7 +854,10 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
                     "filegrpuse": "original",
                     "currentlocation__startswith": fileFileIDPath
                 }
-                original_file = File.objects.get(**kwargs)
+                if prefetch is not None:
+                    original_file = prefetch.get_original('currentlocation', fileFileIDPath)
+                else:
+                    original_file = File.objects.get(**kwargs)
                 GROUPID = "Group-" + original_file.uuid
 
             elif use == "TRIM container metadata":
@@ -993,34 +1054,6 @@ def create_object_metadata(struct_map, baseDirectoryPath):
 
     return el
 
-
-def write_mets(tree, filename):
-    """
-    Write tree to filename, and a validate METS form.
-
-    :param ElementTree tree: METS ElementTree
-    :param str filename: Filename to write the METS to
-    """
-    tree.write(filename, pretty_print=True, xml_declaration=True)
-
-    import cgi
-    validate_filename = filename + ".validatorTester.html"
-    fileContents = """<html>
-<body>
-  <form method="post" action="http://pim.fcla.edu/validate/results">
-    <label for="document">Enter XML Document:</label>
-    <br/>
-    <textarea id="directinput" rows="12" cols="76" name="document">%s</textarea>
-    <br/>
-    <br/>
-    <input type="submit" value="Validate" />
-    <br/>
-  </form>
-</body>
-</html>""" % (cgi.escape(etree.tostring(tree, pretty_print=True, xml_declaration=True)))
-    with open(validate_filename, 'w') as f:
-        f.write(fileContents)
-
 if __name__ == '__main__':
     logger = get_script_logger("archivematica.mcp.client.createMETS2")
 
@@ -1033,6 +1066,7 @@ if __name__ == '__main__':
     parser.add_option("-t",  "--fileGroupType", action="store", dest="fileGroupType", default="sipUUID") #
     parser.add_option("-x",  "--xmlFile", action="store", dest="xmlFile", default="")
     parser.add_option("-a",  "--amdSec", action="store_true", dest="amdSec", default=False)
+    parser.add_option("--validatorPage", action="store_true", dest="validator_page", default=False)
     (opts, args) = parser.parse_args()
 
     SIP_TYPE = opts.sip_type
@@ -1051,8 +1085,7 @@ if __name__ == '__main__':
             baseDirectoryPath,
             fileGroupIdentifier,
         )
-        tree = etree.ElementTree(root)
-        write_mets(tree, XMLFile)
+        write_mets(root, XMLFile, validator_page=opts.validator_page)
         sys.exit(0)
     # End reingest
 
@@ -1069,6 +1102,8 @@ if __name__ == '__main__':
         except OSError:
             pass
 
+    prefetch = MetadataPrefetch(fileGroupType, fileGroupIdentifier)
+
     structMap = etree.Element(ns.metsBNS + "structMap", TYPE='physical', ID='structMap_1', LABEL="Archivematica default")
     structMapDiv = etree.SubElement(structMap, ns.metsBNS + 'div', TYPE="Directory", LABEL=os.path.basename(baseDirectoryPath.rstrip('/')))
     structMapDivObjects = createFileSec(objectsDirectoryPath, structMapDiv, baseDirectoryPath, baseDirectoryPathString, fileGroupIdentifier, fileGroupType, includeAmdSec)
@@ -1113,9 +1148,6 @@ if __name__ == '__main__':
     for dmdSec in dmdSecs:
         root.append(dmdSec)
 
-    for amdSec in amdSecs:
-        root.append(amdSec)
-
     root.append(fileSec)
     root.append(structMap)
     for structMapIncl in getIncludedStructMap(baseDirectoryPath):
@@ -1133,7 +1165,7 @@ if __name__ == '__main__':
         print("RightsMDs:", globalRightsMDCounter)
         print("DigiprovMDs:", globalDigiprovMDCounter)
 
-    tree = etree.ElementTree(root)
-    write_mets(tree, XMLFile)
+    # The amdSecs were spooled as they were created and go before the fileSec
+    write_mets(root, XMLFile, amdsecs=amdSecs, validator_page=opts.validator_page)
 
     sys.exit(sharedVariablesAcrossModules.globalErrorCount)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python2
+#
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage archivematicaClientScript
+
+"""
+Database rows needed to build the METS of a SIP, loaded in bulk.
+
+Building the fileSec and amdSecs file by file runs dozens of queries per
+file. MetadataPrefetch loads the Files, FileIDs, Derivations, Events and
+agent links of the whole unit up front, in a fixed number of queries, and
+archivematicaCreateMETS2 reads them from memory instead. Characterization
+output, which can be large, is loaded one directory at a time with
+load_characterization(), and dropped once used.
+"""
+
+import bisect
+import collections
+
+# dashboard
+from main.models import Agent, Derivation, Event, File, FileID, FPCommandOutput, RightsStatement
+
+# Files whose characterization output is fetched per query
+CHARACTERIZATION_BATCH_SIZE = 500
+
+Derivation_ = collections.namedtuple('Derivation', ['source_file_id', 'derived_file_id', 'event_id'])
+
+
+def _get_one(model, matches, description):
+    """ Return the only item of matches, raising like QuerySet.get otherwise. """
+    if not matches:
+        raise model.DoesNotExist('No {} with {}'.format(model.__name__, description))
+    if len(matches) > 1:
+        raise model.MultipleObjectsReturned('{} {} with {}'.format(len(matches), model.__name__, description))
+    return matches[0]
+
+
+class MetadataPrefetch(object):
+    """
+    The metadata of the files of the unit where `fileGroupType` (e.g.
+    'sip_id') is `fileGroupIdentifier`.
+    """
+
+    def __init__(self, fileGroupType, fileGroupIdentifier):
+        self.fileGroupType = fileGroupType
+        self.fileGroupIdentifier = fileGroupIdentifier
+
+        # Files that have not been removed, by current location
+        self.files = collections.defaultdict(list)
+        # Any file of the unit, by UUID
+        self.files_by_uuid = {}
+        for f in File.objects.filter(**self._unit()).select_related('transfer'):
+            self.files_by_uuid[f.uuid] = f
+            if f.removedtime is None:
+                self.files[f.currentlocation].append(f)
+
+        # Original files, sorted by current and by original location, to
+        # look them up by prefix
+        originals = [f for f in self.files_by_uuid.values() if f.removedtime is None and f.filegrpuse == 'original']
+        self.originals = {}
+        for field in ('currentlocation', 'originallocation'):
+            originals.sort(key=lambda f: getattr(f, field))
+            self.originals[field] = ([getattr(f, field) for f in originals], list(originals))
+
+        self.format_ids = collections.defaultdict(list)
+        for row in FileID.objects.filter(**self._unit('file__')).order_by('id').values_list(
+                'file_id', 'format_name', 'format_version', 'format_registry_name', 'format_registry_key'):
+            self.format_ids[row[0]].append(row[1:])
+
+        # Derivations from and to the files of the unit
+        derivations = {}
+        for prefix in ('source_file__', 'derived_file__'):
+            rows = Derivation.objects.filter(**self._unit(prefix)).values_list(
+                'id', 'source_file_id', 'derived_file_id', 'event_id')
+            derivations.update((row[0], Derivation_(*row[1:])) for row in rows)
+        self.derivations_from = collections.defaultdict(list)
+        self.derivations_to = collections.defaultdict(list)
+        for pk in sorted(derivations):
+            derivation = derivations[pk]
+            self.derivations_from[derivation.source_file_id].append(derivation)
+            self.derivations_to[derivation.derived_file_id].append(derivation)
+
+        # Agents are few; all of them are loaded
+        agents = {agent.id: agent for agent in Agent.objects.all()}
+        event_agents = collections.defaultdict(list)
+        for event_id, agent_id in Event.agents.through.objects.filter(**self._unit('event__file_uuid__')).order_by('id').values_list('event_id', 'agent_id'):
+            event_agents[event_id].append(agents[agent_id])
+
+        self.events = collections.defaultdict(list)
+        self.event_agents = {}
+        self.agents = {}
+        for event in Event.objects.filter(**self._unit('file_uuid__')).order_by('id'):
+            self.events[event.file_uuid_id].append(event)
+            self.event_agents[event.id] = event_agents.get(event.id, [])
+        for file_uuid, events in self.events.items():
+            file_agents = {agent.id: agent for event in events for agent in self.event_agents[event.id]}
+            self.agents[file_uuid] = [file_agents[pk] for pk in sorted(file_agents)]
+
+        # (identifier, metadataappliestotype) of everything with rights
+        self.rights_holders = set(RightsStatement.objects.values_list(
+            'metadataappliestoidentifier', 'metadataappliestotype_id').distinct())
+
+        self.characterization = collections.defaultdict(list)
+
+    def _unit(self, prefix=''):
+        return {prefix + self.fileGroupType: self.fileGroupIdentifier}
+
+    def get_file(self, currentlocation):
+        """ Return the File at currentlocation, raising like File.objects.get. """
+        return _get_one(File, self.files.get(currentlocation, []), 'current location ' + currentlocation)
+
+    def get_file_by_uuid(self, uuid):
+        try:
+            return self.files_by_uuid[uuid]
+        except KeyError:
+            return File.objects.get(uuid=uuid)
+
+    def get_original(self, field, prefix):
+        """
+        Return the original file whose `field` ('currentlocation' or
+        'originallocation') starts with prefix, raising like
+        File.objects.get.
+        """
+        keys, files = self.originals[field]
+        matches = []
+        for i in xrange(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                break
+            matches.append(files[i])
+        return _get_one(File, matches, '{} starting with {}'.format(field, prefix))
+
+    def get_derivation_to(self, uuid):
+        """ Return the derivation of file uuid, raising like Derivation.objects.get. """
+        return _get_one(Derivation, self.derivations_to.get(uuid, []), 'derived file ' + uuid)
+
+    def load_characterization(self, uuids):
+        """ Load the characterization output of the files with `uuids`. """
+        uuids = list(uuids)
+        for i in xrange(0, len(uuids), CHARACTERIZATION_BATCH_SIZE):
+            rows = FPCommandOutput.objects.filter(
+                file_id__in=uuids[i:i + CHARACTERIZATION_BATCH_SIZE],
+                rule__purpose__in=['characterization', 'default_characterization']
+            ).order_by('id').values_list('file_id', 'content')
+            for file_uuid, content in rows:
+                self.characterization[file_uuid].append(content)
+        for uuid in uuids:
+            self.characterization.setdefault(uuid, [])
+
+    def has_file(self, uuid):
+        """ Whether uuid is a file of the unit, whose metadata was prefetched. """
+        return uuid in self.files_by_uuid
+
+    def get_characterization(self, uuid):
+        """
+        Return the characterization output of file uuid and forget it, or
+        None if it was not loaded.
+        """
+        return self.characterization.pop(uuid, None)
+
+    def has_rights(self, identifier, metadataAppliesToType):
+        return (identifier, metadataAppliesToType) in self.rights_holders
@@ -281,7 +281,7 @@ def add_new_files(mets, sip_uuid, sip_dir):
             if fsentry is None:
                 # If not in METS, get File object and store for later
                 print(rel_path, 'not found in METS, must be new file')
-                f = models.File.objects.get(currentlocation=current_loc, sip_id=sip_uuid)
+                f = models.File.objects.at_location(current_loc).get(sip_id=sip_uuid)
                 new_files.append(f)
                 if rel_path == 'objects/metadata/metadata.csv':
                     metadata_csv = f
@@ -62,7 +62,7 @@ def archivematicaCreateMETSRightsDspaceMDRef(fileUUID, filePath, transferUUID, i
         # Find the mets file. May find none.
         path = "%SIPDirectory%{}/mets.xml".format(os.path.dirname(filePath))
         try:
-            mets = File.objects.get(currentlocation=path, transfer_id=transferUUID)
+            mets = File.objects.at_location(path).get(transfer_id=transferUUID)
         except File.DoesNotExist:
             pass
         else:
@@ -87,7 +87,7 @@ def archivematicaCreateMETSRightsDspaceMDRef(fileUUID, filePath, transferUUID, i
 
             path = "%SIPDirectory%{}/mets.xml".format(fullDir2)
             try:
-                f = File.objects.get(currentlocation=path, transfer_id=transferUUID)
+                f = File.objects.at_location(path).get(transfer_id=transferUUID)
             except File.DoesNotExist:
                 pass
             else:
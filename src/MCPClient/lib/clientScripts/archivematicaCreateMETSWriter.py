@@ -0,0 +1,167 @@
+#!/usr/bin/env python2
+#
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage archivematicaClientScript
+
+"""
+Incremental writing of METS files.
+
+The amdSecs of a large SIP make up most of its METS. SectionSpool writes each
+one to a temporary file as soon as it is created, and write_mets() copies them
+from there into the METS with lxml's xmlfile, so they are never all in memory
+at once.
+"""
+
+import cgi
+import tempfile
+
+from lxml import etree
+
+# archivematicaCommon
+import namespaces as ns
+
+# Prefixes that spooled sections are serialized with, as in the mets:mets root
+SECTION_NSMAP = {
+    'mets': ns.metsNS,
+    'xlink': ns.xlinkNS,
+    'xsi': ns.xsiNS,
+}
+
+# Bytes of the METS read at a time when writing the validator page
+COPY_CHUNK_SIZE = 64 * 1024
+
+VALIDATOR_PAGE_HEAD = """<html>
+<body>
+  <form method="post" action="http://pim.fcla.edu/validate/results">
+    <label for="document">Enter XML Document:</label>
+    <br/>
+    <textarea id="directinput" rows="12" cols="76" name="document">"""
+
+VALIDATOR_PAGE_TAIL = """</textarea>
+    <br/>
+    <br/>
+    <input type="submit" value="Validate" />
+    <br/>
+  </form>
+</body>
+</html>"""
+
+
+class SectionSpool(object):
+    """
+    METS sections kept in a temporary file rather than in memory.
+
+    Sections are serialized when they are appended, so they must be complete
+    by then. Iterating reads them back in order; no more can be appended
+    afterwards.
+
+    Sections built without an nsmap, like those of archivematicaCreateMETS2,
+    are serialized under the prefixes in nsmap rather than generated ones.
+    """
+
+    def __init__(self, nsmap=SECTION_NSMAP):
+        self._holder = etree.Element(ns.metsBNS + 'sections', nsmap=nsmap)
+        self._file = None
+        self._closed = False
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, element):
+        if self._closed:
+            raise ValueError('Sections cannot be added once they have been read')
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+            self._file.write('<sections>')
+        if element.getparent() is None:
+            # Parented under the holder, the section reuses its prefixes
+            self._holder.append(element)
+            try:
+                self._file.write(etree.tostring(element, with_tail=False))
+            finally:
+                self._holder.remove(element)
+        else:
+            self._file.write(etree.tostring(element, with_tail=False))
+        self._count += 1
+
+    def __iter__(self):
+        """
+        Yield the sections as Elements. Each one is cleared when the next one
+        is read, so it must not be used afterwards.
+        """
+        if self._file is None:
+            return
+        if not self._closed:
+            self._file.write('</sections>')
+            self._closed = True
+        self._file.seek(0)
+        context = etree.iterparse(self._file, events=('end',), huge_tree=True)
+        for _, element in context:
+            parent = element.getparent()
+            if parent is None or parent.getparent() is not None:
+                continue
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+        del context
+
+
+def write_mets(root, filename, amdsecs=(), validator_page=False):
+    """
+    Write the METS to filename, one top-level section at a time.
+
+    :param Element root: mets:mets Element
+    :param amdsecs: amdSecs to write before the fileSec, besides those in root, e.g. a SectionSpool
+    :param bool validator_page: If True, also write a form to submit the METS to the FCLA validator, to filename + ".validatorTester.html"
+    """
+    with open(filename, 'wb') as f:
+        with etree.xmlfile(f, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap):
+                xf.write('\n')
+                for section in root:
+                    if section.tag == ns.metsBNS + 'fileSec':
+                        _write_sections(xf, amdsecs)
+                        amdsecs = ()
+                    xf.write(section, pretty_print=True)
+                _write_sections(xf, amdsecs)
+
+    if validator_page:
+        write_validator_page(filename)
+
+
+def _write_sections(xf, sections):
+    for section in sections:
+        xf.write(section, pretty_print=True)
+
+
+def write_validator_page(filename):
+    """
+    Write a form to submit the METS in filename to the FCLA validator, to
+    filename + ".validatorTester.html".
+    """
+    with open(filename, 'rb') as mets, open(filename + '.validatorTester.html', 'wb') as page:
+        page.write(VALIDATOR_PAGE_HEAD)
+        for chunk in iter(lambda: mets.read(COPY_CHUNK_SIZE), ''):
+            # Escaping is done character by character, so chunks can be escaped separately
+            page.write(cgi.escape(chunk))
+        page.write(VALIDATOR_PAGE_TAIL)
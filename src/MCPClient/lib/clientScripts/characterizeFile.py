@@ -86,10 +86,14 @@ def main(file_path, file_uuid, sip_uuid):
     else:
         return 0
 
+
+def call(args):
+    file_path = args[0]
+    file_uuid = args[1]
+    sip_uuid = args[2]
+    return main(file_path, file_uuid, sip_uuid)
+
+
 if __name__ == '__main__':
     logger = get_script_logger("archivematica.mcp.client.characterizeFile")
-
-    file_path = sys.argv[1]
-    file_uuid = sys.argv[2]
-    sip_uuid = sys.argv[3]
-    sys.exit(main(file_path, file_uuid, sip_uuid))
+    sys.exit(call(sys.argv[1:]))
@@ -57,9 +57,8 @@ def something(SIPDirectory, serviceDirectory, objectsDirectory, SIPUUID, date):
                 file2Full = os.path.join(path, file[:a]).replace(SIPDirectory + "objects/service/", "%SIPDirectory%objects/", 1) #service
             accessPath = os.path.join(path, file)
 
-            f = File.objects.get(currentlocation=file1Full,
-                                 removedtime__isnull=True,
-                                 sip_id=SIPUUID)
+            f = File.objects.at_location(file1Full).get(removedtime__isnull=True,
+                                                        sip_id=SIPUUID)
             f.filegrpuse = "service"
 
             grp_file = File.objects.get(currentlocation__startswith=file2Full,
@@ -89,9 +88,8 @@ def regular(SIPDirectory, objectsDirectory, SIPUUID, date):
                 file2Full = os.path.join(path, file2).replace(SIPDirectory, "%SIPDirectory%", 1) #original
                 accessPath = os.path.join(path, file)
 
-                f = File.objects.get(currentlocation=file1Full,
-                                     removedtime__isnull=True,
-                                     sip_id=SIPUUID)
+                f = File.objects.at_location(file1Full).get(removedtime__isnull=True,
+                                                            sip_id=SIPUUID)
                 f.filegrpuse = "service"
 
                 grp_file = File.objects.get(currentlocation__startswith=file2Full,
@@ -21,7 +21,6 @@
 # @subpackage archivematicaClientScript
 # @author Joseph Perry <joseph@artefactual.com>
 from optparse import OptionParser
-import uuid
 
 import django
 django.setup()
@@ -29,7 +28,7 @@ django.setup()
 from main.models import File
 
 # archivematicaCommon
-from databaseFunctions import insertIntoEvents
+from databaseFunctions import bulkInsertIntoEvents
 
 
 if __name__ == '__main__':
@@ -50,12 +49,11 @@ if __name__ == '__main__':
         "removedtime__isnull": True,
         opts.groupType: opts.groupUUID
     }
-    file_uuids = File.objects.filter(**kwargs).values_list('uuid')
-    for fileUUID, in file_uuids:
-        insertIntoEvents(fileUUID=fileUUID, \
-                     eventIdentifierUUID=str(uuid.uuid4()), \
-                     eventType=opts.eventType, \
-                     eventDateTime=opts.eventDateTime, \
-                     eventDetail=opts.eventDetail, \
-                     eventOutcome=opts.eventOutcome, \
-                     eventOutcomeDetailNote=opts.eventOutcomeDetailNote)
+    file_uuids = File.objects.filter(**kwargs).values_list('uuid', flat=True)
+    bulkInsertIntoEvents({'fileUUID': fileUUID,
+                          'eventType': opts.eventType,
+                          'eventDateTime': opts.eventDateTime,
+                          'eventDetail': opts.eventDetail,
+                          'eventOutcome': opts.eventOutcome,
+                          'eventOutcomeDetailNote': opts.eventOutcomeDetailNote}
+                         for fileUUID in file_uuids.iterator())
@@ -29,7 +29,7 @@ import shutil
 import django
 django.setup()
 # dashboard
-from main.models import Job, SIP
+from main.models import Job, SIP, UnitStatus
 
 # archivematicaCommon
 from custom_handlers import get_script_logger
@@ -75,3 +75,4 @@ if __name__ == '__main__':
                            currentstep="Completed successfully",
                            unittype="unitSIP",
                            microservicegroup="Upload DIP")
+        UnitStatus.objects.refresh(originalSIPUUID)
@@ -60,7 +60,7 @@ def identify_dspace_files(mets_file, transfer_dir, transfer_uuid, relative_dir="
                 print('Unexpected usage', use, file=sys.stderr)
                 continue
 
-            File.objects.filter(currentlocation=db_location, transfer_id=transfer_uuid).update(filegrpuse=db_use)
+            File.objects.at_location(db_location).filter(transfer_id=transfer_uuid).update(filegrpuse=db_use)
 
 
 if __name__ == '__main__':
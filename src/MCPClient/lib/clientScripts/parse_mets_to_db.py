@@ -3,7 +3,6 @@
 from __future__ import print_function
 import argparse
 import datetime
-from lxml import etree
 import sys
 import os
 import uuid
@@ -15,6 +14,7 @@ from main import models
 from fpr import models as fpr_models
 
 # archivematicaCommon
+from mets_reader import METSReader, file_records
 import namespaces as ns
 import fileOperations
 import databaseFunctions
@@ -48,70 +48,73 @@ def parse_format_version(element):
 
 
 def parse_files(root):
-    filesec = root.find('.//mets:fileSec', namespaces=ns.NSMAP)
-    files = []
-
-    for fe in filesec.findall('.//mets:file', namespaces=ns.NSMAP):
-        filegrpuse = fe.getparent().get('USE')
-        print('filegrpuse', filegrpuse)
-
-        amdid = fe.get('ADMID')
-        print('amdid', amdid)
-        current_techmd = root.xpath('mets:amdSec[@ID="' + amdid + '"]/mets:techMD[not(@STATUS="superseded")]', namespaces=ns.NSMAP)[0]
-
-        file_uuid = current_techmd.findtext('.//premis:objectIdentifierValue', namespaces=ns.NSMAP)
-        print('file_uuid', file_uuid)
-
-        original_path = current_techmd.findtext('.//premis:originalName', namespaces=ns.NSMAP)
-        original_path = original_path.replace('%transferDirectory%', '%SIPDirectory%')
-        print('original_path', original_path)
-
-        current_path = fe.find('mets:FLocat', namespaces=ns.NSMAP).get(ns.xlinkBNS+'href')
-        current_path = '%SIPDirectory%' + current_path
-        print('current_path', current_path)
-
-        checksum = current_techmd.findtext('.//premis:messageDigest', namespaces=ns.NSMAP)
-        print('checksum', checksum)
-
-        checksumtype = current_techmd.findtext('.//premis:messageDigestAlgorithm', namespaces=ns.NSMAP)
-        print('checksumtype', checksumtype)
-
-        size = current_techmd.findtext('.//premis:size', namespaces=ns.NSMAP)
-        print('size', size)
-
-        # FormatVersion
-        format_version = parse_format_version(current_techmd)
-        print('format_version', format_version)
-
-        # Derivation
-        derivation = derivation_event = None
-        event = current_techmd.findtext('.//premis:relatedEventIdentifierValue', namespaces=ns.NSMAP)
-        print('derivation event', event)
-        related_uuid = current_techmd.findtext('.//premis:relatedObjectIdentifierValue', namespaces=ns.NSMAP)
-        print('related_uuid', related_uuid)
-        rel = current_techmd.findtext('.//premis:relationshipSubType', namespaces=ns.NSMAP)
-        print('relationship', rel)
-        if rel == 'is source of':
-            derivation = related_uuid
-            derivation_event = event
-
-        file_info = {
-            'uuid': file_uuid,
-            'original_path': original_path,
-            'current_path': current_path,
-            'use': filegrpuse,
-            'checksum': checksum,
-            'checksumtype': checksumtype,
-            'size': size,
-            'format_version': format_version,
-            'derivation': derivation,
-            'derivation_event': derivation_event,
-        }
+    return [parse_file(mets_file) for mets_file in file_records(root)]
+
 
-        files.append(file_info)
-        print()
+def parse_file(mets_file):
+    """
+    Parse the information about a file needed by later microservices.
 
-    return files
+    :param mets_file: mets_reader.METSFile of the file.
+    :return: Dict of file info.
+    """
+    filegrpuse = mets_file.use
+    print('filegrpuse', filegrpuse)
+
+    amdid = mets_file.admid
+    print('amdid', amdid)
+    current_techmd = mets_file.current_techmd
+
+    file_uuid = current_techmd.findtext('.//premis:objectIdentifierValue', namespaces=ns.NSMAP)
+    print('file_uuid', file_uuid)
+
+    original_path = current_techmd.findtext('.//premis:originalName', namespaces=ns.NSMAP)
+    original_path = original_path.replace('%transferDirectory%', '%SIPDirectory%')
+    print('original_path', original_path)
+
+    current_path = '%SIPDirectory%' + mets_file.path
+    print('current_path', current_path)
+
+    checksum = current_techmd.findtext('.//premis:messageDigest', namespaces=ns.NSMAP)
+    print('checksum', checksum)
+
+    checksumtype = current_techmd.findtext('.//premis:messageDigestAlgorithm', namespaces=ns.NSMAP)
+    print('checksumtype', checksumtype)
+
+    size = current_techmd.findtext('.//premis:size', namespaces=ns.NSMAP)
+    print('size', size)
+
+    # FormatVersion
+    format_version = parse_format_version(current_techmd)
+    print('format_version', format_version)
+
+    # Derivation
+    derivation = derivation_event = None
+    event = current_techmd.findtext('.//premis:relatedEventIdentifierValue', namespaces=ns.NSMAP)
+    print('derivation event', event)
+    related_uuid = current_techmd.findtext('.//premis:relatedObjectIdentifierValue', namespaces=ns.NSMAP)
+    print('related_uuid', related_uuid)
+    rel = current_techmd.findtext('.//premis:relationshipSubType', namespaces=ns.NSMAP)
+    print('relationship', rel)
+    if rel == 'is source of':
+        derivation = related_uuid
+        derivation_event = event
+
+    file_info = {
+        'uuid': file_uuid,
+        'original_path': original_path,
+        'current_path': current_path,
+        'use': filegrpuse,
+        'checksum': checksum,
+        'checksumtype': checksumtype,
+        'size': size,
+        'format_version': format_version,
+        'derivation': derivation,
+        'derivation_event': derivation_event,
+    }
+
+    print()
+    return file_info
 
 
 def update_files(sip_uuid, files):
@@ -232,6 +235,20 @@ def parse_rights(sip_uuid, root):
     :param root: root Element of the METS file.
     :return: List of RightsStatement objects for the parsed entries. Maybe be empty
     """
+    amds = root.xpath('mets:amdSec/mets:rightsMD/parent::*', namespaces=ns.NSMAP)
+    return parse_amdsec_rights(sip_uuid, amds[0] if amds else None)
+
+
+def parse_amdsec_rights(sip_uuid, amd):
+    """
+    Parse the PREMIS:RIGHTS metadata of an amdSec into the database.
+
+    Deletes existing entries associated with this SIP.
+
+    :param str sip_uuid: UUID of the SIP to parse the metadata for.
+    :param amd: amdSec Element with the rightsMDs of the SIP, or None.
+    :return: List of RightsStatement objects for the parsed entries. Maybe be empty
+    """
     # Delete existing PREMIS Rights
     del_rights = models.RightsStatement.objects.filter(metadataappliestoidentifier=sip_uuid, metadataappliestotype_id=MD_TYPE_SIP_ID)
     # TODO delete all the other rights things?
@@ -244,9 +261,7 @@ def parse_rights(sip_uuid, root):
     del_rights.delete()
 
     parsed_rights = []
-    amds = root.xpath('mets:amdSec/mets:rightsMD/parent::*', namespaces=ns.NSMAP)
-    if amds:
-        amd = amds[0]
+    if amd is not None:
         # Get rightsMDs
         # METS from original AIPs will not have @STATUS, and reingested AIPs will have only one @STATUS that is 'current'
         rights_stmts = amd.xpath('mets:rightsMD[not(@STATUS) or @STATUS="current"]/mets:mdWrap[@MDTYPE="PREMIS:RIGHTS"]/*/premis:rightsStatement', namespaces=ns.NSMAP)
@@ -437,14 +452,16 @@ def main(sip_uuid, sip_path):
 
     # Parse METS to extract information needed by later microservices
     mets_path = os.path.join(sip_path, 'metadata', 'submissionDocumentation', 'METS.' + sip_uuid + '.xml')
-    root = etree.parse(mets_path)
+    # The amdSecs are read one at a time, as the METS of a large AIP may not
+    # fit in memory
+    mets = METSReader(mets_path)
 
-    files = parse_files(root)
+    files = [parse_file(mets_file) for mets_file in mets.files()]
     update_files(sip_uuid, files)
 
-    parse_dc(sip_uuid, root)
+    parse_dc(sip_uuid, mets.tree)
 
-    parse_rights(sip_uuid, root)
+    parse_amdsec_rights(sip_uuid, mets.find_amdsec('mets:rightsMD'))
 
 
 if __name__ == '__main__':
@@ -113,7 +113,8 @@ def post_store_hook(sip_uuid):
                 user_email='archivematica system',
                 reason_for_deletion='All files in Transfer are now in AIPs.'
             )
-            elasticSearchFunctions.remove_transfer_files(client, transfer_uuid)
+            deleted = elasticSearchFunctions.remove_transfer_files(client, transfer_uuid)
+            print('Removed', deleted, 'files of transfer', transfer_uuid, 'from the transfer backlog index')
 
     # DSPACE HANDLE TO ARCHIVESSPACE
     dspace_handle_to_archivesspace(sip_uuid)
@@ -28,13 +28,10 @@ import uuid
 
 import django
 django.setup()
-# dashboard
-from main.models import File
 
 # archivematicaCommon
 from custom_handlers import get_script_logger
-from fileOperations import updateFileLocation
-from archivematicaFunctions import unicodeToStr
+from fileOperations import updateFileLocation, updateLocationPrefix
 import sanitizeNames
 
 if __name__ == '__main__':
@@ -74,25 +71,10 @@ if __name__ == '__main__':
         elif os.path.isdir(newfile):
             oldfile = oldfile.replace(objectsDirectory, relativeReplacement, 1) + "/"
             newfile = newfile.replace(objectsDirectory, relativeReplacement, 1) + "/"
-            directoryContents = []
-
-            kwargs = {
-                "removedtime__isnull": True,
-                "currentlocation__startswith": oldfile,
-                groupSQL: groupID
-            }
-            files = File.objects.filter(**kwargs)
 
             print(oldfile, " -> ", newfile)
 
-            for f in files:
-                new_path = unicodeToStr(f.currentlocation).replace(oldfile, newfile, 1)
-                updateFileLocation(f.currentlocation,
-                                   new_path,
-                                   fileUUID=f.uuid,
-                                   # Don't create sanitization events for each
-                                   # file, since it's only a parent directory
-                                   # somewhere up that changed.
-                                   # Otherwise, extra amdSecs will be generated
-                                   # from the resulting METS.
-                                   createEvent=False)
+            # No sanitization events are created for the files, since it's
+            # only a parent directory somewhere up that changed.
+            # Otherwise, extra amdSecs will be generated from the resulting METS.
+            updateLocationPrefix(oldfile, newfile, groupID, groupSQL)
@@ -42,6 +42,8 @@ date = sys.argv[4]
 
 currentDirectory = ''
 exitCode = 0
+# Fixity check events, created once every file has been checked
+events = []
 
 for transfer_dir in os.listdir(transferPath):
     dirPath = os.path.join(transferPath, transfer_dir)
@@ -80,17 +82,19 @@ for transfer_dir in os.listdir(transferPath):
                 eventOutcomeDetailNote = '%s %s' % (xmlFile.__str__(), 'verified')
                 eventIdentifierUUID = uuid.uuid4().__str__()
 
-                databaseFunctions.insertIntoEvents(
-                    fileUUID=fileUUID,
-                    eventIdentifierUUID=eventIdentifierUUID,
-                    eventType='fixity check',
-                    eventDateTime=date,
-                    eventOutcome=eventOutcome,
-                    eventOutcomeDetailNote=eventOutcomeDetailNote,
-                    eventDetail=eventDetail
-                )
+                events.append({
+                    'fileUUID': fileUUID,
+                    'eventIdentifierUUID': eventIdentifierUUID,
+                    'eventType': 'fixity check',
+                    'eventDateTime': date,
+                    'eventOutcome': eventOutcome,
+                    'eventOutcomeDetailNote': eventOutcomeDetailNote,
+                    'eventDetail': eventDetail,
+                })
         else:
             print('Checksum mismatch: ', filePath.replace(transferPath, '%TransferDirectory%'), file=sys.stderr)
             exitCode += 1
 
+databaseFunctions.bulkInsertIntoEvents(events)
+
 quit(exitCode)
@@ -33,7 +33,7 @@ from main.models import File
 from archivematicaFunctions import REQUIRED_DIRECTORIES, OPTIONAL_FILES
 from custom_handlers import get_script_logger
 import fileOperations
-from databaseFunctions import insertIntoEvents
+from databaseFunctions import bulkInsertIntoEvents
 
 from verifyBAG import verify_bag
 
@@ -102,11 +102,11 @@ if __name__ == '__main__':
 
     files = File.objects.filter(removedtime__isnull=True,
                                 transfer_id=transferUUID,
-                                currentlocation__startswith="%transferDirectory%objects/").values_list('uuid')
-    for uuid, in files:
-        insertIntoEvents(fileUUID=uuid,
-                         eventType="fixity check",
-                         eventDetail="Bagit - verifypayloadmanifests",
-                         eventOutcome="Pass")
+                                currentlocation__startswith="%transferDirectory%objects/").values_list('uuid', flat=True)
+    bulkInsertIntoEvents({'fileUUID': uuid,
+                          'eventType': "fixity check",
+                          'eventDetail': "Bagit - verifypayloadmanifests",
+                          'eventOutcome': "Pass"}
+                         for uuid in files.iterator())
 
     sys.exit(exitCode)
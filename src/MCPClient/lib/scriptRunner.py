@@ -0,0 +1,161 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPClient
+
+"""
+Runs Python client scripts inside already running interpreters.
+
+A client script that can be run this way provides a ``call(args)`` function,
+which takes the command line arguments (without the program name) and returns
+the exit code, the same way ``sys.exit(main(...))`` does when the script is
+run on its own. Anything it prints is captured as the task's output.
+"""
+
+from __future__ import print_function
+import imp
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import traceback
+
+from django_mysqlpool import auto_close_db
+
+logger = logging.getLogger('archivematica.mcp.client')
+
+# Client scripts already imported in this process, by path
+_modules = {}
+
+
+class _Output(object):
+    """Collects what is written to stdout or stderr, as UTF-8 bytes."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+def _load_script(script):
+    module = _modules.get(script)
+    if module is None:
+        name = os.path.splitext(os.path.basename(script))[0]
+        module = imp.load_source(name, script)
+        _modules[script] = module
+    return module
+
+
+@auto_close_db
+def run_script(script, args):
+    """
+    Run the call() function of the client script at path `script`.
+
+    Returns (exitCode, stdOut, stdError) like executeOrRun, or None if the
+    script does not provide call() and has to be run as a command instead.
+    """
+    stdout, stderr = _Output(), _Output()
+    saved = sys.stdout, sys.stderr, sys.argv
+    sys.stdout, sys.stderr, sys.argv = stdout, stderr, [script] + list(args)
+    try:
+        module = _load_script(script)
+        if not hasattr(module, 'call'):
+            return None
+        exit_code = module.call(list(args))
+    except SystemExit as e:
+        exit_code = e.code
+    except Exception:
+        # An uncaught exception exits the interpreter with status 1
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout, sys.stderr, sys.argv = saved
+
+    if exit_code is None:
+        exit_code = 0
+    elif not isinstance(exit_code, (int, long)):
+        stderr.write(str(exit_code) + '\n')
+        exit_code = 1
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+def _init_worker(lib_paths):
+    # Interrupts are handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for path in lib_paths:
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+class ScriptRunner(object):
+    """
+    Pool of worker processes running client scripts with run_script().
+
+    Each process imports Django and the client scripts once, and keeps its
+    database connection pool, so running a script costs a function call
+    rather than starting an interpreter. Scripts are run in separate
+    processes rather than on the calling thread because they write to
+    sys.stdout, which is shared by every thread of a process.
+
+    The pool has to be created before the calling process opens any database
+    connection, as those must not be shared with the forked workers.
+
+    With no processes, scripts are run in the calling process instead, which
+    is only safe when that process runs one task at a time.
+    """
+
+    def __init__(self, processes, lib_paths=()):
+        if processes:
+            self.pool = multiprocessing.Pool(
+                processes,
+                initializer=_init_worker,
+                initargs=(list(lib_paths),))
+        else:
+            self.pool = None
+            for path in lib_paths:
+                if path not in sys.path:
+                    sys.path.append(path)
+
+    def run(self, script, args):
+        if self.pool is None:
+            return run_script(script, args)
+        return self.pool.apply(run_script, (script, args))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
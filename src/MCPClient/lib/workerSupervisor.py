@@ -0,0 +1,217 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPClient
+
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+
+logger = logging.getLogger('archivematica.mcp.client')
+
+STARTING, IDLE, BUSY = 0, 1, 2
+STATE_NAMES = {STARTING: 'starting', IDLE: 'idle', BUSY: 'busy'}
+
+# Seconds a worker has to stay up for its exit not to count as a crash loop
+MIN_UPTIME = 10
+MAX_RESTART_DELAY = 60
+
+
+def get_rss():
+    """Return the resident set size of the current process, in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        # Peak rather than current usage, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class WorkerState(object):
+    """
+    State of one worker process slot, shared between the worker and the
+    supervisor.
+
+    The worker calls task_started() and task_finished() around every task,
+    and stops taking tasks once `retiring` is set.
+    """
+
+    def __init__(self, number, max_tasks=0, max_memory=0):
+        self.number = number
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.crashes = 0
+        self.restart_at = None
+        self.retiring = False
+        self._state = multiprocessing.RawValue('i', STARTING)
+        self._tasks = multiprocessing.RawValue('i', 0)
+        self._since = multiprocessing.RawValue('d', time.time())
+
+    def reset(self):
+        self.retiring = False
+        self._set(STARTING)
+        self._tasks.value = 0
+
+    def _set(self, state):
+        self._state.value = state
+        self._since.value = time.time()
+
+    def ready(self):
+        self._set(IDLE)
+
+    def task_started(self):
+        self._set(BUSY)
+
+    def task_finished(self):
+        self._tasks.value += 1
+        self._set(IDLE)
+        if self.max_tasks and self._tasks.value >= self.max_tasks:
+            logger.info('Worker %d completed %d tasks; recycling it', self.number, self._tasks.value)
+            self.retiring = True
+        elif self.max_memory:
+            rss = get_rss()
+            if rss > self.max_memory:
+                logger.info('Worker %d is using %d MiB; recycling it', self.number, rss / 2 ** 20)
+                self.retiring = True
+
+    def status(self):
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            'worker': self.number,
+            'pid': self.process.pid if alive else None,
+            'state': STATE_NAMES[self._state.value] if alive else 'stopped',
+            'since': self._since.value,
+            'tasks': self._tasks.value,
+            'restarts': self.restarts,
+        }
+
+
+def _run_worker(target, state):
+    # The supervisor handles interrupts and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target(state)
+
+
+def _exit(signum, frame):
+    sys.exit(0)
+
+
+class WorkerSupervisor(object):
+    """
+    Runs `target(state)` in `processes` pre-forked worker processes.
+
+    A worker that exits is replaced: straight away if it exited cleanly,
+    which is how workers are recycled after `max_tasks` tasks or once their
+    resident memory grows over `max_memory` bytes, or after an increasing
+    delay if it crashed soon after starting. The busy or idle state of every
+    worker is available from status(), and is written as JSON to
+    `status_file` if set.
+    """
+
+    def __init__(self, target, processes, max_tasks=0, max_memory=0, status_file=None, interval=1):
+        self.target = target
+        self.status_file = status_file
+        self.interval = interval
+        self.run = False
+        self.workers = [WorkerState(i + 1, max_tasks, max_memory) for i in range(processes)]
+
+    def start(self):
+        for state in self.workers:
+            self._spawn(state)
+
+    def _spawn(self, state):
+        state.reset()
+        state.restart_at = None
+        state.process = multiprocessing.Process(
+            target=_run_worker,
+            args=(self.target, state),
+            name='MCPClientWorker-%d' % state.number)
+        state.process.start()
+        state.started = time.time()
+        logger.info('Started worker %d (pid %d)', state.number, state.process.pid)
+
+    def check(self):
+        """Replace the workers that have exited."""
+        now = time.time()
+        for state in self.workers:
+            if state.restart_at is not None:
+                if now >= state.restart_at:
+                    self._spawn(state)
+                continue
+            if state.process.is_alive():
+                continue
+            exitcode = state.process.exitcode
+            state.restarts += 1
+            if exitcode == 0:
+                state.crashes = 0
+                self._spawn(state)
+                continue
+            logger.error('Worker %d (pid %d) exited with code %s', state.number, state.process.pid, exitcode)
+            if now - state.started < MIN_UPTIME:
+                state.crashes += 1
+            else:
+                state.crashes = 0
+            delay = min(2 ** state.crashes - 1, MAX_RESTART_DELAY)
+            if delay:
+                logger.warning('Restarting worker %d in %d seconds', state.number, delay)
+            state.restart_at = now + delay
+
+    def status(self):
+        return [state.status() for state in self.workers]
+
+    def write_status(self):
+        path = self.status_file
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.status(), f)
+        os.rename(tmp, path)
+
+    def supervise(self):
+        """Watch over the workers until stop() is called."""
+        # Stop the workers along with the supervisor when it is terminated
+        signal.signal(signal.SIGTERM, _exit)
+        self.run = True
+        while self.run:
+            self.check()
+            if self.status_file:
+                try:
+                    self.write_status()
+                except (IOError, OSError):
+                    logger.exception('Unable to write worker status to %s', self.status_file)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.run = False
+        for state in self.workers:
+            if state.process is not None and state.process.is_alive():
+                state.process.terminate()
+        for state in self.workers:
+            if state.process is not None:
+                state.process.join()
@@ -14,6 +14,7 @@ sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib/clientScripts')))
 import archivematicaCreateMETS2
 import archivematicaCreateMETSMetadataCSV
 import archivematicaCreateMETSRights
+from archivematicaCreateMETSPrefetch import MetadataPrefetch
 
 from main.models import RightsStatement
 
@@ -492,6 +493,20 @@ class TestCreateDigiprovMD(TestCase):
         assert ret[8].find('.//{info:lc/xmlns/premis-v2}agentName').text == 'username="kmindelan", first_name="Keladry", last_name="Mindelan"'
         assert ret[8].find('.//{info:lc/xmlns/premis-v2}agentType').text == 'Archivematica user'
 
+    def test_creates_events_from_prefetched_metadata(self):
+        """ It should create the same Events and Agents from a MetadataPrefetch. """
+        file_uuid = "ae8d4290-fe52-4954-b72a-0f591bee2e2f"
+        archivematicaCreateMETS2.globalDigiprovMDCounter = 0
+        expected = [etree.tostring(e) for e in archivematicaCreateMETS2.createDigiprovMD(file_uuid)]
+        archivematicaCreateMETS2.globalDigiprovMDCounter = 0
+        archivematicaCreateMETS2.prefetch = MetadataPrefetch('sip_id', '4060ee97-9c3f-4822-afaf-ebdf838284c3')
+        try:
+            with self.assertNumQueries(0):
+                ret = archivematicaCreateMETS2.createDigiprovMD(file_uuid)
+        finally:
+            archivematicaCreateMETS2.prefetch = None
+        assert [etree.tostring(e) for e in ret] == expected
+
 class TestRights(TestCase):
     """ Test archivematicaCreateMETSRights creating rightsMD. """
 
@@ -0,0 +1,85 @@
+import os
+import sys
+
+from lxml import etree
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib/clientScripts')))
+import archivematicaCreateMETSWriter
+
+import namespaces as ns
+
+
+def mets_root():
+    root = etree.Element(ns.metsBNS + 'mets', nsmap={'mets': ns.metsNS, 'xlink': ns.xlinkNS})
+    etree.SubElement(root, ns.metsBNS + 'metsHdr')
+    etree.SubElement(root, ns.metsBNS + 'dmdSec', ID='dmdSec_1')
+    etree.SubElement(root, ns.metsBNS + 'fileSec')
+    etree.SubElement(root, ns.metsBNS + 'structMap', ID='structMap_1')
+    return root
+
+
+def amdsec(number):
+    amdsec = etree.Element(ns.metsBNS + 'amdSec', ID='amdSec_{}'.format(number), nsmap={'mets': ns.metsNS})
+    techmd = etree.SubElement(amdsec, ns.metsBNS + 'techMD')
+    techmd.text = u'caf\xe9 & <{}>'.format(number)
+    return amdsec
+
+
+def test_spooled_sections_are_read_back_in_order():
+    spool = archivematicaCreateMETSWriter.SectionSpool()
+    assert list(spool) == []
+    for number in range(1, 4):
+        spool.append(amdsec(number))
+    assert len(spool) == 3
+    read = [(s.get('ID'), s[0].text) for s in spool]
+    assert read == [('amdSec_{}'.format(n), u'caf\xe9 & <{}>'.format(n)) for n in range(1, 4)]
+    # Sections can be read again, but not added to
+    assert len(list(spool)) == 3
+    try:
+        spool.append(amdsec(4))
+    except ValueError:
+        pass
+    else:
+        assert False, 'Expected ValueError'
+
+
+def test_amdsecs_are_written_before_the_filesec(tmpdir):
+    spool = archivematicaCreateMETSWriter.SectionSpool()
+    for number in range(1, 3):
+        spool.append(amdsec(number))
+    path = str(tmpdir.join('METS.xml'))
+    archivematicaCreateMETSWriter.write_mets(mets_root(), path, amdsecs=spool)
+
+    root = etree.parse(path).getroot()
+    assert [etree.QName(e).localname + (e.get('ID') or '') for e in root] == [
+        'metsHdr', 'dmdSecdmdSec_1', 'amdSecamdSec_1', 'amdSecamdSec_2', 'fileSec', 'structMapstructMap_1']
+    assert root.find('mets:amdSec/mets:techMD', namespaces=ns.NSMAP).text == u'caf\xe9 & <1>'
+    assert not os.path.exists(path + '.validatorTester.html')
+
+
+def test_validator_page(tmpdir):
+    path = str(tmpdir.join('METS.xml'))
+    archivematicaCreateMETSWriter.write_mets(mets_root(), path, amdsecs=[amdsec(1)], validator_page=True)
+    with open(path + '.validatorTester.html') as f:
+        page = f.read()
+    assert page.startswith(archivematicaCreateMETSWriter.VALIDATOR_PAGE_HEAD + '&lt;?xml')
+    assert page.endswith('&lt;/mets:mets&gt;' + archivematicaCreateMETSWriter.VALIDATOR_PAGE_TAIL)
+    assert 'caf\xc3\xa9 &amp;amp; &amp;lt;1&amp;gt;' in page
+
+
+def test_sections_without_nsmap_use_the_mets_prefix(tmpdir):
+    # Built like getAMDSec in archivematicaCreateMETS2
+    section = etree.Element(ns.metsBNS + 'amdSec', ID='amdSec_1')
+    etree.SubElement(section, ns.metsBNS + 'techMD', ID='techMD_1')
+    spool = archivematicaCreateMETSWriter.SectionSpool()
+    spool.append(section)
+    assert section.getparent() is None
+    path = str(tmpdir.join('METS.xml'))
+    archivematicaCreateMETSWriter.write_mets(mets_root(), path, amdsecs=spool)
+
+    with open(path) as f:
+        mets = f.read()
+    assert '<mets:amdSec ' in mets
+    assert '<mets:techMD ID="techMD_1"/>' in mets
+    assert 'ns0' not in mets
@@ -0,0 +1,61 @@
+# -*- coding: utf8
+import os
+import sys
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+import scriptRunner
+
+SCRIPT = """
+from __future__ import print_function
+import sys
+
+def call(args):
+    if args[0] == 'exit':
+        sys.exit(int(args[1]))
+    if args[0] == 'raise':
+        raise ValueError('broken')
+    print('out', *args)
+    print(u'\\u00e9rror', file=sys.stderr)
+    return len(args)
+"""
+
+
+def write_script(tmpdir, name, text):
+    path = os.path.join(str(tmpdir), name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def test_run_script_captures_output(tmpdir):
+    script = write_script(tmpdir, 'captures.py', SCRIPT)
+    exit_code, stdout, stderr = scriptRunner.run_script(script, ['a', 'b'])
+    assert exit_code == 2
+    assert stdout == 'out a b\n'
+    assert stderr == u'érror\n'.encode('utf-8')
+    # Output is restored after the call
+    assert not isinstance(sys.stdout, scriptRunner._Output)
+
+
+def test_run_script_exit_codes(tmpdir):
+    script = write_script(tmpdir, 'exits.py', SCRIPT)
+    assert scriptRunner.run_script(script, ['exit', '3'])[0] == 3
+    assert scriptRunner.run_script(script, ['exit', '0'])[0] == 0
+    exit_code, _, stderr = scriptRunner.run_script(script, ['raise'])
+    assert exit_code == 1
+    assert 'ValueError: broken' in stderr
+
+
+def test_run_script_without_call(tmpdir):
+    script = write_script(tmpdir, 'nocall.py', 'import sys\n')
+    assert scriptRunner.run_script(script, []) is None
+
+
+def test_script_runner_pool(tmpdir):
+    script = write_script(tmpdir, 'pooled.py', SCRIPT)
+    runner = scriptRunner.ScriptRunner(1)
+    try:
+        assert runner.run(script, ['c']) == (1, 'out c\n', u'érror\n'.encode('utf-8'))
+    finally:
+        runner.close()
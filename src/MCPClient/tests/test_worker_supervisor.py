@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+import workerSupervisor
+
+
+def work_until_retired(state):
+    state.ready()
+    while not state.retiring:
+        state.task_started()
+        state.task_finished()
+
+
+def crash(state):
+    os._exit(3)
+
+
+def wait_for_exit(supervisor):
+    for state in supervisor.workers:
+        state.process.join(5)
+
+
+def test_workers_are_recycled_after_max_tasks():
+    supervisor = workerSupervisor.WorkerSupervisor(work_until_retired, 2, max_tasks=3)
+    supervisor.start()
+    try:
+        wait_for_exit(supervisor)
+        status = supervisor.status()
+        assert [s['state'] for s in status] == ['stopped', 'stopped']
+        assert [s['tasks'] for s in status] == [3, 3]
+
+        supervisor.check()
+        assert [s['restarts'] for s in supervisor.status()] == [1, 1]
+        assert all(state.restart_at is None for state in supervisor.workers)
+        assert all(state.crashes == 0 for state in supervisor.workers)
+    finally:
+        supervisor.stop()
+
+
+def test_crashed_workers_are_restarted_with_a_delay():
+    supervisor = workerSupervisor.WorkerSupervisor(crash, 1)
+    supervisor.start()
+    try:
+        wait_for_exit(supervisor)
+        state = supervisor.workers[0]
+        assert state.process.exitcode == 3
+
+        supervisor.check()
+        assert state.crashes == 1
+        assert state.restart_at > time.time()
+
+        state.restart_at = time.time()
+        supervisor.check()
+        assert state.restart_at is None
+        assert state.restarts == 1
+    finally:
+        supervisor.stop()
+
+
+def test_status_file(tmpdir):
+    status_file = os.path.join(str(tmpdir), 'status.json')
+    supervisor = workerSupervisor.WorkerSupervisor(work_until_retired, 1, max_tasks=1, status_file=status_file)
+    supervisor.start()
+    try:
+        wait_for_exit(supervisor)
+        supervisor.write_status()
+        with open(status_file) as f:
+            assert '"tasks": 1' in f.read()
+    finally:
+        supervisor.stop()
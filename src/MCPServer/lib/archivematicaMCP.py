@@ -54,7 +54,11 @@ from django.db.models import Q
 
 # This project, alphabetical by import source
 import watchDirectory
+import gearmanPool
 import gRPCServer
+import taskDispatcher
+import taskStandard
+import workflowGraph
 from utils import log_exceptions
 
 from jobChain import jobChain
@@ -68,7 +72,7 @@ from django_mysqlpool import auto_close_db
 import databaseFunctions
 from archivematicaFunctions import unicodeToStr
 
-from main.models import Job, SIP, Task, WatchedDirectory
+from main.models import Job, SIP, Task, UnitStatus, WatchedDirectory
 
 global countOfCreateUnitAndJobChainThreaded
 countOfCreateUnitAndJobChainThreaded = 0
@@ -82,10 +86,15 @@ dbWaitSleep = 2
 
 limitTaskThreads = config.getint('Protocol', "limitTaskThreads")
 limitTaskThreadsSleep = config.getfloat('Protocol', "limitTaskThreadsSleep")
-limitGearmanConnectionsSemaphore = threading.Semaphore(value=config.getint('Protocol', "limitGearmanConnections"))
 reservedAsTaskProcessingThreads = config.getint('Protocol', "reservedAsTaskProcessingThreads")
 stopSignalReceived = False #Tracks whether a sigkill has been received or not
 
+def activeUnitThreadCount():
+    """Count of active threads, not including the task dispatcher's pool."""
+    return threading.activeCount() - taskDispatcher.get_dispatcher().worker_count
+
+watcher = None #watchDirectory.DirectoryWatcher serving every watched directory
+
 def isUUID(uuid):
     """Return boolean of whether it's string representation of a UUID v4"""
     split = uuid.split("-")
@@ -191,7 +200,7 @@ def createUnitAndJobChainThreaded(path, config, terminate=True):
         t = threading.Thread(target=createUnitAndJobChain, args=(path, config), kwargs={"terminate":terminate})
         t.daemon = True
         countOfCreateUnitAndJobChainThreaded += 1
-        while(limitTaskThreads <= threading.activeCount() + reservedAsTaskProcessingThreads ):
+        while(limitTaskThreads <= activeUnitThreadCount() + reservedAsTaskProcessingThreads ):
             if stopSignalReceived:
                 logger.info('Signal was received; stopping createUnitAndJobChainThreaded(path, config)')
                 exit(0)
@@ -202,10 +211,26 @@ def createUnitAndJobChainThreaded(path, config, terminate=True):
     except Exception:
         logger.exception('Error creating threads to watch directories')
 
+def _get_config_option(getter, option, default):
+    """Read an optional MCPServer option, which older config files may lack."""
+    try:
+        return getter('MCPServer', option)
+    except ConfigParser.NoOptionError:
+        return default
+
 def watchDirectories():
     """Start watching the watched directories defined in the WatchedDirectories table in the database."""
+    global watcher
     watched_dir_path = config.get('MCPServer', "watchDirectoryPath")
-    interval = config.getint('MCPServer', "watchDirectoriesPollInterval")
+    interval = config.getfloat('MCPServer', "watchDirectoriesPollInterval")
+
+    watcher = watchDirectory.DirectoryWatcher(
+        interval=interval,
+        settle_time=_get_config_option(config.getfloat, "watchDirectoriesSettleTime", 1),
+        use_inotify=_get_config_option(config.getboolean, "watchDirectoriesUseInotify", True),
+        rescan_interval=_get_config_option(config.getfloat, "watchDirectoriesRescanInterval", 60),
+        metrics_file=_get_config_option(config.get, "watchDirectoriesMetricsFile", None),
+    )
 
     watched_directories = WatchedDirectory.objects.all()
 
@@ -215,32 +240,35 @@ def watchDirectories():
         # Tuple of variables that may be used by a callback
         row = (watched_directory.watched_directory_path, watched_directory.chain_id, watched_directory.only_act_on_directories, watched_directory.expected_type.description)
 
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        for item in os.listdir(directory):
+        actOnFiles=True
+        if watched_directory.only_act_on_directories:
+            actOnFiles=False
+        existing = watcher.watch(
+            directory,
+            variables=row,
+            callback=createUnitAndJobChainThreaded,
+            alert_on_files=actOnFiles,
+        )
+        for item in existing:
             if item == ".gitignore":
                 continue
             item = item.decode("utf-8")
             path = os.path.join(unicode(directory), item)
-            while(limitTaskThreads <= threading.activeCount() + reservedAsTaskProcessingThreads ):
+            while(limitTaskThreads <= activeUnitThreadCount() + reservedAsTaskProcessingThreads ):
                 time.sleep(1)
             createUnitAndJobChainThreaded(path, row, terminate=False)
-        actOnFiles=True
-        if watched_directory.only_act_on_directories:
-            actOnFiles=False
-        watchDirectory.archivematicaWatchDirectory(
-            directory,
-            variablesAdded=row,
-            callBackFunctionAdded=createUnitAndJobChainThreaded,
-            alertOnFiles=actOnFiles,
-            interval=interval,
-        )
+
+    watcher.start()
 
 def signal_handler(signalReceived, frame):
     """Used to handle the stop/kill command signals (SIGKILL)"""
     logger.info('Recieved signal %s in frame %s', signalReceived, frame)
     global stopSignalReceived
     stopSignalReceived = True
+    try:
+        taskStandard.get_task_journal().flush()
+    except Exception:
+        logger.exception('Unable to flush task journal')
     threads = threading.enumerate()
     for thread in threads:
         logger.warning('Not stopping %s %s', type(thread), thread)
@@ -249,6 +277,11 @@ def signal_handler(signalReceived, frame):
     sys.exit(0)
     exit(0)
 
+def reload_workflow_handler(signalReceived, frame):
+    """Reload the workflow from the database on SIGHUP, e.g. after editing it."""
+    logger.info('Received signal %s; reloading workflow', signalReceived)
+    workflowGraph.invalidate()
+
 @log_exceptions
 @auto_close_db
 def debugMonitor():
@@ -258,6 +291,15 @@ def debugMonitor():
         logger.debug('Debug monitor: datetime: %s', databaseFunctions.getUTCDate())
         logger.debug('Debug monitor: thread count: %s', threading.activeCount())
         logger.debug('Debug monitor: created job chain threaded: %s', countOfCreateUnitAndJobChainThreaded)
+        dispatcher = taskDispatcher.get_dispatcher()
+        logger.debug('Debug monitor: task dispatcher: %s of %s workers busy, %s tasks queued', dispatcher.busy, dispatcher.worker_count, dispatcher.qsize())
+        logger.debug('Debug monitor: Gearman jobs in flight: %s', gearmanPool.get_pool().in_flight())
+        if watcher is not None and watcher.stats['dispatched']:
+            logger.debug('Debug monitor: watched directory pickups: %s, latency avg/max/last: %.2f/%.2f/%.2f seconds',
+                watcher.stats['dispatched'],
+                watcher.stats['latency_total'] / watcher.stats['dispatched'],
+                watcher.stats['latency_max'],
+                watcher.stats['latency_last'])
         time.sleep(3600)
 
 @log_exceptions
@@ -269,9 +311,13 @@ def flushOutputs():
         time.sleep(5)
 
 def cleanupOldDbEntriesOnNewRun():
+    interrupted = Job.objects.filter(currentstep__in=['Awaiting decision', 'Executing command(s)'])
+    units = set(interrupted.values_list('sipuuid', flat=True).distinct())
     Job.objects.filter(currentstep='Awaiting decision').delete()
     Job.objects.filter(currentstep='Executing command(s)').update(currentstep='Failed')
     Task.objects.filter(exitcode=None).update(exitcode=-1, stderror="MCP shut down while processing.")
+    for unit_uuid in units:
+        UnitStatus.objects.refresh(unit_uuid)
 
 
 def _except_hook_log_everything(exc_type, exc_value, exc_traceback):
@@ -334,6 +380,7 @@ if __name__ == '__main__':
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, reload_workflow_handler)
 
     logger.info('This PID: %s', os.getpid())
     logger.info('User: %s', getpass.getuser())
@@ -346,6 +393,7 @@ if __name__ == '__main__':
     t.daemon = True
     t.start()
     cleanupOldDbEntriesOnNewRun()
+    workflowGraph.get_graph()
     watchDirectories()
 
     # This is going to block the main thread
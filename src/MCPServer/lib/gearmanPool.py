@@ -0,0 +1,206 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPServer
+
+import ConfigParser
+import logging
+import Queue
+import threading
+import time
+
+import gearman
+
+import taskDispatcher
+
+LOGGER = logging.getLogger('archivematica.mcp.server')
+
+# Times a batch is submitted, on errors other than the server being
+# unavailable, before its jobs are reported as failed
+SUBMIT_ATTEMPTS = 3
+# Seconds between those attempts
+SUBMIT_RETRY_DELAY = 1
+
+
+class _GearmanConnection(object):
+    """
+    A persistent GearmanClient owned by a single thread.
+
+    Jobs handed to submit() are sent to the server in batches with
+    submit_multiple_jobs, without waiting for them to complete. In between
+    batches the thread polls the connection and hands every job that has
+    finished to the completion callback it was submitted with.
+    """
+
+    def __init__(self, name, host_list, batch_size, poll_timeout):
+        self.name = name
+        self.host_list = host_list
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.queue = Queue.Queue()
+        # GearmanJobRequest: (callback, release)
+        self.in_flight = {}
+        t = threading.Thread(target=self._run, name=name)
+        t.daemon = True
+        t.start()
+
+    def load(self):
+        return self.queue.qsize() + len(self.in_flight)
+
+    def submit(self, job, callback, release):
+        self.queue.put((job, callback, release))
+
+    def _run(self):
+        client = gearman.GearmanClient(self.host_list)
+        while True:
+            try:
+                batch = self._next_batch()
+                if batch:
+                    self._submit_batch(client, batch)
+                if self.in_flight:
+                    self._poll(client)
+            except Exception:
+                LOGGER.exception('Error in Gearman client %s', self.name)
+                time.sleep(1)
+
+    def _next_batch(self):
+        batch = []
+        # Only wait for work when there is nothing else to poll
+        block = not self.in_flight
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(block=block))
+            except Queue.Empty:
+                break
+            block = False
+        return batch
+
+    def _submit_batch(self, client, batch):
+        import taskStandard
+        fail_max_sleep = 60
+        fail_sleep = 1
+        attempts = 0
+        while True:
+            try:
+                # Clients look up the Task row as soon as they get the job
+                taskStandard.get_task_journal().flush()
+                requests = client.submit_multiple_jobs(
+                    [job for job, _, _ in batch],
+                    background=False,
+                    wait_until_complete=False)
+                break
+            except gearman.errors.ServerUnavailable:
+                if fail_sleep == 1:
+                    LOGGER.exception('Error submitting %s jobs. Retrying.', len(batch))
+                time.sleep(fail_sleep)
+                fail_sleep = min(fail_sleep + 2, fail_max_sleep)
+            except Exception:
+                attempts += 1
+                if attempts >= SUBMIT_ATTEMPTS:
+                    LOGGER.exception('Error submitting %s jobs through %s. Failing them.', len(batch), self.name)
+                    self._fail_batch(batch)
+                    return
+                LOGGER.exception('Error submitting %s jobs through %s. Retrying.', len(batch), self.name)
+                time.sleep(SUBMIT_RETRY_DELAY)
+        LOGGER.debug('Submitted %s jobs through %s', len(batch), self.name)
+        for request, (_, callback, release) in zip(requests, batch):
+            self.in_flight[request] = (callback, release)
+
+    def _fail_batch(self, batch):
+        """
+        Hand each job of batch to its callback as a request in the
+        JOB_UNKNOWN state, as for a lost connection, and free its slot.
+        """
+        for job, callback, release in batch:
+            request = gearman.job.GearmanJobRequest(
+                gearman.job.GearmanJob(None, None, job['task'], job['unique'], job['data']))
+            release()
+            taskDispatcher.get_dispatcher().call(callback, request)
+
+    def _poll(self, client):
+        requests = self.in_flight.keys()
+        try:
+            client.wait_until_jobs_completed(requests, poll_timeout=self.poll_timeout)
+        except gearman.errors.ServerUnavailable:
+            # Every connection was lost; jobs still running are reported as
+            # failed through their JOB_UNKNOWN state below
+            LOGGER.exception('Lost connection to Gearman server')
+        for request in requests:
+            if request.complete or request.state == gearman.client.JOB_UNKNOWN:
+                callback, release = self.in_flight.pop(request)
+                # wait_until_jobs_completed flags everything it did not see
+                # finish within poll_timeout as timed out
+                request.timed_out = False
+                release()
+                taskDispatcher.get_dispatcher().call(callback, request)
+
+
+class GearmanClientPool(object):
+    """
+    Pool of persistent Gearman client connections shared by every task.
+
+    submit() returns as soon as the job is queued; `callback` is later
+    called on a task dispatcher worker with the finished GearmanJobRequest.
+    No more than `max_in_flight` jobs are outstanding at once, and submit()
+    blocks when that limit is reached.
+    """
+
+    def __init__(self, host_list, connections=2, max_in_flight=1000, batch_size=100, poll_timeout=0.1):
+        self.slots = threading.Semaphore(max_in_flight)
+        self.connections = [
+            _GearmanConnection('GearmanClient-%d' % i, host_list, batch_size, poll_timeout)
+            for i in range(connections)
+        ]
+
+    def submit(self, task, data, unique, callback):
+        self.slots.acquire()
+        connection = min(self.connections, key=lambda c: c.load())
+        job = dict(task=task, data=data, unique=unique)
+        connection.submit(job, callback, self.slots.release)
+
+    def in_flight(self):
+        return sum(len(c.in_flight) for c in self.connections)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_protocol_option(option, default):
+    import archivematicaMCP
+    try:
+        return archivematicaMCP.config.getint('Protocol', option)
+    except ConfigParser.NoOptionError:
+        return default
+
+
+def get_pool():
+    """Return the GearmanClientPool shared by every task."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import archivematicaMCP
+            _pool = GearmanClientPool(
+                [archivematicaMCP.config.get('MCPServer', "MCPArchivematicaServer")],
+                connections=_get_protocol_option('gearmanClientConnections', 2),
+                max_in_flight=_get_protocol_option('limitGearmanJobsInFlight', 1000),
+                batch_size=_get_protocol_option('gearmanSubmitBatchSize', 100),
+            )
+    return _pool
@@ -25,9 +25,12 @@ import logging
 import sys
 
 from jobChainLink import jobChainLink
+import taskDispatcher
+import workflowGraph
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from dicts import ReplacementDict
+from django_mysqlpool import auto_close_db
 
 sys.path.append("/usr/share/archivematica/dashboard")
 from main.models import MicroServiceChain, UnitVariable
@@ -57,6 +60,10 @@ def fetchUnitVariableForUnit(unit_uuid):
 
     return results
 
+@auto_close_db
+def startChainLink(*args, **kwargs):
+    jobChainLink(*args, **kwargs)
+
 class jobChain:
     def __init__(self, unit, chainPK, notifyComplete=None, passVar=None, UUID=None, subJobOf=""):
         """Create an instance of a chain from the MicroServiceChains table"""
@@ -70,7 +77,9 @@ class jobChain:
         self.linkSplitCount = 1
         self.subJobOf = subJobOf
 
-        chain = MicroServiceChain.objects.get(id=str(chainPK))
+        chain = workflowGraph.get_graph().get_chain(chainPK)
+        if chain is None:
+            raise MicroServiceChain.DoesNotExist('MicroServiceChain %s does not exist' % chainPK)
         LOGGER.debug('Chain: %s', chain)
         self.startingChainLink = chain.startinglink_id
         self.description = chain.description
@@ -92,7 +101,11 @@ class jobChain:
         if incrementLinkSplit:
             self.linkSplitCount += 1
         if pk != None:
-            jobChainLink(self, pk, self.unit, passVar=passVar, subJobOf=subJobOf)
+            # Links are mostly moved on to by task completion callbacks, on the
+            # dispatcher's workers; their tasks must not be queued from there,
+            # or they would not wait for room in the queue
+            taskDispatcher.get_dispatcher().start_off_workers(
+                startChainLink, self, pk, self.unit, passVar=passVar, subJobOf=subJobOf)
         else:
             self.linkSplitCount -= 1
             if self.linkSplitCount == 0:
@@ -35,13 +35,14 @@ from linkTaskManagerGetMicroserviceGeneratedListInStdOut import linkTaskManagerG
 from linkTaskManagerGetUserChoiceFromMicroserviceGeneratedList import linkTaskManagerGetUserChoiceFromMicroserviceGeneratedList
 from linkTaskManagerSetUnitVariable import linkTaskManagerSetUnitVariable
 from linkTaskManagerUnitVariableLinkPull import linkTaskManagerUnitVariableLinkPull
+import workflowGraph
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from django_mysqlpool import auto_close_db
-from databaseFunctions import logJobCreatedSQL, getUTCDate
+from databaseFunctions import logJobCreatedSQL, logJobStepSQL, getUTCDate
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import Job, MicroServiceChainLink, MicroServiceChainLinkExitCode, TaskType
+from main.models import TaskType
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -70,22 +71,21 @@ class jobChainLink:
 
         # Depending on the path that led to this, jobChainLinkPK may
         # either be a UUID or a MicroServiceChainLink instance
-        if isinstance(jobChainLinkPK, basestring):
-            try:
-                link = MicroServiceChainLink.objects.get(id=str(jobChainLinkPK))
-            # This will sometimes return no values
-            except MicroServiceChainLink.DoesNotExist:
-                return
-        else:
-            link = jobChainLinkPK
-
+        if not isinstance(jobChainLinkPK, basestring):
+            jobChainLinkPK = jobChainLinkPK.id
+        link = workflowGraph.get_graph().get_link(jobChainLinkPK)
+        # This will sometimes return no values
+        if link is None:
+            return
+
+        self.link = link
         self.pk = link.id
 
         self.currentTask = link.currenttask_id
         self.defaultNextChainLink = link.defaultnextchainlink_id
-        taskType = link.currenttask.tasktype_id
-        taskTypePKReference = link.currenttask.tasktypepkreference
-        self.description = link.currenttask.description
+        taskType = link.tasktype_id
+        taskTypePKReference = link.tasktypepkreference
+        self.description = link.description
         self.reloadFileList = link.reloadfilelist
         self.defaultExitMessage = link.defaultexitmessage
         self.microserviceGroup = link.microservicegroup
@@ -128,23 +128,17 @@ class jobChainLink:
 
     def getNextChainLinkPK(self, exitCode):
         if exitCode is not None:
-            try:
-                return MicroServiceChainLinkExitCode.objects.get(microservicechainlink_id=str(self.pk), exitcode=str(exitCode)).nextmicroservicechainlink_id
-            except (MicroServiceChainLinkExitCode.DoesNotExist, MicroServiceChainLinkExitCode.MultipleObjectsReturned):
-                return self.defaultNextChainLink
+            return self.link.next_link(exitCode)
 
     @log_exceptions
     @auto_close_db
     def setExitMessage(self, message):
-        Job.objects.filter(jobuuid=self.UUID).update(currentstep=str(message))
+        logJobStepSQL(self, str(message))
 
     def updateExitMessage(self, exitCode):
         message = self.defaultExitMessage
         if exitCode is not None:
-            try:
-                message = MicroServiceChainLinkExitCode.objects.get(microservicechainlink_id=str(self.pk), exitcode=str(exitCode)).exitmessage
-            except MicroServiceChainLinkExitCode.DoesNotExist:
-                pass
+            message = self.link.exit_message(exitCode)
         if message is not None:
             self.setExitMessage(message)
         else:
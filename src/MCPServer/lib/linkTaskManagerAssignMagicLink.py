@@ -24,6 +24,7 @@
 import sys
 
 from linkTaskManager import LinkTaskManager
+import workflowGraph
 
 sys.path.append("/usr/share/archivematica/dashboard")
 from main.models import TaskConfigAssignMagicLink
@@ -38,9 +39,9 @@ class linkTaskManagerAssignMagicLink(LinkTaskManager):
         super(linkTaskManagerAssignMagicLink, self).__init__(jobChainLink, pk, unit)
 
         ###GET THE MAGIC NUMBER FROM THE TASK stuff
-        link = 0
+        link = None
         try:
-            link = TaskConfigAssignMagicLink.objects.get(id=pk).execute
+            link = workflowGraph.get_graph().get_magic_link(pk)
         except TaskConfigAssignMagicLink.DoesNotExist:
             pass
 
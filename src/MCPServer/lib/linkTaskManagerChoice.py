@@ -43,7 +43,7 @@ from django_mysqlpool import auto_close_db
 from archivematicaFunctions import unicodeToStr
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import MicroServiceChainChoice, UserProfile
+from main.models import UserProfile
 
 waitingOnTimer="waitingOnTimer"
 
@@ -57,9 +57,7 @@ class linkTaskManagerChoice(LinkTaskManager):
         self.delayTimerLock = threading.Lock()
         self.delayTimer = None
 
-        choices = MicroServiceChainChoice.objects.filter(choiceavailableatlink_id=str(jobChainLink.pk))
-        for choice in choices:
-            self.choices.append((choice.chainavailable_id, choice.chainavailable.description))
+        self.choices.extend(jobChainLink.link.choices)
 
         preConfiguredChain = self.checkForPreconfiguredXML()
         if preConfiguredChain != None:
@@ -69,9 +67,11 @@ class linkTaskManagerChoice(LinkTaskManager):
 
         else:
             choicesAvailableForUnitsLock.acquire()
+            # The choices must be available by the time the dashboard sees
+            # that the job is awaiting a decision
+            choicesAvailableForUnits[self.jobChainLink.UUID] = self
             if self.delayTimer == None:
                 self.jobChainLink.setExitMessage('Awaiting decision')
-            choicesAvailableForUnits[self.jobChainLink.UUID] = self
             choicesAvailableForUnitsLock.release()
 
     def checkForPreconfiguredXML(self):
@@ -23,23 +23,22 @@
 
 from linkTaskManager import LinkTaskManager
 from taskStandard import taskStandard
+import taskDispatcher
+import workflowGraph
 import os
 import sys
-import threading
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import archivematicaFunctions
 import databaseFunctions
 from dicts import ReplacementDict
-sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import StandardTaskConfig
 
 
 class linkTaskManagerDirectories(LinkTaskManager):
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerDirectories, self).__init__(jobChainLink, pk, unit)
         self.tasks = []
-        stc = StandardTaskConfig.objects.get(id=str(pk))
+        stc = workflowGraph.get_graph().get_standard_task_config(pk)
         filterSubDir = stc.filter_subdir
         self.requiresOutputLock = stc.requires_output_lock
         standardOutputFile = stc.stdout_file
@@ -71,9 +70,7 @@ class linkTaskManagerDirectories(LinkTaskManager):
 
         self.task = taskStandard(self, execute, arguments, standardOutputFile, standardErrorFile, UUID=self.UUID)
         databaseFunctions.logTaskCreatedSQL(self, commandReplacementDic, self.UUID, arguments)
-        t = threading.Thread(target=self.task.performTask)
-        t.daemon = True
-        t.start()
+        taskDispatcher.get_dispatcher().submit(self.task)
 
     def taskCompletedCallBackFunction(self, task):
         databaseFunctions.logTaskCompletedSQL(task)
@@ -25,23 +25,26 @@ import ast
 import logging
 import os
 import threading
-import time
 import sys
 import uuid
 
-import archivematicaMCP
 from linkTaskManager import LinkTaskManager
-from taskStandard import taskStandard
+from taskStandard import taskStandard, get_task_journal
+import taskDispatcher
+import workflowGraph
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import archivematicaFunctions
-import databaseFunctions
 from dicts import ReplacementDict
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import StandardTaskConfig, UnitVariable
+from main.models import UnitVariable
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
 class linkTaskManagerFiles(LinkTaskManager):
+    # Up to this many files, only the replacement dicts of the files selected
+    # by the link's filters are built; beyond it, those of the whole unit
+    SELECT_FILES_BY_UUID = 500
+
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerFiles, self).__init__(jobChainLink, pk, unit)
         self.tasks = {}
@@ -49,7 +52,7 @@ class linkTaskManagerFiles(LinkTaskManager):
         self.exitCode = 0
         self.clearToNextLink = False
 
-        stc = StandardTaskConfig.objects.get(id=str(pk))
+        stc = workflowGraph.get_graph().get_standard_task_config(pk)
         # These three may be concatenated/compared with other strings,
         # so they need to be bytestrings here
         filterFileEnd = str(stc.filter_file_end) if stc.filter_file_end else ''
@@ -86,7 +89,9 @@ class linkTaskManagerFiles(LinkTaskManager):
         # Escape all values for shell
         for key, value in SIPReplacementDic.items():
             SIPReplacementDic[key] = archivematicaFunctions.escapeForCommand(value)
-        self.tasksLock.acquire()
+        # Files known to the database, by UUID, and those that are not
+        fileUnits = {}
+        unknownFileUnits = []
         for file, fileUnit in unit.fileList.items():
             if filterFileEnd:
                 if not file.endswith(filterFileEnd):
@@ -97,51 +102,72 @@ class linkTaskManagerFiles(LinkTaskManager):
             if filterSubDir:
                 if not file.startswith(unit.pathString + filterSubDir):
                     continue
+            if fileUnit.UUID != "None":
+                fileUnits[fileUnit.UUID] = fileUnit
+            else:
+                unknownFileUnits.append(fileUnit)
+
+        self.dispatcher = taskDispatcher.get_dispatcher()
+        self.journal = get_task_journal()
+        # Build the replacement dicts of all files in one go, rather than
+        # fetching each file (and its SIP or transfer) separately
+        if fileUnits:
+            if len(fileUnits) <= self.SELECT_FILES_BY_UUID:
+                replacementDics = unit.iterFileReplacementDics(fileUnits.keys())
+            else:
+                replacementDics = unit.iterFileReplacementDics()
+            for fileUUID, commandReplacementDic in replacementDics:
+                fileUnit = fileUnits.pop(fileUUID, None)
+                if fileUnit is not None:
+                    self.createTask(commandReplacementDic, SIPReplacementDic, outputLock)
+        # Files whose rows belong to another unit, or have not been added yet
+        for fileUnit in fileUnits.values() + unknownFileUnits:
+            self.createTask(fileUnit.getReplacementDic(), SIPReplacementDic, outputLock)
+
+        with self.tasksLock:
+            self.clearToNextLink = True
+            proceed = self.tasks == {}
+        if proceed:
+            self.jobChainLink.linkProcessingComplete(self.exitCode)
 
-            standardOutputFile = self.standardOutputFile
-            standardErrorFile = self.standardErrorFile
-            execute = self.execute
-            arguments = self.arguments
-
-            # Apply passvar replacement values
-            if self.jobChainLink.passVar is not None:
-                if isinstance(self.jobChainLink.passVar, list):
-                    for passVar in self.jobChainLink.passVar:
-                        if isinstance(passVar, ReplacementDict):
-                            arguments, standardOutputFile, standardErrorFile = passVar.replace(arguments, standardOutputFile, standardErrorFile)
-                elif isinstance(self.jobChainLink.passVar, ReplacementDict):
-                    arguments, standardOutputFile, standardErrorFile = self.jobChainLink.passVar.replace(arguments, standardOutputFile, standardErrorFile)
-
-            # Apply file replacement values
-            commandReplacementDic = fileUnit.getReplacementDic()
-            for key, value in commandReplacementDic.items():
-                # Escape values for shell
-                commandReplacementDic[key] = archivematicaFunctions.escapeForCommand(value)
-            arguments, standardOutputFile, standardErrorFile = commandReplacementDic.replace(arguments, standardOutputFile, standardErrorFile)
-
-            # Apply unit (SIP/Transfer) replacement values
-            arguments, standardOutputFile, standardErrorFile = SIPReplacementDic.replace(arguments, standardOutputFile, standardErrorFile)
-
-            UUID = str(uuid.uuid4())
-            task = taskStandard(self, execute, arguments, standardOutputFile, standardErrorFile, outputLock=outputLock, UUID=UUID)
+    def createTask(self, commandReplacementDic, SIPReplacementDic, outputLock):
+        standardOutputFile = self.standardOutputFile
+        standardErrorFile = self.standardErrorFile
+        execute = self.execute
+        arguments = self.arguments
+
+        # Apply passvar replacement values
+        if self.jobChainLink.passVar is not None:
+            if isinstance(self.jobChainLink.passVar, list):
+                for passVar in self.jobChainLink.passVar:
+                    if isinstance(passVar, ReplacementDict):
+                        arguments, standardOutputFile, standardErrorFile = passVar.replace(arguments, standardOutputFile, standardErrorFile)
+            elif isinstance(self.jobChainLink.passVar, ReplacementDict):
+                arguments, standardOutputFile, standardErrorFile = self.jobChainLink.passVar.replace(arguments, standardOutputFile, standardErrorFile)
+
+        # Apply file replacement values
+        for key, value in commandReplacementDic.items():
+            # Escape values for shell
+            commandReplacementDic[key] = archivematicaFunctions.escapeForCommand(value)
+        arguments, standardOutputFile, standardErrorFile = commandReplacementDic.replace(arguments, standardOutputFile, standardErrorFile)
+
+        # Apply unit (SIP/Transfer) replacement values
+        arguments, standardOutputFile, standardErrorFile = SIPReplacementDic.replace(arguments, standardOutputFile, standardErrorFile)
+
+        UUID = str(uuid.uuid4())
+        task = taskStandard(self, execute, arguments, standardOutputFile, standardErrorFile, outputLock=outputLock, UUID=UUID)
+        with self.tasksLock:
             self.tasks[UUID] = task
-            databaseFunctions.logTaskCreatedSQL(self, commandReplacementDic, UUID, arguments)
-            t = threading.Thread(target=task.performTask)
-            t.daemon = True
-            while(archivematicaMCP.limitTaskThreads <= threading.activeCount()):
-                self.tasksLock.release()
-                time.sleep(archivematicaMCP.limitTaskThreadsSleep)
-                self.tasksLock.acquire()
-            t.start()
-
-        self.clearToNextLink = True
-        self.tasksLock.release()
-        if self.tasks == {}:
-            self.jobChainLink.linkProcessingComplete(self.exitCode)
+        self.journal.task_created(self, commandReplacementDic, UUID, arguments)
+        # Blocks while the dispatcher queue is full; tasksLock must not be
+        # held here, or workers waiting for it in
+        # taskCompletedCallBackFunction would stop draining the queue
+        self.dispatcher.submit(task)
 
     def taskCompletedCallBackFunction(self, task):
         self.exitCode = max(self.exitCode, abs(task.results["exitCode"]))
-        databaseFunctions.logTaskCompletedSQL(task)
+        journal = get_task_journal()
+        journal.task_completed(task)
 
         self.tasksLock.acquire()
         if task.UUID in self.tasks:
@@ -152,5 +178,7 @@ class linkTaskManagerFiles(LinkTaskManager):
 
         if self.clearToNextLink is True and self.tasks == {} :
             LOGGER.debug('Proceeding to next link %s', self.jobChainLink.UUID)
+            # Later links may read the output of these tasks
+            journal.flush()
             self.jobChainLink.linkProcessingComplete(self.exitCode, self.jobChainLink.passVar)
         self.tasksLock.release()
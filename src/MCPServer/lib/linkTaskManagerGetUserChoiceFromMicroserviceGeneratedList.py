@@ -32,11 +32,12 @@ from linkTaskManager import LinkTaskManager
 import archivematicaMCP
 from linkTaskManagerChoice import choicesAvailableForUnits
 from linkTaskManagerChoice import choicesAvailableForUnitsLock
+import workflowGraph
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from dicts import ReplacementDict, ChoicesDict
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import StandardTaskConfig, UserProfile
+from main.models import UserProfile
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -44,7 +45,7 @@ class linkTaskManagerGetUserChoiceFromMicroserviceGeneratedList(LinkTaskManager)
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerGetUserChoiceFromMicroserviceGeneratedList, self).__init__(jobChainLink, pk, unit)
         self.choices = []
-        stc = StandardTaskConfig.objects.get(id=str(pk))
+        stc = workflowGraph.get_graph().get_standard_task_config(pk)
         key = stc.execute
 
         choiceIndex = 0
@@ -76,8 +77,8 @@ class linkTaskManagerGetUserChoiceFromMicroserviceGeneratedList(LinkTaskManager)
             self.proceedWithChoice(index=preConfiguredIndex, user_id=None)
         else:
             choicesAvailableForUnitsLock.acquire()
-            self.jobChainLink.setExitMessage('Awaiting decision')
             choicesAvailableForUnits[self.jobChainLink.UUID] = self
+            self.jobChainLink.setExitMessage('Awaiting decision')
             choicesAvailableForUnitsLock.release()
 
     def checkForPreconfiguredXML(self):
@@ -32,11 +32,12 @@ import time
 from linkTaskManager import LinkTaskManager
 import archivematicaMCP
 from linkTaskManagerChoice import choicesAvailableForUnits, choicesAvailableForUnitsLock, waitingOnTimer
+import workflowGraph
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from dicts import ReplacementDict
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import MicroServiceChoiceReplacementDic, UserProfile
+from main.models import UserProfile
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -45,7 +46,7 @@ class linkTaskManagerReplacementDicFromChoice(LinkTaskManager):
         super(linkTaskManagerReplacementDicFromChoice, self).__init__(jobChainLink, pk, unit)
 
         self.choices = []
-        dicts = MicroServiceChoiceReplacementDic.objects.filter(choiceavailableatlink=str(jobChainLink.pk))
+        dicts = workflowGraph.get_graph().get_replacement_dics(jobChainLink.pk)
         for i, dic in enumerate(dicts):
             self.choices.append((i, dic.description, dic.replacementdic))
 
@@ -60,8 +61,8 @@ class linkTaskManagerReplacementDicFromChoice(LinkTaskManager):
                 LOGGER.info('Waiting on delay to resume processing on unit %s', unit)
         else:
             choicesAvailableForUnitsLock.acquire()
-            self.jobChainLink.setExitMessage('Awaiting decision')
             choicesAvailableForUnits[self.jobChainLink.UUID] = self
+            self.jobChainLink.setExitMessage('Awaiting decision')
             choicesAvailableForUnitsLock.release()
 
     def checkForPreconfiguredXML(self):
@@ -80,7 +81,7 @@ class linkTaskManagerReplacementDicFromChoice(LinkTaskManager):
                 for preconfiguredChoice in root.findall(".//preconfiguredChoice"):
                     if preconfiguredChoice.find("appliesTo").text == self.jobChainLink.pk:
                         desiredChoice = preconfiguredChoice.find("goToChain").text
-                        dic = MicroServiceChoiceReplacementDic.objects.get(id=desiredChoice, choiceavailableatlink=self.jobChainLink.pk)
+                        dic = workflowGraph.get_graph().get_replacement_dic(self.jobChainLink.pk, desiredChoice)
                         ret = dic.replacementdic
                         try:
                             #<delay unitAtime="yes">30</delay>
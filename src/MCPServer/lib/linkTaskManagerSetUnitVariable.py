@@ -24,17 +24,16 @@
 import sys
 
 from linkTaskManager import LinkTaskManager
+import workflowGraph
 global choicesAvailableForUnits
 choicesAvailableForUnits = {}
 
-sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import TaskConfigSetUnitVariable
 
 class linkTaskManagerSetUnitVariable(LinkTaskManager):
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerSetUnitVariable, self).__init__(jobChainLink, pk, unit)
         ###GET THE MAGIC NUMBER FROM THE TASK stuff
-        var = TaskConfigSetUnitVariable.objects.get(id=pk)
+        var = workflowGraph.get_graph().get_set_unit_variable_config(pk)
 
         ###Update the unit
         #set the magic number
@@ -24,16 +24,15 @@
 import sys
 
 from linkTaskManager import LinkTaskManager
+import workflowGraph
 global choicesAvailableForUnits
 choicesAvailableForUnits = {}
 
-sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import TaskConfigUnitVariableLinkPull
 
 class linkTaskManagerUnitVariableLinkPull(LinkTaskManager):
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerUnitVariableLinkPull, self).__init__(jobChainLink, pk, unit)
-        var = TaskConfigUnitVariableLinkPull.objects.get(id=pk)
+        var = workflowGraph.get_graph().get_unit_variable_link_pull_config(pk)
         link = self.unit.getmicroServiceChainLink(var.variable, var.variablevalue, var.defaultmicroservicechainlink_id)
         
         ###Update the unit
@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPServer
+
+import ConfigParser
+import logging
+import Queue
+import threading
+
+from utils import log_exceptions
+
+LOGGER = logging.getLogger('archivematica.mcp.server')
+
+
+class TaskDispatcher(object):
+    """
+    Performs tasks on a fixed number of worker threads fed from a queue.
+
+    submit() blocks once `max_queued` tasks are waiting, which throttles the
+    link task managers creating them. A worker must never block there, as
+    that could leave every worker waiting on a queue that only they can
+    drain; so links started from a worker (e.g. when a task completion
+    callback moves a chain on) are started on their own thread with
+    start_off_workers(). Tasks that are still submitted from a worker are
+    not blocked. Neither are calls queued with call(), which is how task
+    completion callbacks get onto the workers.
+    """
+
+    def __init__(self, workers, max_queued):
+        self.worker_count = workers
+        self.queue = Queue.Queue()
+        self.slots = threading.Semaphore(max_queued)
+        self.busy = 0
+        self.busy_lock = threading.Lock()
+        self._local = threading.local()
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name='TaskDispatcher-%d' % i)
+            t.daemon = True
+            t.start()
+
+    def is_worker(self):
+        return getattr(self._local, 'is_worker', False)
+
+    def submit(self, task):
+        """Queue task; its performTask method will be called by a worker."""
+        holds_slot = not self.is_worker()
+        if holds_slot:
+            self.slots.acquire()
+        self.queue.put((task.performTask, (), holds_slot))
+
+    def call(self, function, *args):
+        """Queue a call to function(*args) on a worker, without blocking."""
+        self.queue.put((function, args, False))
+
+    def start_off_workers(self, function, *args, **kwargs):
+        """
+        Call function(*args, **kwargs), on a new thread if this is a worker,
+        so that the tasks it submits can wait for room in the queue.
+        """
+        if not self.is_worker():
+            return function(*args, **kwargs)
+        t = threading.Thread(target=log_exceptions(function), args=args, kwargs=kwargs)
+        t.daemon = True
+        t.start()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def _work(self):
+        self._local.is_worker = True
+        while True:
+            function, args, holds_slot = self.queue.get()
+            if holds_slot:
+                self.slots.release()
+            with self.busy_lock:
+                self.busy += 1
+            try:
+                function(*args)
+            except Exception:
+                LOGGER.exception('Error calling %s', function)
+            finally:
+                with self.busy_lock:
+                    self.busy -= 1
+                self.queue.task_done()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the TaskDispatcher shared by every link task manager."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            import archivematicaMCP
+            config = archivematicaMCP.config
+            try:
+                workers = config.getint('Protocol', 'taskWorkerThreads')
+            except ConfigParser.NoOptionError:
+                workers = 32
+            try:
+                max_queued = config.getint('Protocol', 'taskQueueSize')
+            except ConfigParser.NoOptionError:
+                max_queued = 1000
+            LOGGER.info('Starting task dispatcher with %s workers and a queue of %s tasks', workers, max_queued)
+            _dispatcher = TaskDispatcher(workers, max_queued)
+    return _dispatcher
@@ -21,25 +21,45 @@
 # @subpackage MCPServer
 # @author Joseph Perry <joseph@artefactual.com>
 
+import ConfigParser
 import cPickle
 import gearman
 import logging
 import os
 import sys
-import time
+import threading
 import uuid
 
 import archivematicaMCP
+import gearmanPool
 from utils import log_exceptions
 
 from django.utils import timezone
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from django_mysqlpool import auto_close_db
+from databaseFunctions import TaskJournal
 from fileOperations import writeToFile
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
+_task_journal = None
+_task_journal_lock = threading.Lock()
+
+def get_task_journal():
+    """Return the TaskJournal buffering Task rows for every link task manager."""
+    global _task_journal
+    with _task_journal_lock:
+        if _task_journal is None:
+            kwargs = {}
+            try:
+                kwargs['batch_size'] = archivematicaMCP.config.getint('Protocol', 'taskJournalBatchSize')
+                kwargs['flush_interval'] = archivematicaMCP.config.getfloat('Protocol', 'taskJournalFlushInterval')
+            except ConfigParser.NoOptionError:
+                pass
+            _task_journal = TaskJournal(**kwargs)
+    return _task_journal
+
 # ~Class Task~
 #Tasks are what are assigned to clients.
 #They have a zero-many(tasks) TO one(job) relationship
@@ -61,56 +81,35 @@ class taskStandard():
         self.outputLock = outputLock
 
     @log_exceptions
-    @auto_close_db
     def performTask(self):
-        from archivematicaMCP import limitGearmanConnectionsSemaphore
-        limitGearmanConnectionsSemaphore.acquire()
-        gm_client = gearman.GearmanClient([archivematicaMCP.config.get('MCPServer', "MCPArchivematicaServer")])
+        """Hand the task to Gearman; check_request_status is called once it has run."""
         data = {"createdDate" : timezone.now().isoformat(' ')}
         data["arguments"] = self.arguments
         LOGGER.info('Executing %s %s', self.execute, data)
-        completed_job_request = None
-        failMaxSleep = 60
-        failSleepInitial = 1
-        failSleep = failSleepInitial
-        failSleepIncrementor = 2
-        while completed_job_request == None:
-            try:
-                completed_job_request = gm_client.submit_job(self.execute.lower(), cPickle.dumps(data), self.UUID)
-            except gearman.errors.ServerUnavailable:
-                completed_job_request = None
-                time.sleep(failSleep)
-                if failSleep == failSleepInitial:
-                    LOGGER.exception('Error submitting job. Retrying.')
-                if failSleep < failMaxSleep:
-                    failSleep += failSleepIncrementor
-        limitGearmanConnectionsSemaphore.release()
-        self.check_request_status(completed_job_request)
-        gm_client.shutdown()
-        LOGGER.debug('Finished performing task %s', self.UUID)
+        gearmanPool.get_pool().submit(self.execute.lower(), cPickle.dumps(data), self.UUID, self.check_request_status)
 
+    @log_exceptions
+    @auto_close_db
     def check_request_status(self, job_request):
-        if job_request.complete:
+        if job_request.complete and job_request.state == gearman.JOB_COMPLETE:
             self.results = cPickle.loads(job_request.result)
             LOGGER.debug('Task %s finished! Result %s - %s', job_request.job.unique, job_request.state, self.results)
             self.writeOutputs()
             self.linkTaskManager.taskCompletedCallBackFunction(self)
-        elif job_request.timed_out:
-            LOGGER.error('Task %s timed out!', job_request.unique)
-            self.results['exitCode'] = -1
-            self.results["stdError"] = "Task %s timed out!" % job_request.unique
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
+            LOGGER.debug('Finished performing task %s', self.UUID)
+            return
 
+        self.results = {"exitCode": -1, "stdOut": ""}
+        if job_request.timed_out:
+            LOGGER.error('Task %s timed out!', job_request.job.unique)
+            self.results["stdError"] = "Task %s timed out!" % job_request.job.unique
         elif job_request.state == gearman.client.JOB_UNKNOWN:
-            LOGGER.error('Task %s connection failed!', job_request.unique)
-            self.results["stdError"] = "Task %s connection failed!" % job_request.unique
-            self.results['exitCode'] = -1
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
+            LOGGER.error('Task %s connection failed!', job_request.job.unique)
+            self.results["stdError"] = "Task %s connection failed!" % job_request.job.unique
         else:
-            LOGGER.error('Task %s failed!', job_request.unique)
-            self.results["stdError"] = "Task %s failed!" % job_request.unique
-            self.results['exitCode'] = -1
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
+            LOGGER.error('Task %s failed!', job_request.job.unique)
+            self.results["stdError"] = "Task %s failed!" % job_request.job.unique
+        self.linkTaskManager.taskCompletedCallBackFunction(self)
 
     def outputFileIsWritable(self, fileName):
         """
@@ -23,52 +23,186 @@
 
 import logging
 import os
+import stat as statmodule
 import sys
+import threading
+import time
 
 import archivematicaMCP
 from unitFile import unitFile
 
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+from dicts import ReplacementDict
+
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import File, UnitVariable
+from main.models import File, UnitVariable, path_hash
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
+# Directory mtimes are only trusted once they are older than this many
+# seconds, as filesystems with coarse timestamps would otherwise hide changes
+# made within the same tick as the last scan
+MTIME_GRANULARITY = 2
+# Files in the database but not on disk are reported this many at a time
+MISSING_FILES_CHUNK = 500
+
+_reloadLocksLock = threading.Lock()
+
+
+class _DirectoryEntry(object):
+    """A directory in a unit's manifest."""
+    __slots__ = ('mtime', 'files', 'subdirectories')
+
+    def __init__(self, mtime, files, subdirectories):
+        self.mtime = mtime
+        # Names of the files in it
+        self.files = files
+        self.subdirectories = subdirectories
+
+
+def _scanDirectory(path):
+    """List path like os.walk would, returning the names of its files and the subdirectories to descend into."""
+    files = []
+    subdirectories = []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return files, subdirectories
+    for name in names:
+        try:
+            st = os.lstat(os.path.join(path, name))
+        except OSError:
+            continue
+        if statmodule.S_ISDIR(st.st_mode):
+            subdirectories.append(name)
+        elif statmodule.S_ISLNK(st.st_mode) and os.path.isdir(os.path.join(path, name)):
+            # os.walk does not follow links to directories, nor list them as files
+            continue
+        else:
+            files.append(name)
+    return files, subdirectories
+
+
+def _scanTree(root, relative, previous, manifest):
+    """Add the directory root + relative and everything below it to manifest, reusing unchanged entries of previous."""
+    path = root + relative
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return
+    entry = previous.get(relative)
+    if entry is None or entry.mtime != mtime or time.time() - mtime < MTIME_GRANULARITY:
+        files, subdirectories = _scanDirectory(path)
+        entry = _DirectoryEntry(mtime, files, subdirectories)
+    manifest[relative] = entry
+    for name in entry.subdirectories:
+        _scanTree(root, relative + name + '/', previous, manifest)
+
+
 class unit:
     """A class to inherit from, to over-ride methods, defininging a processing object at the Job level"""
     def __init__(self, currentPath, UUID):
         self.currentPath = currentPath.__str__()
         self.UUID = UUID
 
+    # Manifest of the unit's directory, from the last reloadFileList: the
+    # absolute path it was taken of, and its directories by relative path
+    _manifestRoot = None
+    _manifest = None
+    # path_hash() of each path in fileList
+    _pathHashes = None
+
+    def _getReloadLock(self):
+        with _reloadLocksLock:
+            if '_reloadLock' not in self.__dict__:
+                self._reloadLock = threading.Lock()
+            return self._reloadLock
+
     def reloadFileList(self):
-        """Match files to their UUID's via their location and the File table's currentLocation"""
-        self.fileList = {}
+        """
+        Match files to their UUID's via their location and the File table's currentLocation
+
+        Only the directories whose mtime changed since the last reload are
+        listed again. Files are matched to their rows through
+        currentLocationHash, so a reload reads the UUID, location hash,
+        fileGrpUse and removedTime of the unit's files, but not their
+        (unindexed, arbitrarily long) locations.
+        """
         # currentPath must be a string to return all filenames as bytestrings,
         # and to safely concatenate with other bytestrings
         currentPath = os.path.join(self.currentPath.replace("%sharedPath%", archivematicaMCP.config.get('MCPServer', "sharedDirectory"), 1), "").encode('utf-8')
-        try:
-            for directory, subDirectories, files in os.walk(currentPath):
-                directory = directory.replace(currentPath, self.pathString, 1)
-                for file_ in files:
-                    if self.pathString != directory:
-                        filePath = os.path.join(directory, file_)
-                    else:
-                        filePath = directory + file_
-                    self.fileList[filePath] = unitFile(filePath, owningUnit=self)
-
-            if self.unitType == "Transfer":
-                files = File.objects.filter(transfer_id=self.UUID)
-            else:
-                files = File.objects.filter(sip_id=self.UUID)
-            for f in files:
-                if f.currentlocation in self.fileList:
-                    self.fileList[f.currentlocation].UUID = f.uuid
-                    self.fileList[f.currentlocation].fileGrpUse = f.filegrpuse
-                else:
+        with self._getReloadLock():
+            try:
+                self._reloadFileList(currentPath)
+            except Exception:
+                LOGGER.exception('Error reloading file list for %s', currentPath)
+                exit(1)
+
+    def _reloadFileList(self, currentPath):
+        if self._manifestRoot != currentPath:
+            # The unit moved; start over
+            previous = {}
+            previousFileList = {}
+            previousHashes = {}
+        else:
+            previous = self._manifest
+            previousFileList = self.fileList
+            previousHashes = self._pathHashes
+        manifest = {}
+        _scanTree(currentPath, '', previous, manifest)
+
+        fileList = {}
+        pathHashes = {}
+        for relative, entry in manifest.iteritems():
+            directory = self.pathString + relative
+            for file_ in entry.files:
+                filePath = directory + file_
+                fileList[filePath] = previousFileList.get(filePath) or unitFile(filePath, owningUnit=self)
+                pathHashes[filePath] = previousHashes.get(filePath) or path_hash(filePath)
+
+        if self.unitType == "Transfer":
+            files = File.objects.filter(transfer_id=self.UUID)
+        else:
+            files = File.objects.filter(sip_id=self.UUID)
+        rows = {}
+        for fileUUID, locationHash, fileGrpUse, removedTime in files.values_list('uuid', 'currentlocation_hash', 'filegrpuse', 'removedtime').iterator():
+            row = rows.get(locationHash)
+            if row is not None and row[2] is None and removedTime is not None:
+                # Files removed from the unit give way to the one there now
+                continue
+            rows[locationHash] = (fileUUID, fileGrpUse, removedTime)
+
+        # Files are matched again on every reload, as their rows can be
+        # updated, replaced or removed without the file itself changing
+        for filePath, fileUnit in fileList.iteritems():
+            fileUUID, fileGrpUse, _ = rows.pop(pathHashes[filePath], ("None", 'None', None))
+            fileUnit.UUID = fileUUID
+            fileUnit.fileGrpUse = fileGrpUse
+
+        if rows and not previousFileList:
+            missing = [fileUUID for fileUUID, _, _ in rows.itervalues()]
+            for i in range(0, len(missing), MISSING_FILES_CHUNK):
+                for fileUUID, location in files.filter(uuid__in=missing[i:i + MISSING_FILES_CHUNK]).values_list('uuid', 'currentlocation'):
                     LOGGER.warning('%s %s has file (%s) %s in the database, but file does not exist in the file system',
-                        self.unitType, self.UUID, f.uuid, f.currentlocation)
-        except Exception:
-            LOGGER.exception('Error reloading file list for %s', currentPath)
-            exit(1)
+                        self.unitType, self.UUID, fileUUID, location)
+
+        self._manifestRoot = currentPath
+        self._manifest = manifest
+        self._pathHashes = pathHashes
+        self.fileList = fileList
+
+    def iterFileReplacementDics(self, uuids=None):
+        """
+        Iterate over (file UUID, ReplacementDict) for the files of this unit
+        in the database, or only those in uuids if given.
+        """
+        if self.unitType == "Transfer":
+            files = File.objects.filter(transfer_id=self.UUID)
+        else:
+            files = File.objects.filter(sip_id=self.UUID)
+        if uuids is not None:
+            files = files.filter(uuid__in=uuids)
+        return ReplacementDict.frommodels(files, type_='file')
 
     def getMagicLink(self):
         return
@@ -104,6 +238,6 @@ class unit:
             var = UnitVariable.objects.get(unittype=self.unitType,
                                            unituuid=self.UUID,
                                            variable=variable)
-            return var.microservicechainlink
+            return var.microservicechainlink_id
         except UnitVariable.DoesNotExist:
             return defaultMicroServiceChainLink
@@ -31,15 +31,24 @@ LOGGER = logging.getLogger('archivematica.mcp.server')
 
 class unitFile(object):
     """For objects representing a File"""
+    # Units keep one of these for every file they contain
+    __slots__ = ('currentPath', 'UUID', 'owningUnit', 'fileGrpUse')
+
     def __init__(self, currentPath, UUID="None", owningUnit=None):
         self.currentPath = currentPath
         self.UUID = UUID
         self.owningUnit = owningUnit
         self.fileGrpUse = 'None'
-        self.fileList = {currentPath: self}
-        self.pathString = ""
-        if owningUnit:
-            self.pathString = owningUnit.pathString
+
+    @property
+    def fileList(self):
+        return {self.currentPath: self}
+
+    @property
+    def pathString(self):
+        if self.owningUnit:
+            return self.owningUnit.pathString
+        return ""
 
     def __str__(self):
         return 'unitFile: <UUID: {u.UUID}, path: {u.currentPath}>'.format(u=self)
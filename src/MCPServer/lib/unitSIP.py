@@ -53,7 +53,7 @@ class unitSIP(unit):
         """Assign a link to the unit to process when loaded.
         Deprecated! Replaced with Set/Load Unit Variable"""
         sip = SIP.objects.get(uuid=self.UUID)
-        sip.magiclink = link
+        sip.magiclink_id = link
         if exitStatus:
             sip.magiclinkexitmessage = exitStatus
         sip.save()
@@ -79,7 +79,7 @@ class unitTransfer(unit):
         """Assign a link to the unit to process when loaded.
         Deprecated! Replaced with Set/Load Unit Variable"""
         transfer = Transfer.objects.get(uuid=self.UUID)
-        transfer.magiclink = link
+        transfer.magiclink_id = link
         if exitStatus:
             transfer.magiclinkexitmessage = exitStatus
         transfer.save()
@@ -20,13 +20,19 @@
 # @package Archivematica
 # @subpackage MCPServer
 # @author Joseph Perry <joseph@artefactual.com>
-# @thanks to http://timgolden.me.uk/python/win32_how_do_i/watch_directory_for_changes.html
 import logging
 import os
+import Queue
+import tempfile
 import time
 import threading
 import sys
 
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from django_mysqlpool import auto_close_db
 from archivematicaFunctions import unicodeToStr
@@ -35,70 +41,310 @@ from utils import log_exceptions
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
-class archivematicaWatchDirectory:
-    """Watches for new files/directories to process in a watched directory. Directories are defined in the WatchedDirectoriesTable.""" 
-    def __init__(self, directory, 
-                 variablesAdded=None, 
-                 callBackFunctionAdded=None, 
-                 variablesRemoved=None, 
-                 callBackFunctionRemoved=None, 
-                 alertOnDirectories=True, 
-                 alertOnFiles=True, 
-                 interval=1, 
-                 threaded=True):
+# Directory mtimes are only trusted once they are older than this many
+# seconds; filesystems with coarse timestamps (NFS, ext3) can otherwise hide a
+# second change made within the same tick as the scan that recorded them.
+MTIME_GRANULARITY = 2
+
+METRICS_TEMPLATE = """\
+# HELP archivematica_mcp_watched_directory_pickups_total Entries picked up from watched directories.
+# TYPE archivematica_mcp_watched_directory_pickups_total counter
+archivematica_mcp_watched_directory_pickups_total {dispatched}
+# HELP archivematica_mcp_watched_directory_pickup_latency_seconds Time from the last change to an entry to its pickup.
+# TYPE archivematica_mcp_watched_directory_pickup_latency_seconds summary
+archivematica_mcp_watched_directory_pickup_latency_seconds_sum {latency_total}
+archivematica_mcp_watched_directory_pickup_latency_seconds_count {dispatched}
+# HELP archivematica_mcp_watched_directory_pickup_latency_max_seconds Longest pickup latency.
+# TYPE archivematica_mcp_watched_directory_pickup_latency_max_seconds gauge
+archivematica_mcp_watched_directory_pickup_latency_max_seconds {latency_max}
+# HELP archivematica_mcp_watched_directory_pickup_latency_last_seconds Latency of the latest pickup.
+# TYPE archivematica_mcp_watched_directory_pickup_latency_last_seconds gauge
+archivematica_mcp_watched_directory_pickup_latency_last_seconds {latency_last}
+"""
+
+
+def _signature(path):
+    """
+    Return (signature, time of last change) of the entry at path. The
+    signature of a file is its size and mtime; that of a directory covers the
+    number, total size and latest mtime of everything under it, as files deep
+    inside it can be written without changing the directory itself.
+    """
+    st = os.stat(path)
+    if not os.path.isdir(path):
+        return (st.st_size, st.st_mtime), st.st_mtime
+    count, size, mtime = 0, st.st_size, st.st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                # Removed while walking; the next pass sees the change
+                continue
+            count += 1
+            size += st.st_size
+            mtime = max(mtime, st.st_mtime)
+    return (count, size, mtime), mtime
+
+
+class _WatchedDirectory(object):
+    """Book-keeping for a single directory served by DirectoryWatcher."""
+
+    def __init__(self, path, variables, callback, alert_on_directories, alert_on_files):
+        self.path = path
+        self.variables = variables
+        self.callback = callback
+        self.alert_on_directories = alert_on_directories
+        self.alert_on_files = alert_on_files
+        self.mtime = None
+        self.dirty = True
+        # Whether changes are reported by inotify, or need polling
+        self.inotify = False
+        # Entries already seen (and dispatched, or present at start-up)
+        self.known = set()
+        # Entries that appeared but are still being written to, keyed by
+        # name: (signature, time of last signature change)
+        self.pending = {}
+
+
+class DirectoryWatcher(object):
+    """
+    Watches every watched directory from a single thread.
+
+    New entries are reported through the callback registered with watch().
+    Changes are picked up with inotify when pyinotify is available and the
+    filesystem supports it; otherwise each directory is stat()ed every
+    `interval` seconds and only listed when its mtime has changed.
+
+    An entry is only reported once its size and mtime, and for a directory
+    those of everything under it, have been stable for `settle_time` seconds,
+    so that partially copied transfers are not picked up early. Pickup latency
+    (from the entry's last change to its dispatch) is tracked in `stats`, and
+    written to `metrics_file`, if given, in the Prometheus text format (e.g.
+    for node_exporter's textfile collector).
+
+    Callbacks are run in order on a thread of their own, started with the
+    watcher, so that one waiting (e.g. for room to start a unit) does not hold
+    up pickup in the other directories.
+    """
+
+    def __init__(self, interval=1, settle_time=1, use_inotify=True, rescan_interval=60, metrics_file=None):
+        self.interval = interval
+        self.settle_time = settle_time
+        self.rescan_interval = rescan_interval
+        self.metrics_file = metrics_file
+        self.directories = {}
+        self.lock = threading.Lock()
         self.run = False
-        self.variablesAdded = variablesAdded
-        self.callBackFunctionAdded = callBackFunctionAdded 
-        self.variablesRemoved = variablesRemoved 
-        self.callBackFunctionRemoved = callBackFunctionRemoved
-        self.directory = directory
-        self.alertOnDirectories = alertOnDirectories
-        self.alertOnFiles = alertOnFiles
-        self.interval= interval
-        
+        # (callback, path, variables) of entries picked up
+        self.callbacks = Queue.Queue()
+        self._dispatcher = None
+        self.stats = {
+            'dispatched': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+            'latency_last': 0.0,
+        }
+        self._notifier = None
+        self._watch_manager = None
+        if use_inotify:
+            self._setup_inotify()
+
+    def _setup_inotify(self):
+        if pyinotify is None:
+            LOGGER.info('pyinotify is not installed; falling back to polling watched directories')
+            return
+        try:
+            self._watch_manager = pyinotify.WatchManager()
+            self._notifier = pyinotify.Notifier(
+                self._watch_manager,
+                _InotifyHandler(watcher=self),
+                timeout=int(self.interval * 1000))
+        except Exception:
+            LOGGER.warning('Unable to initialize inotify; falling back to polling watched directories', exc_info=True)
+            self._watch_manager = None
+            self._notifier = None
+
+    @property
+    def uses_inotify(self):
+        return self._notifier is not None
+
+    def watch(self, directory, variables=None, callback=None, alert_on_directories=True, alert_on_files=True):
+        """
+        Register a directory to watch.
+
+        Entries already in the directory are considered known and will not be
+        reported; they are returned so that the caller can act on them.
+        """
+        directory = unicodeToStr(directory)
         if not os.path.isdir(directory):
-            os.makedirs(directory, mode=770)
-        
+            os.makedirs(directory, mode=0o770)
+        watched = _WatchedDirectory(directory, variables, callback, alert_on_directories, alert_on_files)
+        watched.mtime = os.stat(directory).st_mtime
+        watched.known = set(os.listdir(directory))
+        watched.dirty = False
+
+        with self.lock:
+            self.directories[os.path.normpath(directory)] = watched
+        if self.uses_inotify:
+            mask = (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO |
+                    pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY |
+                    pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM)
+            result = self._watch_manager.add_watch(directory, mask, quiet=True)
+            watched.inotify = result.get(directory, -1) >= 0
+            if not watched.inotify:
+                LOGGER.warning('Unable to add inotify watch for %s; it will be polled', directory)
+        LOGGER.info('Watching directory %s (Files: %s)', directory, alert_on_files)
+        return sorted(watched.known)
+
+    def mark_dirty(self, directory):
+        """Flag a directory to be listed on the next pass."""
+        watched = self.directories.get(os.path.normpath(unicodeToStr(directory)))
+        if watched is not None:
+            watched.dirty = True
+
+    def start(self, threaded=True):
+        self.start_dispatcher()
         if threaded:
-            t = threading.Thread(target=self.start)
+            t = threading.Thread(target=self.loop)
             t.daemon = True
             t.start()
         else:
-            self.start()
+            self.loop()
+
+    def start_dispatcher(self):
+        """Start the thread running the callbacks, unless already running."""
+        with self.lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_callbacks, name='DirectoryWatcherCallbacks')
+                self._dispatcher.daemon = True
+                self._dispatcher.start()
+
+    def stop(self):
+        self.run = False
+
+    @log_exceptions
+    @auto_close_db
+    def _dispatch_callbacks(self):
+        while True:
+            callback, path, variables = self.callbacks.get()
+            try:
+                callback(path, variables)
+            except Exception:
+                LOGGER.exception('Error handling %s', path)
+            finally:
+                self.callbacks.task_done()
+
+    def write_metrics(self):
+        """Write `stats` to `metrics_file`, replacing it atomically."""
+        if not self.metrics_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.metrics_file))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.watchDirectory')
+            with os.fdopen(fd, 'w') as f:
+                f.write(METRICS_TEMPLATE.format(**self.stats))
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.metrics_file)
+        except (IOError, OSError):
+            LOGGER.warning('Unable to write watched directory metrics to %s', self.metrics_file, exc_info=True)
 
     @log_exceptions
     @auto_close_db
-    def start(self):
-        """Based on polling example: http://timgolden.me.uk/python/win32_how_do_i/watch_directory_for_changes.html"""
+    def loop(self):
         self.run = True
-        LOGGER.info('Watching directory %s (Files: %s)', self.directory, self.alertOnFiles)
-        before = dict ([(f, None) for f in os.listdir (self.directory)])
+        self.write_metrics()
+        LOGGER.info('Watching %d directories using %s', len(self.directories), 'inotify' if self.uses_inotify else 'polling')
+        last_rescan = time.time()
         while self.run:
-            time.sleep (self.interval)
-            after = dict ([(f, None) for f in os.listdir (self.directory)])
-            added = [f for f in after if not f in before]
-            removed = [f for f in before if not f in after]
-            if added: 
-                LOGGER.debug('Added %s', added)
-                for i in added:
-                    i = unicodeToStr(i)
-                    directory = unicodeToStr(self.directory)
-                    self.event(os.path.join(directory, i), self.variablesAdded, self.callBackFunctionAdded)
+            if self.uses_inotify:
+                # Blocks for at most `interval` seconds
+                if self._notifier.check_events():
+                    self._notifier.read_events()
+                    self._notifier.process_events()
+                # inotify does not see changes made by other NFS clients, so
+                # still look at directory mtimes every once in a while
+                full_rescan = time.time() - last_rescan >= self.rescan_interval
+            else:
+                time.sleep(self.interval)
+                full_rescan = True
+            if full_rescan:
+                last_rescan = time.time()
+            self.scan(check_mtimes=full_rescan)
+
+    def scan(self, check_mtimes=True):
+        """Do a single pass over all watched directories."""
+        with self.lock:
+            directories = self.directories.values()
+        for watched in directories:
+            try:
+                self._scan_directory(watched, check_mtimes)
+            except OSError:
+                LOGGER.exception('Error scanning watched directory %s', watched.path)
+
+    def _scan_directory(self, watched, check_mtimes):
+        now = time.time()
+        if (check_mtimes or not watched.inotify) and not watched.dirty:
+            mtime = os.stat(watched.path).st_mtime
+            if mtime != watched.mtime or now - mtime < MTIME_GRANULARITY:
+                watched.dirty = True
+        if watched.dirty:
+            # Reset the flag before listing so that events arriving while
+            # listing are not lost
+            watched.dirty = False
+            watched.mtime = os.stat(watched.path).st_mtime
+            entries = set(os.listdir(watched.path))
+            removed = watched.known - entries
             if removed:
-                LOGGER.debug('Removed %s', removed)
-                for i in removed:
-                    i = unicodeToStr(i)
-                    directory = unicodeToStr(self.directory)
-                    self.event(os.path.join(directory, i), self.variablesRemoved, self.callBackFunctionRemoved)
-            before = after
-    
-    def event(self, path, variables, function):
-        if not function:
+                LOGGER.debug('Removed %s', list(removed))
+            watched.known &= entries
+            for name in removed:
+                watched.pending.pop(name, None)
+            for name in entries - watched.known:
+                if name not in watched.pending:
+                    watched.pending[name] = (None, now)
+        if watched.pending:
+            self._process_pending(watched, now)
+
+    def _process_pending(self, watched, now):
+        for name, (signature, changed) in watched.pending.items():
+            path = os.path.join(watched.path, name)
+            try:
+                current, modified = _signature(path)
+            except OSError:
+                # Gone before it settled
+                del watched.pending[name]
+                continue
+            if current != signature:
+                watched.pending[name] = (current, now)
+                if self.settle_time > 0:
+                    continue
+            elif now - changed < self.settle_time:
+                continue
+            del watched.pending[name]
+            watched.known.add(name)
+            LOGGER.debug('Added %s', name)
+            self.event(watched, path, modified, now)
+
+    def event(self, watched, path, modified, now):
+        if not watched.callback:
             return
-        if os.path.isdir(path) and self.alertOnDirectories:
-            function(path, variables)
-        if os.path.isfile(path) and self.alertOnFiles:
-            function(path, variables)
-    
-    def stop(self):
-        self.run = False
+        is_dir = os.path.isdir(path)
+        if (is_dir and watched.alert_on_directories) or (not is_dir and watched.alert_on_files):
+            latency = max(now - modified, 0.0)
+            self.stats['dispatched'] += 1
+            self.stats['latency_total'] += latency
+            self.stats['latency_last'] = latency
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+            self.write_metrics()
+            LOGGER.info('Picked up %s after %.2f seconds', path, latency)
+            self.callbacks.put((watched.callback, path, watched.variables))
+
+
+if pyinotify is not None:
+    class _InotifyHandler(pyinotify.ProcessEvent):
+        def my_init(self, watcher):
+            self.watcher = watcher
+
+        def process_default(self, event):
+            self.watcher.mark_dirty(event.path)
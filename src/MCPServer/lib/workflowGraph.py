@@ -0,0 +1,264 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPServer
+
+"""
+In-memory copy of the workflow: chains, links, exit codes, choices,
+replacement dict choices and task configs.
+
+The workflow tables only change on upgrades, or when they are edited by hand,
+so they are read once and every link reads them from memory afterwards. The
+graph is never modified; invalidate() throws it away, and the next call to
+get_graph() loads a new one. Links already running keep the copy they
+started with.
+"""
+
+from collections import namedtuple
+import logging
+import sys
+import threading
+
+from django.db.models.signals import post_delete, post_save
+
+sys.path.append("/usr/share/archivematica/dashboard")
+from main.models import (
+    MicroServiceChain, MicroServiceChainChoice, MicroServiceChainLink,
+    MicroServiceChainLinkExitCode, MicroServiceChoiceReplacementDic,
+    StandardTaskConfig, TaskConfigAssignMagicLink, TaskConfigSetUnitVariable,
+    TaskConfigUnitVariableLinkPull)
+
+LOGGER = logging.getLogger('archivematica.mcp.server')
+
+Chain = namedtuple('Chain', ['id', 'startinglink_id', 'description'])
+
+ExitCode = namedtuple('ExitCode', ['nextmicroservicechainlink_id', 'exitmessage'])
+
+TaskConfig = namedtuple('TaskConfig', [
+    'id', 'execute', 'arguments', 'filter_subdir', 'filter_file_start',
+    'filter_file_end', 'requires_output_lock', 'stdout_file', 'stderr_file'])
+
+SetUnitVariableConfig = namedtuple('SetUnitVariableConfig', [
+    'id', 'variable', 'variablevalue', 'microservicechainlink_id'])
+
+UnitVariableLinkPullConfig = namedtuple('UnitVariableLinkPullConfig', [
+    'id', 'variable', 'variablevalue', 'defaultmicroservicechainlink_id'])
+
+ReplacementDicChoice = namedtuple('ReplacementDicChoice', ['id', 'description', 'replacementdic'])
+
+_LinkBase = namedtuple('Link', [
+    'id', 'currenttask_id', 'tasktype_id', 'tasktypepkreference',
+    'description', 'defaultnextchainlink_id', 'reloadfilelist',
+    'defaultexitmessage', 'microservicegroup',
+    # exitcode: ExitCode, or None if the exit code is listed more than once
+    'exit_codes',
+    # (chain ID, chain description) tuples
+    'choices'])
+
+
+class Link(_LinkBase):
+    __slots__ = ()
+
+    def _exit_code(self, exitCode):
+        try:
+            return self.exit_codes.get(int(exitCode))
+        except (TypeError, ValueError):
+            return None
+
+    def next_link(self, exitCode):
+        """Return the ID of the link to go to after exiting with exitCode."""
+        exit_code = self._exit_code(exitCode)
+        if exit_code is None:
+            return self.defaultnextchainlink_id
+        return exit_code.nextmicroservicechainlink_id
+
+    def exit_message(self, exitCode):
+        """Return the message for the job after exiting with exitCode."""
+        exit_code = self._exit_code(exitCode)
+        if exit_code is None:
+            return self.defaultexitmessage
+        return exit_code.exitmessage
+
+
+class WorkflowGraph(object):
+    def __init__(self, chains, links, task_configs, set_unit_variable_configs=None,
+                 unit_variable_link_pull_configs=None, magic_links=None, replacement_dics=None):
+        self.chains = chains
+        self.links = links
+        self.task_configs = task_configs
+        self.set_unit_variable_configs = set_unit_variable_configs or {}
+        self.unit_variable_link_pull_configs = unit_variable_link_pull_configs or {}
+        # TaskConfigAssignMagicLink ID: link ID
+        self.magic_links = magic_links or {}
+        # link ID: tuple of ReplacementDicChoice
+        self.replacement_dics = replacement_dics or {}
+
+    @classmethod
+    def load(cls):
+        """Read the whole workflow from the database."""
+        exit_codes = {}
+        for ec in MicroServiceChainLinkExitCode.objects.all():
+            codes = exit_codes.setdefault(ec.microservicechainlink_id, {})
+            if ec.exitcode in codes:
+                # Ambiguous; the link's defaults are used instead
+                codes[ec.exitcode] = None
+            else:
+                codes[ec.exitcode] = ExitCode(ec.nextmicroservicechainlink_id, ec.exitmessage)
+
+        choices = {}
+        for choice in MicroServiceChainChoice.objects.select_related('chainavailable'):
+            choices.setdefault(choice.choiceavailableatlink_id, []).append(
+                (choice.chainavailable_id, choice.chainavailable.description))
+
+        links = {}
+        for link in MicroServiceChainLink.objects.select_related('currenttask'):
+            links[link.id] = Link(
+                id=link.id,
+                currenttask_id=link.currenttask_id,
+                tasktype_id=link.currenttask.tasktype_id,
+                tasktypepkreference=link.currenttask.tasktypepkreference,
+                description=link.currenttask.description,
+                defaultnextchainlink_id=link.defaultnextchainlink_id,
+                reloadfilelist=link.reloadfilelist,
+                defaultexitmessage=link.defaultexitmessage,
+                microservicegroup=link.microservicegroup,
+                exit_codes=exit_codes.get(link.id, {}),
+                choices=tuple(choices.get(link.id, ())))
+
+        chains = {}
+        for chain in MicroServiceChain.objects.all():
+            chains[chain.id] = Chain(chain.id, chain.startinglink_id, chain.description)
+
+        task_configs = {}
+        for stc in StandardTaskConfig.objects.all():
+            task_configs[stc.id] = TaskConfig(
+                id=stc.id,
+                execute=stc.execute,
+                arguments=stc.arguments,
+                filter_subdir=stc.filter_subdir,
+                filter_file_start=stc.filter_file_start,
+                filter_file_end=stc.filter_file_end,
+                requires_output_lock=stc.requires_output_lock,
+                stdout_file=stc.stdout_file,
+                stderr_file=stc.stderr_file)
+
+        set_unit_variable_configs = {}
+        for config in TaskConfigSetUnitVariable.objects.all():
+            set_unit_variable_configs[config.id] = SetUnitVariableConfig(
+                config.id, config.variable, config.variablevalue, config.microservicechainlink_id)
+
+        unit_variable_link_pull_configs = {}
+        for config in TaskConfigUnitVariableLinkPull.objects.all():
+            unit_variable_link_pull_configs[config.id] = UnitVariableLinkPullConfig(
+                config.id, config.variable, config.variablevalue, config.defaultmicroservicechainlink_id)
+
+        magic_links = dict(TaskConfigAssignMagicLink.objects.values_list('id', 'execute'))
+
+        replacement_dics = {}
+        for dic in MicroServiceChoiceReplacementDic.objects.all():
+            replacement_dics.setdefault(dic.choiceavailableatlink_id, []).append(
+                ReplacementDicChoice(dic.id, dic.description, dic.replacementdic))
+        replacement_dics = dict((link_id, tuple(dics)) for link_id, dics in replacement_dics.items())
+
+        LOGGER.info('Loaded workflow: %d chains, %d links, %d standard task configs', len(chains), len(links), len(task_configs))
+        return cls(chains, links, task_configs, set_unit_variable_configs,
+                   unit_variable_link_pull_configs, magic_links, replacement_dics)
+
+    def get_chain(self, pk):
+        """Return the chain with ID pk, or None."""
+        return self.chains.get(str(pk))
+
+    def get_link(self, pk):
+        """Return the link with ID pk, or None."""
+        return self.links.get(str(pk))
+
+    def get_standard_task_config(self, pk):
+        """Return the StandardTaskConfig with ID pk."""
+        try:
+            return self.task_configs[str(pk)]
+        except KeyError:
+            raise StandardTaskConfig.DoesNotExist('StandardTaskConfig %s does not exist' % pk)
+
+    def get_set_unit_variable_config(self, pk):
+        """Return the TaskConfigSetUnitVariable with ID pk."""
+        try:
+            return self.set_unit_variable_configs[str(pk)]
+        except KeyError:
+            raise TaskConfigSetUnitVariable.DoesNotExist('TaskConfigSetUnitVariable %s does not exist' % pk)
+
+    def get_unit_variable_link_pull_config(self, pk):
+        """Return the TaskConfigUnitVariableLinkPull with ID pk."""
+        try:
+            return self.unit_variable_link_pull_configs[str(pk)]
+        except KeyError:
+            raise TaskConfigUnitVariableLinkPull.DoesNotExist('TaskConfigUnitVariableLinkPull %s does not exist' % pk)
+
+    def get_magic_link(self, pk):
+        """Return the ID of the link assigned by TaskConfigAssignMagicLink pk."""
+        try:
+            return self.magic_links[str(pk)]
+        except KeyError:
+            raise TaskConfigAssignMagicLink.DoesNotExist('TaskConfigAssignMagicLink %s does not exist' % pk)
+
+    def get_replacement_dics(self, link_pk):
+        """Return the ReplacementDicChoices offered at link link_pk."""
+        return self.replacement_dics.get(str(link_pk), ())
+
+    def get_replacement_dic(self, link_pk, pk):
+        """Return the ReplacementDicChoice pk offered at link link_pk."""
+        for dic in self.get_replacement_dics(link_pk):
+            if dic.id == pk:
+                return dic
+        raise MicroServiceChoiceReplacementDic.DoesNotExist('MicroServiceChoiceReplacementDic %s does not exist' % pk)
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """Return the workflow graph, loading it if needed."""
+    global _graph
+    graph = _graph
+    if graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = WorkflowGraph.load()
+            graph = _graph
+    return graph
+
+
+def invalidate(*args, **kwargs):
+    """Discard the workflow graph; it is loaded again on next use."""
+    global _graph
+    with _graph_lock:
+        if _graph is not None:
+            LOGGER.info('Workflow graph invalidated')
+        _graph = None
+
+
+# Changes made through the ORM in this process invalidate the graph directly.
+# Changes made elsewhere need invalidate() to be called, e.g. with SIGHUP.
+for _model in (MicroServiceChain, MicroServiceChainChoice, MicroServiceChainLink,
+               MicroServiceChainLinkExitCode, MicroServiceChoiceReplacementDic,
+               StandardTaskConfig, TaskConfigAssignMagicLink, TaskConfigSetUnitVariable,
+               TaskConfigUnitVariableLinkPull):
+    post_save.connect(invalidate, sender=_model, dispatch_uid='workflowGraph')
+    post_delete.connect(invalidate, sender=_model, dispatch_uid='workflowGraph')
@@ -0,0 +1,81 @@
+import os
+import socket
+import sys
+import time
+import types
+
+import gearman
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+import gearmanPool
+import taskDispatcher
+
+
+class FakeJournal(object):
+    def __init__(self, failures):
+        self.failures = failures
+
+    def flush(self):
+        if self.failures:
+            self.failures -= 1
+            raise Exception('Database unavailable')
+
+
+class FakeClient(object):
+    failures = 0
+
+    def __init__(self, host_list):
+        pass
+
+    def submit_multiple_jobs(self, jobs, background, wait_until_complete):
+        if FakeClient.failures:
+            FakeClient.failures -= 1
+            raise socket.error('Connection reset')
+        return [gearman.job.GearmanJobRequest(gearman.job.GearmanJob(None, None, job['task'], job['unique'], job['data']))
+                for job in jobs]
+
+    def wait_until_jobs_completed(self, requests, poll_timeout):
+        for request in requests:
+            request.state = gearman.JOB_COMPLETE
+            request.result = 'done'
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def submit_jobs(monkeypatch, journal_failures=0, client_failures=0, count=3):
+    journal = FakeJournal(journal_failures)
+    task_standard = types.ModuleType('taskStandard')
+    task_standard.get_task_journal = lambda: journal
+    monkeypatch.setitem(sys.modules, 'taskStandard', task_standard)
+    monkeypatch.setattr(gearman, 'GearmanClient', FakeClient)
+    monkeypatch.setattr(FakeClient, 'failures', client_failures)
+    monkeypatch.setattr(gearmanPool, 'SUBMIT_RETRY_DELAY', 0)
+    monkeypatch.setattr(taskDispatcher, '_dispatcher', taskDispatcher.TaskDispatcher(1, 10))
+
+    pool = gearmanPool.GearmanClientPool([], connections=1, max_in_flight=count)
+    results = []
+    for i in range(count):
+        pool.submit('task', 'data', 'unique-%d' % i, results.append)
+    assert wait_for(lambda: len(results) == count)
+    # Every slot was released
+    assert all(pool.slots.acquire(False) for _ in range(count))
+    return results
+
+
+def test_jobs_are_submitted_after_transient_errors(monkeypatch):
+    results = submit_jobs(monkeypatch, journal_failures=1, client_failures=1)
+    assert [r.state for r in results] == [gearman.JOB_COMPLETE] * 3
+    assert [r.result for r in results] == ['done'] * 3
+
+
+def test_jobs_are_failed_when_they_cannot_be_submitted(monkeypatch):
+    # Jobs may be split over several batches, so every submission fails
+    results = submit_jobs(monkeypatch, client_failures=float('inf'))
+    assert sorted(r.job.unique for r in results) == ['unique-0', 'unique-1', 'unique-2']
+    assert all(r.state == gearman.client.JOB_UNKNOWN and not r.complete for r in results)
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+import taskDispatcher
+
+
+class FakeTask(object):
+    def __init__(self, release):
+        self.release = release
+        self.done = threading.Event()
+
+    def performTask(self):
+        self.release.wait()
+        self.done.set()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_links_started_from_a_callback_wait_for_room_in_the_queue():
+    dispatcher = taskDispatcher.TaskDispatcher(workers=2, max_queued=3)
+    release = threading.Event()
+    tasks = [FakeTask(release) for _ in range(20)]
+    submitted = []
+
+    def start_link():
+        # As a link task manager does for each file
+        for task in tasks:
+            dispatcher.submit(task)
+            submitted.append(task)
+
+    def completion_callback():
+        assert dispatcher.is_worker()
+        dispatcher.start_off_workers(start_link)
+
+    dispatcher.call(completion_callback)
+
+    # Both workers end up blocked on a task, and the queue is full
+    assert wait_for(lambda: dispatcher.busy == 2 and dispatcher.qsize() == 3)
+    time.sleep(0.1)
+    assert len(submitted) == 5
+    assert dispatcher.qsize() == 3
+
+    release.set()
+    assert wait_for(lambda: len(submitted) == 20)
+    assert wait_for(lambda: all(task.done.is_set() for task in tasks))
+
+
+def test_start_off_workers_calls_directly_from_other_threads():
+    dispatcher = taskDispatcher.TaskDispatcher(workers=1, max_queued=1)
+    threads = []
+    dispatcher.start_off_workers(lambda: threads.append(threading.current_thread()))
+    assert threads == [threading.current_thread()]
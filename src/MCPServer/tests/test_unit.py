@@ -0,0 +1,98 @@
+import ConfigParser
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+from django.test import TestCase
+from django.utils import timezone
+
+from main import models
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+
+# archivematicaMCP reads the server configuration when imported; only the
+# shared directory is needed here
+archivematicaMCP = types.ModuleType('archivematicaMCP')
+archivematicaMCP.config = ConfigParser.SafeConfigParser()
+archivematicaMCP.config.add_section('MCPServer')
+archivematicaMCP = sys.modules.setdefault('archivematicaMCP', archivematicaMCP)
+import unitSIP
+
+SIP_UUID = '3b5f4f2e-8d1f-4c1e-9f0a-0b7c6b1d2e3f'
+FILE_A = '0a6f1b1e-7c1e-4d83-9d6f-0f1c9a1c0a01'
+FILE_B = '0b6f1b1e-7c1e-4d83-9d6f-0f1c9a1c0a02'
+FILE_C = '0c6f1b1e-7c1e-4d83-9d6f-0f1c9a1c0a03'
+FILE_A2 = '0a6f1b1e-7c1e-4d83-9d6f-0f1c9a1c0a04'
+
+
+class TestReloadFileList(TestCase):
+
+    def setUp(self):
+        self.shared_directory = tempfile.mkdtemp()
+        archivematicaMCP.config.set('MCPServer', 'sharedDirectory', self.shared_directory + '/')
+        os.makedirs(os.path.join(self.shared_directory, 'sip', 'objects'))
+        models.SIP.objects.create(uuid=SIP_UUID, currentpath='%sharedPath%sip/')
+        self._add_file('a.txt', FILE_A)
+        self._add_file('b.txt', FILE_B)
+        self.unit = unitSIP.unitSIP('%sharedPath%sip/', SIP_UUID)
+        self.unit.reloadFileList()
+
+    def tearDown(self):
+        shutil.rmtree(self.shared_directory)
+
+    def _add_file(self, name, uuid=None, filegrpuse='original'):
+        with open(os.path.join(self.shared_directory, 'sip', 'objects', name), 'w') as f:
+            f.write(name)
+        if uuid is not None:
+            self._add_row(name, uuid, filegrpuse)
+
+    def _add_row(self, name, uuid, filegrpuse='original'):
+        models.File.objects.create(uuid=uuid, sip_id=SIP_UUID, filegrpuse=filegrpuse,
+                                   originallocation='%SIPDirectory%objects/' + name,
+                                   currentlocation='%SIPDirectory%objects/' + name)
+
+    def _files(self):
+        return dict((path, (f.UUID, f.fileGrpUse)) for path, f in self.unit.fileList.items())
+
+    def test_unchanged_files(self):
+        with self.assertNumQueries(1):
+            self.unit.reloadFileList()
+        assert self._files() == {
+            '%SIPDirectory%objects/a.txt': (FILE_A, 'original'),
+            '%SIPDirectory%objects/b.txt': (FILE_B, 'original'),
+        }
+
+    def test_modified_files(self):
+        # Rows can change without the file changing on disk
+        models.File.objects.filter(uuid=FILE_A).update(filegrpuse='preservation')
+        models.File.objects.filter(uuid=FILE_B).update(currentlocation='%SIPDirectory%objects/old/b.txt')
+        self._add_row('b.txt', FILE_C)
+        self.unit.reloadFileList()
+        assert self._files() == {
+            '%SIPDirectory%objects/a.txt': (FILE_A, 'preservation'),
+            '%SIPDirectory%objects/b.txt': (FILE_C, 'original'),
+        }
+
+    def test_added_files(self):
+        self._add_file('c.txt', FILE_C)
+        self._add_file('d.txt')
+        self.unit.reloadFileList()
+        assert self._files() == {
+            '%SIPDirectory%objects/a.txt': (FILE_A, 'original'),
+            '%SIPDirectory%objects/b.txt': (FILE_B, 'original'),
+            '%SIPDirectory%objects/c.txt': (FILE_C, 'original'),
+            '%SIPDirectory%objects/d.txt': ('None', 'None'),
+        }
+
+    def test_removed_files(self):
+        os.remove(os.path.join(self.shared_directory, 'sip', 'objects', 'b.txt'))
+        # a.txt was replaced by a new file at the same location
+        models.File.objects.filter(uuid=FILE_A).update(removedtime=timezone.now())
+        self._add_row('a.txt', FILE_A2)
+        self.unit.reloadFileList()
+        assert self._files() == {
+            '%SIPDirectory%objects/a.txt': (FILE_A2, 'original'),
+        }
@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+import watchDirectory
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+def make_watcher(monkeypatch, tmpdir, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(watchDirectory, 'time', clock)
+    watcher = watchDirectory.DirectoryWatcher(use_inotify=False, settle_time=5, **kwargs)
+    watcher.start_dispatcher()
+    picked_up = []
+    watched = str(tmpdir.mkdir('watched'))
+    watcher.watch(watched, callback=lambda path, variables: picked_up.append(os.path.basename(path)))
+    return watcher, clock, watched, picked_up
+
+
+def scan(watcher):
+    """Scan, and wait for the callbacks of what was picked up."""
+    watcher.scan()
+    watcher.callbacks.join()
+
+
+def test_entries_are_picked_up_once_settled(monkeypatch, tmpdir):
+    watcher, clock, watched, picked_up = make_watcher(monkeypatch, tmpdir)
+    with open(os.path.join(watched, 'file.txt'), 'w') as f:
+        f.write('data')
+
+    scan(watcher)
+    assert picked_up == []
+    clock.now += 4
+    scan(watcher)
+    assert picked_up == []
+    clock.now += 2
+    scan(watcher)
+    assert picked_up == ['file.txt']
+    clock.now += 10
+    scan(watcher)
+    assert picked_up == ['file.txt']
+
+
+def test_existing_entries_are_not_picked_up(monkeypatch, tmpdir):
+    watched = tmpdir.mkdir('watched')
+    watched.join('old.txt').write('data')
+    watcher = watchDirectory.DirectoryWatcher(use_inotify=False, settle_time=0)
+    picked_up = []
+    assert watcher.watch(str(watched), callback=lambda path, variables: picked_up.append(path)) == ['old.txt']
+    watcher.scan()
+    assert picked_up == []
+
+
+def test_directories_wait_for_nested_files_to_settle(monkeypatch, tmpdir):
+    watcher, clock, watched, picked_up = make_watcher(monkeypatch, tmpdir)
+    nested = os.path.join(watched, 'transfer', 'objects')
+    os.makedirs(nested)
+    with open(os.path.join(nested, 'image.tif'), 'w') as f:
+        f.write('part 1')
+
+    scan(watcher)
+    clock.now += 4
+    # Still being copied: the top-level directory is unchanged
+    with open(os.path.join(nested, 'image.tif'), 'a') as f:
+        f.write('part 2')
+    scan(watcher)
+    clock.now += 4
+    scan(watcher)
+    assert picked_up == []
+
+    clock.now += 2
+    scan(watcher)
+    assert picked_up == ['transfer']
+
+
+def test_pickup_latency_is_written_to_metrics_file(monkeypatch, tmpdir):
+    metrics_file = str(tmpdir.join('watched_directories.prom'))
+    watcher, clock, watched, picked_up = make_watcher(monkeypatch, tmpdir, metrics_file=metrics_file)
+    with open(os.path.join(watched, 'file.txt'), 'w') as f:
+        f.write('data')
+    modified = os.stat(os.path.join(watched, 'file.txt')).st_mtime
+
+    scan(watcher)
+    clock.now += 6
+    scan(watcher)
+    assert picked_up == ['file.txt']
+
+    assert watcher.stats['dispatched'] == 1
+    assert abs(watcher.stats['latency_last'] - (clock.now - modified)) < 0.001
+    with open(metrics_file) as f:
+        metrics = dict(line.rsplit(' ', 1) for line in f.read().splitlines() if not line.startswith('#'))
+    assert metrics['archivematica_mcp_watched_directory_pickups_total'] == '1'
+    assert abs(float(metrics['archivematica_mcp_watched_directory_pickup_latency_seconds_sum']) - watcher.stats['latency_total']) < 0.001
+    assert abs(float(metrics['archivematica_mcp_watched_directory_pickup_latency_last_seconds']) - watcher.stats['latency_last']) < 0.001
+
+
+def test_waiting_callbacks_do_not_hold_up_scans(tmpdir):
+    watcher = watchDirectory.DirectoryWatcher(use_inotify=False, settle_time=0)
+    watcher.start_dispatcher()
+    release = threading.Event()
+    picked_up = []
+
+    def callback(path, variables):
+        release.wait()
+        picked_up.append(os.path.basename(path))
+    first = str(tmpdir.mkdir('first'))
+    second = str(tmpdir.mkdir('second'))
+    watcher.watch(first, callback=callback)
+    watcher.watch(second, callback=callback)
+
+    tmpdir.join('first', 'a.txt').write('data')
+    watcher.scan()
+    tmpdir.join('second', 'b.txt').write('data')
+    watcher.scan()
+    assert watcher.stats['dispatched'] == 2
+    assert picked_up == []
+
+    release.set()
+    watcher.callbacks.join()
+    assert picked_up == ['a.txt', 'b.txt']
@@ -0,0 +1,94 @@
+import os
+import sys
+import uuid
+
+from django.test import TestCase
+
+from main import models
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+import workflowGraph
+
+TASK_TYPE = '4ad0e7f6-3a6e-4d2f-9d0c-3c1f8e2b6a1d'
+SET_VARIABLE_LINK = '5b3c8268-6b19-4b2c-b7da-ebbe0e1bdbb1'
+LINK_PULL_LINK = 'c4e6c2a7-3f2d-4a2c-9c66-6c1e2b8a0b57'
+MAGIC_LINK_LINK = '0b1f0e77-1fd0-4d2b-8c39-6f3c1a1a7a4e'
+REPLACEMENT_DIC_LINK = '9e7a4f04-0b9f-4bd8-9a3b-4ad43bfbd62c'
+SET_VARIABLE_CONFIG = 'f6df0e8b-ffb4-46e8-8d3b-a8bd3c66b0a3'
+LINK_PULL_CONFIG = '2f3c1ab4-79a3-4bb7-8b49-67b3d3f4b66c'
+MAGIC_LINK_CONFIG = 'e8fe4b4a-a6b1-4b3a-a8f0-2d4f9d4f1c7a'
+REPLACEMENT_DIC = '3e0a9e7c-0fa5-4b8b-8c11-4a1b1e5d2d2b'
+
+
+class TestWorkflowGraph(TestCase):
+
+    def setUp(self):
+        task_type = models.TaskType.objects.create(id=TASK_TYPE, description='test')
+
+        def link(pk, config_pk, next_link=None):
+            task = models.TaskConfig.objects.create(
+                id=str(uuid.uuid4()), tasktype=task_type, tasktypepkreference=config_pk, description=pk)
+            return models.MicroServiceChainLink.objects.create(
+                id=pk, currenttask=task, defaultnextchainlink_id=next_link, microservicegroup='Test')
+
+        link(REPLACEMENT_DIC_LINK, None)
+        link(MAGIC_LINK_LINK, MAGIC_LINK_CONFIG, REPLACEMENT_DIC_LINK)
+        link(LINK_PULL_LINK, LINK_PULL_CONFIG)
+        link(SET_VARIABLE_LINK, SET_VARIABLE_CONFIG)
+        models.MicroServiceChainLinkExitCode.objects.create(
+            microservicechainlink_id=SET_VARIABLE_LINK, exitcode=0, nextmicroservicechainlink_id=LINK_PULL_LINK)
+
+        models.TaskConfigSetUnitVariable.objects.create(
+            id=SET_VARIABLE_CONFIG, variable='next', variablevalue='value', microservicechainlink_id=MAGIC_LINK_LINK)
+        models.TaskConfigUnitVariableLinkPull.objects.create(
+            id=LINK_PULL_CONFIG, variable='next', defaultmicroservicechainlink_id=MAGIC_LINK_LINK)
+        models.TaskConfigAssignMagicLink.objects.create(id=MAGIC_LINK_CONFIG, execute_id=SET_VARIABLE_LINK)
+        models.MicroServiceChoiceReplacementDic.objects.create(
+            id=REPLACEMENT_DIC, choiceavailableatlink_id=REPLACEMENT_DIC_LINK,
+            description='Choice', replacementdic='{"%Choice%": "yes"}')
+        workflowGraph.invalidate()
+
+    def tearDown(self):
+        workflowGraph.invalidate()
+
+    def test_link_transitions_make_no_queries(self):
+        workflowGraph.get_graph()
+        with self.assertNumQueries(0):
+            graph = workflowGraph.get_graph()
+            link = graph.get_link(SET_VARIABLE_LINK)
+            config = graph.get_set_unit_variable_config(link.tasktypepkreference)
+            assert (config.variable, config.variablevalue, config.microservicechainlink_id) == ('next', 'value', MAGIC_LINK_LINK)
+
+            link = graph.get_link(link.next_link(0))
+            assert link.id == LINK_PULL_LINK
+            config = graph.get_unit_variable_link_pull_config(link.tasktypepkreference)
+            assert config.defaultmicroservicechainlink_id == MAGIC_LINK_LINK
+
+            link = graph.get_link(config.defaultmicroservicechainlink_id)
+            assert graph.get_magic_link(link.tasktypepkreference) == SET_VARIABLE_LINK
+
+            link = graph.get_link(link.next_link(0))
+            assert link.id == REPLACEMENT_DIC_LINK
+            dics = graph.get_replacement_dics(link.id)
+            assert [(dic.id, dic.description, dic.replacementdic) for dic in dics] == [
+                (REPLACEMENT_DIC, 'Choice', '{"%Choice%": "yes"}')]
+            assert graph.get_replacement_dic(link.id, REPLACEMENT_DIC) == dics[0]
+
+    def test_missing_configs_raise_does_not_exist(self):
+        graph = workflowGraph.get_graph()
+        with self.assertRaises(models.TaskConfigSetUnitVariable.DoesNotExist):
+            graph.get_set_unit_variable_config(LINK_PULL_CONFIG)
+        with self.assertRaises(models.TaskConfigAssignMagicLink.DoesNotExist):
+            graph.get_magic_link(SET_VARIABLE_CONFIG)
+        with self.assertRaises(models.MicroServiceChoiceReplacementDic.DoesNotExist):
+            graph.get_replacement_dic(SET_VARIABLE_LINK, REPLACEMENT_DIC)
+        assert graph.get_replacement_dics(SET_VARIABLE_LINK) == ()
+
+    def test_saving_task_configs_invalidates_the_graph(self):
+        graph = workflowGraph.get_graph()
+        models.TaskConfigSetUnitVariable.objects.get(id=SET_VARIABLE_CONFIG).save()
+        assert workflowGraph.get_graph() is not graph
+        graph = workflowGraph.get_graph()
+        models.MicroServiceChoiceReplacementDic.objects.get(id=REPLACEMENT_DIC).save()
+        assert workflowGraph.get_graph() is not graph
@@ -22,18 +22,22 @@
 # @author Joseph Perry <joseph@artefactual.com>
 from __future__ import print_function
 
+import itertools
 import logging
 import os
 import string
 import sys
+import threading
+import time
 import uuid
 
 from archivematicaFunctions import strToUnicode
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from django.db.models import Q
+from django.db import close_old_connections, connection, models, transaction
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
-from main.models import Agent, Derivation, Event, File, FileID, FPCommandOutput, Job, SIP, Task, Transfer, UnitVariable
+from main.models import Agent, Derivation, Event, File, FileID, FPCommandOutput, Job, SIP, Task, Transfer, UnitStatus, UnitVariable
 
 LOGGER = logging.getLogger('archivematica.common')
 
@@ -86,6 +90,39 @@ def insertIntoFiles(fileUUID, filePath, enteredSystem=None, transferUUID="", sip
 
     File.objects.create(**kwargs)
 
+# Events created by a single bulk INSERT
+EVENTS_BATCH_SIZE = 500
+
+def _getAMAgents():
+    """Returns the IDs of the Agents representing Archivematica and the repository."""
+    return list(Agent.objects.filter(Q(identifiertype='repository code') | Q(identifiertype='preservation system')).values_list('pk', flat=True))
+
+def _getActiveAgent(sipUUID, transferUUID):
+    """
+    Returns the ID of the current user's Agent for the SIP sipUUID, or failing
+    that for the transfer transferUUID, or None.
+    """
+    for unittype, unituuid in (('SIP', sipUUID), ('Transfer', transferUUID)):
+        if not unituuid:
+            continue
+        try:
+            var = UnitVariable.objects.get(unittype=unittype, unituuid=unituuid,
+                                           variable='activeAgent')
+            return int(var.variablevalue)
+        except UnitVariable.DoesNotExist:
+            pass
+    return None
+
+def _getAMAgentsForUnit(sipUUID, transferUUID, am_agents=None):
+    agents = []
+    agent = _getActiveAgent(sipUUID, transferUUID)
+    if agent is not None:
+        agents.append(agent)
+    if am_agents is None:
+        am_agents = _getAMAgents()
+    agents.extend(am_agents)
+    return agents
+
 def getAMAgentsForFile(fileUUID):
     """
     Fetches the IDs for the Archivematica agents associated with the given file.
@@ -97,34 +134,38 @@ def getAMAgentsForFile(fileUUID):
 
     :returns: A list of Agent IDs
     """
-    agents = []
-
     try:
-        f = File.objects.get(uuid=fileUUID)
+        sipUUID, transferUUID = File.objects.values_list('sip_id', 'transfer_id').get(uuid=fileUUID)
     except File.DoesNotExist:
         LOGGER.warning('File with UUID %s does not exist in database; unable to fetch Agents', fileUUID)
         return []
 
-    # Fetch Agent for the User
-    if f.sip:
-        try:
-            var = UnitVariable.objects.get(unittype='SIP', unituuid=f.sip_id,
-                                           variable='activeAgent')
-            agents.append(int(var.variablevalue))
-        except UnitVariable.DoesNotExist:
-            pass
-    if f.transfer and not agents: # agent hasn't been found yet
-        try:
-            var = UnitVariable.objects.get(unittype='Transfer',
-                                           unituuid=f.transfer_id,
-                                           variable='activeAgent')
-            agents.append(int(var.variablevalue))
-        except UnitVariable.DoesNotExist:
-            pass
-    # Fetch other Archivematica Agents
-    am_agents = Agent.objects.filter(Q(identifiertype='repository code') | Q(identifiertype='preservation system')).values_list('pk', flat=True)
-    agents.extend(am_agents)
-    return agents
+    return _getAMAgentsForUnit(sipUUID, transferUUID)
+
+def _createEventAgents(event_agents):
+    """Links Events to Agents, given (Event ID, list of Agent IDs) pairs."""
+    EventAgent = Event.agents.through
+    rows = []
+    for event_id, agents in event_agents:
+        for agent_id in sorted(set(agents), key=agents.index):
+            rows.append(EventAgent(event_id=event_id, agent_id=agent_id))
+    EventAgent.objects.bulk_create(rows, batch_size=EVENTS_BATCH_SIZE)
+
+def _newEvent(fileUUID, eventIdentifierUUID="", eventType="", eventDateTime=None, eventDetail="", eventOutcome="", eventOutcomeDetailNote=""):
+    if eventDateTime is None:
+        eventDateTime = getUTCDate()
+    if not eventIdentifierUUID:
+        eventIdentifierUUID = str(uuid.uuid4())
+
+    return Event(
+        event_id=eventIdentifierUUID,
+        file_uuid_id=fileUUID,
+        event_type=eventType,
+        event_datetime=eventDateTime,
+        event_detail=eventDetail,
+        event_outcome=eventOutcome,
+        event_outcome_detail=eventOutcomeDetailNote
+    )
 
 def insertIntoEvents(fileUUID, eventIdentifierUUID="", eventType="", eventDateTime=None, eventDetail="", eventOutcome="", eventOutcomeDetailNote="", agents=None):
     """
@@ -139,26 +180,67 @@ def insertIntoEvents(fileUUID, eventIdentifierUUID="", eventType="", eventDateTi
     :param str eventOutcomeDetailNote: Can be blank. Will be used in the eventOutcomeDetailNote element in the AIP METS.
     :param list agents: List of Agent IDs to associate with this. If None provided, automatically fetches Agents representing Archivematica.
     """
-    if eventDateTime is None:
-        eventDateTime = getUTCDate()
-
     # Assume the Agent is Archivematica & the current user
     if not agents:
         agents = getAMAgentsForFile(fileUUID)
-    if not eventIdentifierUUID:
-        eventIdentifierUUID = str(uuid.uuid4())
 
-    event = Event.objects.create(
-        event_id=eventIdentifierUUID,
-        file_uuid_id=fileUUID,
-        event_type=eventType,
-        event_datetime=eventDateTime,
-        event_detail=eventDetail,
-        event_outcome=eventOutcome,
-        event_outcome_detail=eventOutcomeDetailNote
-    )
-    # Splat agents list into multiple arguments
-    event.agents.add(*agents)
+    event = _newEvent(fileUUID, eventIdentifierUUID, eventType, eventDateTime, eventDetail, eventOutcome, eventOutcomeDetailNote)
+    event.save(force_insert=True)
+    _createEventAgents([(event.id, agents)])
+
+def bulkInsertIntoEvents(events, agents=None, batch_size=EVENTS_BATCH_SIZE):
+    """
+    Creates many entries in the Events table, batch_size at a time.
+
+    Unless agents are given, the Agents of each event are those of
+    getAMAgentsForFile, looked up once per SIP or transfer rather than once
+    per file.
+
+    :param events: Iterable of dicts of insertIntoEvents keyword arguments, except agents. fileUUID is required.
+    :param list agents: List of Agent IDs to associate with every event. If None provided, automatically fetches Agents representing Archivematica.
+    :param int batch_size: Number of events written by each INSERT.
+    :returns: The number of events created.
+    """
+    am_agents = None
+    # (SIP UUID, transfer UUID): Agent IDs
+    unit_agents = {}
+    count = 0
+    batch = []
+    for kwargs in itertools.chain(events, [None]):
+        if kwargs is not None:
+            batch.append(_newEvent(**kwargs))
+            if len(batch) < batch_size:
+                continue
+        if not batch:
+            break
+
+        if agents:
+            batch_agents = [agents] * len(batch)
+        else:
+            file_units = dict(
+                (uuid_, (sip_uuid, transfer_uuid)) for uuid_, sip_uuid, transfer_uuid in
+                File.objects.filter(uuid__in=set(e.file_uuid_id for e in batch)).values_list('uuid', 'sip_id', 'transfer_id'))
+            batch_agents = []
+            for event in batch:
+                unit = file_units.get(event.file_uuid_id)
+                if unit is None:
+                    LOGGER.warning('File with UUID %s does not exist in database; unable to fetch Agents', event.file_uuid_id)
+                    batch_agents.append([])
+                    continue
+                if unit not in unit_agents:
+                    if am_agents is None:
+                        am_agents = _getAMAgents()
+                    unit_agents[unit] = _getAMAgentsForUnit(unit[0], unit[1], am_agents)
+                batch_agents.append(unit_agents[unit])
+
+        with transaction.atomic():
+            Event.objects.bulk_create(batch)
+            # bulk_create does not set primary keys on MySQL
+            event_ids = dict(Event.objects.filter(event_id__in=[e.event_id for e in batch]).values_list('event_id', 'id'))
+            _createEventAgents((event_ids[e.event_id], a) for e, a in zip(batch, batch_agents))
+        count += len(batch)
+        batch = []
+    return count
 
 def insertIntoDerivations(sourceFileUUID, derivedFileUUID, relatedEventUUID=None):
     """
@@ -194,6 +276,23 @@ def insertIntoFPCommandOutput(fileUUID="", fitsXMLString="", ruleUUID=""):
 #user approved?
 #client connected/disconnected.
 
+def _task_from_manager(taskManager, commandReplacementDic, taskUUID, arguments):
+    """Returns an unsaved Task for the given linkTaskManager; see logTaskCreatedSQL."""
+    jobUUID = taskManager.jobChainLink.UUID
+    fileUUID = ""
+    if "%fileUUID%" in commandReplacementDic:
+        fileUUID = commandReplacementDic["%fileUUID%"]
+    taskexec = taskManager.execute
+    fileName = os.path.basename(os.path.abspath(commandReplacementDic["%relativeLocation%"]))
+
+    return Task(taskuuid=taskUUID,
+                job_id=jobUUID,
+                fileuuid=fileUUID,
+                filename=fileName,
+                execution=taskexec,
+                arguments=arguments,
+                createdtime=getUTCDate())
+
 def logTaskCreatedSQL(taskManager, commandReplacementDic, taskUUID, arguments):
     """
     Creates a new entry in the Tasks table using the supplied data.
@@ -203,20 +302,7 @@ def logTaskCreatedSQL(taskManager, commandReplacementDic, taskUUID, arguments):
     :param str taskUUID: The UUID to be used for this Task in the database.
     :param str arguments: The arguments to be passed to the command when it is executed, as a string. Can contain replacement variables; see ReplacementDict for supported values.
     """
-    jobUUID = taskManager.jobChainLink.UUID
-    fileUUID = ""
-    if "%fileUUID%" in commandReplacementDic:
-        fileUUID = commandReplacementDic["%fileUUID%"]
-    taskexec = taskManager.execute
-    fileName = os.path.basename(os.path.abspath(commandReplacementDic["%relativeLocation%"]))
-
-    Task.objects.create(taskuuid=taskUUID,
-                        job_id=jobUUID,
-                        fileuuid=fileUUID,
-                        filename=fileName,
-                        execution=taskexec,
-                        arguments=arguments,
-                        createdtime=getUTCDate())
+    _task_from_manager(taskManager, commandReplacementDic, taskUUID, arguments).save(force_insert=True)
 
 def logTaskCompletedSQL(task):
     """
@@ -242,20 +328,164 @@ def logTaskCompletedSQL(task):
     task.stderror = strToUnicode(stdError, obstinate=True)
     task.save()
 
+class TaskJournal(object):
+    """
+    Buffers Task rows created and completed by the MCP server, and writes
+    them in bulk: new rows with bulk_create, completions as grouped UPDATEs.
+
+    Buffers are flushed once `batch_size` entries are waiting and, unless
+    `flush_interval` is None, at least every `flush_interval` seconds by a
+    background thread. Callers must flush() before handing a
+    task to a client, since the client expects the row to exist. Anything
+    lost in a crash is therefore a completion, and the affected rows keep a
+    NULL exitCode, which MCPServer's cleanupOldDbEntriesOnNewRun handles.
+    """
+
+    # Caps on the completions, and on their output in bytes, written by a
+    # single UPDATE
+    UPDATE_ROWS = 100
+    UPDATE_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, batch_size=500, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.created = []
+        # taskUUID: (endtime, exitCode, stdOut, stdError)
+        self.completed = {}
+        self.flusher = None
+
+    def task_created(self, taskManager, commandReplacementDic, taskUUID, arguments):
+        """Buffered equivalent of logTaskCreatedSQL."""
+        task = _task_from_manager(taskManager, commandReplacementDic, taskUUID, arguments)
+        with self.lock:
+            self.created.append(task)
+            full = len(self.created) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+
+    def task_completed(self, task):
+        """Buffered equivalent of logTaskCompletedSQL."""
+        with self.lock:
+            self.completed[str(task.UUID)] = (
+                getUTCDate(),
+                str(task.results["exitCode"]),
+                strToUnicode(task.results["stdOut"], obstinate=True),
+                strToUnicode(task.results["stdError"], obstinate=True),
+            )
+            full = len(self.completed) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything buffered so far. If that fails, the entries are
+        buffered again, to be written by the next flush.
+        """
+        with self.flush_lock:
+            with self.lock:
+                created, self.created = self.created, []
+                completed, self.completed = self.completed, {}
+            if not created and not completed:
+                return
+            _close_old_connections()
+            try:
+                self._write(created, dict(completed))
+            except Exception:
+                with self.lock:
+                    self.created[:0] = created
+                    # Completions buffered since take precedence
+                    completed.update(self.completed)
+                    self.completed = completed
+                raise
+            finally:
+                _close_old_connections()
+            LOGGER.debug('Task journal flushed %d new and %d completed tasks', len(created), len(completed))
+
+    def _write(self, created, completed):
+        with transaction.atomic():
+            if created:
+                # Completions of rows not yet inserted go in with them
+                for task in created:
+                    if task.taskuuid in completed:
+                        task.endtime, task.exitcode, task.stdout, task.stderror = completed.pop(task.taskuuid)
+                Task.objects.bulk_create(created, batch_size=self.batch_size)
+            for chunk in self._update_chunks(completed):
+                self._update(chunk)
+
+    def _update_chunks(self, completed):
+        chunk, size = [], 0
+        for item in completed.iteritems():
+            chunk.append(item)
+            size += len(item[1][2]) + len(item[1][3])
+            if len(chunk) >= self.UPDATE_ROWS or size >= self.UPDATE_BYTES:
+                yield chunk
+                chunk, size = [], 0
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _update(chunk):
+        def case(index, output_field):
+            whens = [When(taskuuid=uuid_, then=Value(values[index])) for uuid_, values in chunk]
+            return Case(*whens, output_field=output_field)
+
+        Task.objects.filter(taskuuid__in=[uuid_ for uuid_, _ in chunk]).update(
+            endtime=case(0, models.DateTimeField()),
+            exitcode=case(1, models.BigIntegerField()),
+            stdout=case(2, models.TextField()),
+            stderror=case(3, models.TextField()),
+        )
+
+    def _start_flusher(self):
+        if self.flusher is not None or self.flush_interval is None:
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_periodically)
+                self.flusher.daemon = True
+                self.flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception('Error flushing task journal')
+
+
+def _close_old_connections():
+    """
+    Close the connection of the current thread if it is broken or has
+    outlived CONN_MAX_AGE. The journal is flushed from long-lived MCPServer
+    threads, whose connections Django's request handling never recycles.
+    """
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+def _jobUnitUUID(job):
+    """ Return the UUID of the unit (SIP, Transfer) a jobChainLink is logged under. """
+    if job.unit.owningUnit != None:
+        return job.unit.owningUnit.UUID
+    return job.unit.UUID
 
 def logJobCreatedSQL(job):
     """
-    Logs a job's properties into the Jobs table in the database.
+    Logs a job's properties into the Jobs table in the database, and updates
+    the status of its unit.
 
     :param jobChainLink job: A jobChainLink instance.
     :returns None:    
     """
-    unitUUID =  job.unit.UUID
+    unitUUID = _jobUnitUUID(job)
     # microseconds are always 6 digits
     # The number returned may have a leading 0 which needs to be preserved
     decDate = getDeciDate("." + str(job.createdDate.microsecond).zfill(6))
-    if job.unit.owningUnit != None:
-        unitUUID = job.unit.owningUnit.UUID 
     Job.objects.create(jobuuid=job.UUID,
                        jobtype=job.description,
                        directory=job.unit.currentPath,
@@ -267,9 +497,22 @@ def logJobCreatedSQL(job):
                        createdtimedec=decDate,
                        microservicechainlink_id=str(job.pk),
                        subjobof=str(job.subJobOf))
+    UnitStatus.objects.refresh(unitUUID)
 
     # TODO -un hardcode executing exeCommand
 
+def logJobStepSQL(job, currentStep):
+    """
+    Sets the current step of a job in the Jobs table, e.g. "Awaiting
+    decision", and updates the status of its unit.
+
+    :param jobChainLink job: A jobChainLink instance.
+    :param str currentStep: The new step.
+    :returns None:
+    """
+    Job.objects.filter(jobuuid=job.UUID).update(currentstep=currentStep)
+    UnitStatus.objects.refresh(_jobUnitUUID(job))
+
 def fileWasRemoved(fileUUID, utcDate=None, eventDetail = "", eventOutcomeDetailNote = "", eventOutcome=""):
     """
     Logs the removal of a file from the database.
@@ -281,24 +524,34 @@ def fileWasRemoved(fileUUID, utcDate=None, eventDetail = "", eventOutcomeDetailN
     :param str eventOutcomeDetailNote: The eventOutcomeDetailNote for the logged event. Can be blank.
     :param str eventOutcome: The eventOutcome for the logged event. Can be blank.
     """
+    filesWereRemoved([fileUUID], utcDate, eventDetail, eventOutcomeDetailNote, eventOutcome)
+
+def filesWereRemoved(fileUUIDs, utcDate=None, eventDetail="", eventOutcomeDetailNote="", eventOutcome=""):
+    """
+    Logs the removal of several files from the database, like fileWasRemoved,
+    with one "file removed" event for each file.
+
+    :param list fileUUIDs:
+    :param datetime utcDate: The date of the removal. Defaults to the current date.
+    :param str eventDetail: The eventDetail for the logged events. Can be blank.
+    :param str eventOutcomeDetailNote: The eventOutcomeDetailNote for the logged events. Can be blank.
+    :param str eventOutcome: The eventOutcome for the logged events. Can be blank.
+    """
     if utcDate is None:
         utcDate = getUTCDate()
-
-    eventIdentifierUUID = uuid.uuid4().__str__()
-    eventType = "file removed"
-    eventDateTime = utcDate
-    insertIntoEvents(fileUUID=fileUUID, \
-                       eventIdentifierUUID=eventIdentifierUUID, \
-                       eventType=eventType, \
-                       eventDateTime=eventDateTime, \
-                       eventDetail=eventDetail, \
-                       eventOutcome=eventOutcome, \
-                       eventOutcomeDetailNote=eventOutcomeDetailNote)
-
-    f = File.objects.get(uuid=fileUUID)
-    f.removedtime = utcDate
-    f.currentlocation = None
-    f.save()
+    fileUUIDs = list(fileUUIDs)
+
+    bulkInsertIntoEvents({
+        'fileUUID': fileUUID,
+        'eventType': "file removed",
+        'eventDateTime': utcDate,
+        'eventDetail': eventDetail,
+        'eventOutcome': eventOutcome,
+        'eventOutcomeDetailNote': eventOutcomeDetailNote,
+    } for fileUUID in fileUUIDs)
+
+    for i in xrange(0, len(fileUUIDs), EVENTS_BATCH_SIZE):
+        File.objects.filter(uuid__in=fileUUIDs[i:i + EVENTS_BATCH_SIZE]).update(removedtime=utcDate, currentlocation=None)
 
 def createSIP(path, UUID=None, sip_type='SIP'):
     """
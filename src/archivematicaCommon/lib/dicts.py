@@ -44,6 +44,32 @@ def replace_string_values(string, **kwargs):
     return rd.replace(string)[0]
 
 
+# Compiled patterns matching any of a set of keys, by the sorted keys
+_replacement_patterns = {}
+
+
+def _replacement_pattern(keys):
+    keys = tuple(sorted(keys))
+    pattern = _replacement_patterns.get(keys)
+    if pattern is None:
+        if len(_replacement_patterns) > 1000:
+            _replacement_patterns.clear()
+        # Longest first, so that a key is never shadowed by its own prefix
+        alternatives = sorted(keys, key=len, reverse=True)
+        pattern = re.compile('|'.join(re.escape(key) for key in alternatives))
+        _replacement_patterns[keys] = pattern
+    return pattern
+
+
+def _config_values():
+    return {
+        'shared_path': config.get('MCPServer', "sharedDirectory"),
+        '%processingDirectory%': config.get('MCPServer', "processingDirectory"),
+        '%watchDirectoryPath%': config.get('MCPServer', "watchDirectoryPath"),
+        '%rejectedDirectory%': config.get('MCPServer', "rejectedDirectory"),
+    }
+
+
 class ReplacementDict(dict):
     @staticmethod
     def fromstring(s):
@@ -93,7 +119,27 @@ class ReplacementDict(dict):
             except:
                 sip = models.Transfer.objects.get(uuid=sip)
 
-        shared_path = config.get('MCPServer', "sharedDirectory")
+        return ReplacementDict._frommodel(type_, sip, file_, expand_path, _config_values())
+
+    @staticmethod
+    def frommodels(files, type_='file', expand_path=True):
+        '''
+        Creates ReplacementDicts for many files at once, yielding
+        (file UUID, ReplacementDict) pairs. Each ReplacementDict is the same
+        as the one returned by frommodel(type_=type_, file_=file_,
+        expand_path=expand_path).
+
+        files must be a queryset of File objects, e.g. all of the files of a
+        SIP. Their SIPs and transfers are fetched along with them, so the
+        whole batch takes a single query.
+        '''
+        settings = _config_values()
+        for file_ in files.select_related('sip', 'transfer').iterator():
+            yield file_.uuid, ReplacementDict._frommodel(type_, None, file_, expand_path, settings)
+
+    @staticmethod
+    def _frommodel(type_, sip, file_, expand_path, settings):
+        shared_path = settings['shared_path']
 
         # We still want to set SIP variables, even if no SIP or Transfer
         # was passed in, so try to fetch it from the file
@@ -161,9 +207,9 @@ class ReplacementDict(dict):
             rd['%fileExtension%'] = ext[1:]
             rd['%fileExtensionWithDot%'] = ext
 
-        rd['%processingDirectory%'] = config.get('MCPServer', "processingDirectory")
-        rd['%watchDirectoryPath%'] = config.get('MCPServer', "watchDirectoryPath")
-        rd['%rejectedDirectory%'] = config.get('MCPServer', "rejectedDirectory")
+        rd['%processingDirectory%'] = settings['%processingDirectory%']
+        rd['%watchDirectoryPath%'] = settings['%watchDirectoryPath%']
+        rd['%rejectedDirectory%'] = settings['%rejectedDirectory%']
 
         return rd
 
@@ -190,13 +236,20 @@ class ReplacementDict(dict):
         contains Unicode characters is "%originalLocation%", and Archivematica
         does not use this variable in any place where precise fidelity of the
         original string is required.
+
+        All keys are substituted in a single pass, so values are inserted
+        as they are: keys appearing in a value are not replaced in turn.
         """
+        values = dict((unicodeToStr(key), unicodeToStr(value)) for key, value in self.items())
         ret = []
+        if values:
+            pattern = _replacement_pattern(values)
+            substitute = lambda match: values[match.group(0)]
         for orig in strings:
             if orig is not None:
                 orig = unicodeToStr(orig)
-                for key, value in self.items():
-                    orig = orig.replace(key, unicodeToStr(value))
+                if values:
+                    orig = pattern.sub(substitute, orig)
             ret.append(orig)
         return ret
 
@@ -26,8 +26,10 @@ from __future__ import absolute_import
 from __future__ import division
 import ConfigParser
 import datetime
+import itertools
 import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import re
 import sys
@@ -36,21 +38,28 @@ from xml.etree import ElementTree
 
 sys.path.append("/usr/share/archivematica/dashboard")
 from django.db.models import Q
-from main.models import File, Transfer
+from main.models import File, FileFormatVersion, Transfer
 
 # archivematicaCommon
 from archivematicaFunctions import get_dashboard_uuid
+from mets_reader import METSReader
 import namespaces as ns
 import version
 
-from externals import xmltodict
-
-from elasticsearch import Elasticsearch, ImproperlyConfigured
+from elasticsearch import Elasticsearch, ImproperlyConfigured, TransportError, helpers
 
 
 logger = logging.getLogger('archivematica.common')
 
-MAX_QUERY_SIZE = 50000  # TODO Check that this is a reasonable number
+# Hits fetched per shard and scroll request by scan_all_results(), and how
+# long the search context is kept between requests
+SCAN_PAGE_SIZE = 500
+SCAN_SCROLL = '1m'
+# Documents sent per _bulk request, and _bulk requests sent at a time
+BULK_CHUNK_SIZE = 500
+BULK_THREADS = 1
+# Statuses of bulk items worth sending again: the node was busy or unavailable
+BULK_RETRY_STATUSES = (429, 502, 503, 504)
 MATCH_ALL_QUERY = {
     "query": {
         "match_all": {}
@@ -94,18 +103,26 @@ class TooManyResultsError(ElasticsearchError):
 
 _es_hosts = None
 _es_client = None
+_bulk_chunk_size = BULK_CHUNK_SIZE
+_bulk_threads = BULK_THREADS
 
 
-def setup(hosts):
+def setup(hosts, bulk_chunk_size=BULK_CHUNK_SIZE, bulk_threads=BULK_THREADS):
     """
     Initialize Elasticsearch client and share it as the attribute _es_client in
     the current module. An additional attribute _es_hosts is defined containing
     the Elasticsearch hosts (expected types are: string, list or tuple).
+
+    bulk_chunk_size and bulk_threads are the defaults used by bulk_index().
     """
     global _es_hosts
     global _es_client
+    global _bulk_chunk_size
+    global _bulk_threads
 
     _es_hosts = hosts
+    _bulk_chunk_size = bulk_chunk_size
+    _bulk_threads = bulk_threads
     _es_client = Elasticsearch(**{
         'hosts': _es_hosts,
         'dead_timeout': 2
@@ -126,7 +143,14 @@ def setup_reading_from_client_conf(config=None):
         hosts = config.get('MCPClient', "elasticsearchServer")
     except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
         hosts = '127.0.0.1:9200'
-    setup(hosts)
+    bulk_options = {}
+    for option, name in (('elasticsearchBulkChunkSize', 'bulk_chunk_size'),
+                         ('elasticsearchBulkThreads', 'bulk_threads')):
+        try:
+            bulk_options[name] = config.getint('MCPClient', option)
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            pass
+    setup(hosts, **bulk_options)
 
 
 def get_host():
@@ -166,13 +190,18 @@ def remove_tool_output_from_mets(doc):
     root = doc.getroot()
 
     # remove tool output nodes
-    toolNodes = root.findall("mets:amdSec/mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectCharacteristics/premis:objectCharacteristicsExtension", namespaces=ns.NSMAP)
+    for amdSec in root.findall("mets:amdSec", namespaces=ns.NSMAP):
+        _remove_tool_output_from_amdsec(amdSec)
+
+    print("Removed FITS output from METS.")
+
+
+def _remove_tool_output_from_amdsec(amdSec):
+    toolNodes = amdSec.findall("mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectCharacteristics/premis:objectCharacteristicsExtension", namespaces=ns.NSMAP)
 
     for parent in toolNodes:
         parent.clear()
 
-    print("Removed FITS output from METS.")
-
 
 def wait_for_cluster_yellow_status(client, wait_between_tries=10, max_tries=10):
     health = {}
@@ -204,13 +233,15 @@ def create_indexes_if_needed(client):
         raise ElasticsearchError('The AIP index mapping is incorrect. The "aips" index should be re-created.')
 
 
-def search_all_results(client, body, index=None, doc_type=None, **query_params):
+def scan_all_results(client, body, index=None, doc_type=None, page_size=None, **query_params):
     """
-    Performs client.search with the size set to MAX_QUERY_SIZE.
+    Iterates over all the hits of a search, in no particular order.
 
-    By default search_raw returns only 10 results.  Since we usually want all
-    results, this is a wrapper that fetches MAX_QUERY_SIZE results and logs a
-    warning if more results were available.
+    client.search only returns the first 10 hits by default. This fetches
+    the hits with the scroll API instead, page_size hits per shard at a time,
+    so that no hit is left out and they are never all held in memory.
+    query_params are passed on to the search, e.g. `fields` or `_source` to
+    only fetch some of the fields of each document.
     """
     if isinstance(index, list):
         index = ','.join(index)
@@ -218,17 +249,15 @@ def search_all_results(client, body, index=None, doc_type=None, **query_params):
     if isinstance(doc_type, list):
         doc_type = ','.join(doc_type)
 
-    results = client.search(
-        body=body,
+    return helpers.scan(
+        client,
+        query=body,
         index=index,
         doc_type=doc_type,
-        size=MAX_QUERY_SIZE,
+        size=page_size or SCAN_PAGE_SIZE,
+        scroll=SCAN_SCROLL,
         **query_params)
 
-    if results['hits']['total'] > MAX_QUERY_SIZE:
-        logger.warning('Number of items in backlog (%s) exceeds maximum amount fetched (%s)', results['hits']['total'], MAX_QUERY_SIZE)
-    return results
-
 
 def get_type_mapping(client, index, type):
     return client.indices.get_mapping(index, doc_type=type)[index]['mappings']
@@ -403,8 +432,7 @@ def index_aip(client, uuid, name, filePath, pathToMETS, size=None, aips_in_aic=N
         is_part_of = dublincore.findtext('dcterms:isPartOf', namespaces=ns.NSMAP)
 
     # convert METS XML to dict
-    xml = ElementTree.tostring(root)
-    mets_data = rename_dict_keys_with_child_dicts(normalize_dict_values(xmltodict.parse(xml)))
+    mets_data = rename_dict_keys_with_child_dicts(normalize_dict_values(xml_element_to_dict(root)))
 
     aipData = {
         'uuid': uuid,
@@ -441,6 +469,113 @@ def try_to_index(client, data, index, doc_type, wait_between_tries=10, max_tries
     raise
 
 
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bulk_index_chunk(client, documents, index, doc_type, wait_between_tries, max_tries):
+    """
+    Index `documents` with one _bulk request, sending the documents that
+    failed for a transient reason again, up to max_tries times.
+
+    Returns the number of documents indexed and the errors of the others.
+    """
+    indexed = 0
+    errors = []
+    for attempt in xrange(1, max_tries + 1):
+        body = []
+        for document in documents:
+            body.append({'index': {'_index': index, '_type': doc_type}})
+            body.append(document)
+
+        retry = []
+        retry_errors = []
+        try:
+            items = client.bulk(body=body)['items']
+        except TransportError as e:
+            logger.warning('Bulk request of %d documents failed: %s', len(documents), e)
+            retry = documents
+            retry_errors = [str(e)] * len(documents)
+        else:
+            for document, item in zip(documents, items):
+                result = item.values()[0]
+                status = result.get('status', 500)
+                if 200 <= status < 300:
+                    indexed += 1
+                elif status in BULK_RETRY_STATUSES:
+                    retry.append(document)
+                    retry_errors.append(result.get('error'))
+                else:
+                    errors.append(result.get('error'))
+
+        if not retry:
+            break
+        if attempt < max_tries:
+            logger.info('Retrying %d documents', len(retry))
+            time.sleep(wait_between_tries)
+        documents = retry
+    else:
+        errors.extend(retry_errors)
+
+    return indexed, errors
+
+
+def bulk_index(client, documents, index, doc_type, chunk_size=None, threads=None, wait_between_tries=10, max_tries=10):
+    """
+    Index the dicts in `documents` with the _bulk API, `chunk_size` documents
+    per request and `threads` requests at a time.
+
+    Documents are taken from `documents` as they are sent, so it can be a
+    generator. Documents that fail for a transient reason are sent again, up
+    to max_tries times. ElasticsearchError is raised once all documents have
+    been sent if any of them could not be indexed.
+
+    Returns the number of documents indexed.
+    """
+    if max_tries < 1:
+        raise ValueError("max_tries must be 1 or greater")
+    chunk_size = chunk_size or _bulk_chunk_size
+    threads = threads or _bulk_threads
+
+    def index_chunk(chunk):
+        return _bulk_index_chunk(client, chunk, index, doc_type, wait_between_tries, max_tries)
+
+    indexed = 0
+    errors = []
+    chunks = _chunks(documents, chunk_size)
+    # Only `threads` chunks are read ahead, so memory use does not depend on
+    # the number of documents
+    pool = ThreadPool(threads) if threads > 1 else None
+    try:
+        while True:
+            batch = list(itertools.islice(chunks, threads))
+            if not batch:
+                break
+            if pool is None:
+                results = [index_chunk(chunk) for chunk in batch]
+            else:
+                results = pool.map(index_chunk, batch)
+            for chunk_indexed, chunk_errors in results:
+                indexed += chunk_indexed
+                errors.extend(chunk_errors)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if errors:
+        logger.error('%d documents could not be indexed in %s/%s: %s', len(errors), index, doc_type, errors[:10])
+        raise ElasticsearchError('{} document(s) could not be indexed; first error: {}'.format(len(errors), errors[0]))
+    return indexed
+
+
 def get_aip_data(client, uuid, fields=None):
     search_params = {
         'body': {
@@ -501,25 +636,93 @@ def index_files(client, index, type_, uuid, pathToArchive, identifiers=[], sipNa
     return 0
 
 
+def _xml_text(text):
+    # Like expat, which xmltodict uses, split character data at line breaks
+    # and drop the runs that are only whitespace
+    if not text:
+        return ''
+    return ''.join(run for run in text.split('\n') if run.strip())
+
+
+def _qualified_names(element):
+    # Same as ElementTree._namespaces(), which only accepts ElementTree
+    # elements: the prefix:name tostring() gives to every tag and attribute
+    # name in element, and the prefixes of the namespaces used
+    qnames = {}
+    namespaces = {}
+    for el in element.iter():
+        if not isinstance(el.tag, basestring):
+            continue  # Comment or processing instruction
+        for name in [el.tag] + el.keys():
+            if name in qnames:
+                continue
+            if name[:1] != '{':
+                qnames[name] = name
+                continue
+            uri, local = name[1:].rsplit('}', 1)
+            prefix = namespaces.get(uri)
+            if prefix is None:
+                prefix = ElementTree._namespace_map.get(uri) or 'ns%d' % len(namespaces)
+                if prefix != 'xml':
+                    namespaces[uri] = prefix
+            qnames[name] = '%s:%s' % (prefix, local)
+    return qnames, namespaces
+
+
+def _element_to_dict(element, qnames, attributes):
+    item = attributes
+    for key, value in element.items():
+        item['@' + qnames[key]] = value
+    data = _xml_text(element.text)
+    for child in element:
+        if isinstance(child.tag, basestring):
+            key = qnames[child.tag]
+            value = _element_to_dict(child, qnames, {})
+            if key not in item:
+                item[key] = value
+            elif isinstance(item[key], list):
+                item[key].append(value)
+            else:
+                item[key] = [item[key], value]
+        data += _xml_text(child.tail)
+
+    if not item:
+        return data or None
+    if data:
+        item['#text'] = data
+    return item
+
+
+def xml_element_to_dict(element):
+    """
+    Convert an ElementTree element to a dict.
+
+    The result is the same as xmltodict.parse(ElementTree.tostring(element)),
+    namespace prefixes and declarations included, so documents built from it
+    match those already indexed, but the element is not serialized and
+    parsed again. lxml elements are accepted as well.
+    """
+    qnames, namespaces = _qualified_names(element)
+    declarations = {'@xmlns:' + prefix: uri for uri, prefix in namespaces.items()}
+    return {qnames[element.tag]: _element_to_dict(element, qnames, declarations)}
+
+
 def _extract_transfer_metadata(doc):
-    return [xmltodict.parse(ElementTree.tostring(el))['transfer_metadata']
+    return [xml_element_to_dict(el)['transfer_metadata']
             for el in doc.findall("mets:amdSec/mets:sourceMD/mets:mdWrap/mets:xmlData/transfer_metadata", namespaces=ns.NSMAP)]
 
 
 def index_mets_file_metadata(client, uuid, metsFilePath, index, type_, sipName, identifiers=[]):
-    # parse XML
-    tree = ElementTree.parse(metsFilePath)
-    root = tree.getroot()
-
-    # TODO add a conditional to toggle this
-    remove_tool_output_from_mets(tree)
+    # parse XML, except for the files' amdSecs, which are read one at a time
+    # below; the transfer metadata is in sourceMDs
+    reader = METSReader(metsFilePath, keep=['sourceMD'])
+    root = reader.root
 
     # get SIP-wide dmdSec
     dmdSec = root.findall("mets:dmdSec/mets:mdWrap/mets:xmlData", namespaces=ns.NSMAP)
     dmdSecData = {}
     for item in dmdSec:
-        xml = ElementTree.tostring(item)
-        dmdSecData = xmltodict.parse(xml)
+        dmdSecData = xml_element_to_dict(item)
 
     # Extract isPartOf (for AIPs) or identifier (for AICs) from DublinCore
     dublincore = root.find('mets:dmdSec/mets:mdWrap/mets:xmlData/dcterms:dublincore', namespaces=ns.NSMAP)
@@ -552,57 +755,55 @@ def index_mets_file_metadata(client, uuid, metsFilePath, index, type_, sipName,
         'transferMetadata': _extract_transfer_metadata(root),
     }
 
-    # Index all files in a fileGrup with USE='original' or USE='metadata'
-    original_files = root.findall("mets:fileSec/mets:fileGrp[@USE='original']/mets:file", namespaces=ns.NSMAP)
-    metadata_files = root.findall("mets:fileSec/mets:fileGrp[@USE='metadata']/mets:file", namespaces=ns.NSMAP)
-    files = original_files + metadata_files
-
-    # Index AIC METS file if it exists
-    for file_ in files:
-        indexData = fileData.copy() # Deep copy of dict, not of dict contents
-
-        # Get file UUID.  If and ADMID exists, look in the amdSec for the UUID,
-        # otherwise parse it out of the file ID.
-        # 'Original' files have ADMIDs, 'Metadata' files don't
-        admID = file_.attrib.get('ADMID', None)
-        if admID is None:
-            # Parse UUID from file ID
-            fileUUID = None
-            uuix_regex = r'\w{8}-?\w{4}-?\w{4}-?\w{4}-?\w{12}'
-            uuids = re.findall(uuix_regex, file_.attrib['ID'])
-            # Multiple UUIDs may be returned - if they are all identical, use that
-            # UUID, otherwise use None.
-            # To determine all UUIDs are identical, use the size of the set
-            if len(set(uuids)) == 1:
-                fileUUID = uuids[0]
-        else:
-            amdSecInfo = root.find("mets:amdSec[@ID='{}']".format(admID), namespaces=ns.NSMAP)
-            fileUUID = amdSecInfo.findtext("mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectIdentifier/premis:objectIdentifierValue", namespaces=ns.NSMAP)
+    def documents():
+        # Index all files in a fileGrup with USE='original' or USE='metadata'
+        for file_ in reader.files(uses=('original', 'metadata')):
+            indexData = fileData.copy() # Deep copy of dict, not of dict contents
+            # Documents are sent in chunks, so each needs its own METS dict
+            indexData['METS'] = {
+                'dmdSec': fileData['METS']['dmdSec'],
+                'amdSec': {},
+            }
 
-            # Index amdSec information
-            xml = ElementTree.tostring(amdSecInfo)
-            indexData['METS']['amdSec'] = rename_dict_keys_with_child_dicts(normalize_dict_values(xmltodict.parse(xml)))
+            # Get file UUID.  If and ADMID exists, look in the amdSec for the UUID,
+            # otherwise parse it out of the file ID.
+            # 'Original' files have ADMIDs, 'Metadata' files don't
+            amdSecInfo = file_.amdsec
+            if amdSecInfo is None:
+                # Parse UUID from file ID
+                fileUUID = None
+                uuix_regex = r'\w{8}-?\w{4}-?\w{4}-?\w{4}-?\w{12}'
+                uuids = re.findall(uuix_regex, file_.id)
+                # Multiple UUIDs may be returned - if they are all identical, use that
+                # UUID, otherwise use None.
+                # To determine all UUIDs are identical, use the size of the set
+                if len(set(uuids)) == 1:
+                    fileUUID = uuids[0]
+            else:
+                # TODO add a conditional to toggle this
+                _remove_tool_output_from_amdsec(amdSecInfo)
+                fileUUID = amdSecInfo.findtext("mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectIdentifier/premis:objectIdentifierValue", namespaces=ns.NSMAP)
 
-        indexData['FILEUUID'] = fileUUID
+                # Index amdSec information
+                indexData['METS']['amdSec'] = rename_dict_keys_with_child_dicts(normalize_dict_values(xml_element_to_dict(amdSecInfo)))
 
-        # Get file path from FLocat and extension
-        filePath = file_.find('mets:FLocat', namespaces=ns.NSMAP).attrib['{http://www.w3.org/1999/xlink}href']
-        indexData['filePath'] = filePath
-        _, fileExtension = os.path.splitext(filePath)
-        if fileExtension:
-            indexData['fileExtension'] = fileExtension[1:].lower()
+            indexData['FILEUUID'] = fileUUID
 
-        # index data
-        wait_for_cluster_yellow_status(client)
-        result = try_to_index(client, indexData, index, type_)
+            # Get file path from FLocat and extension
+            filePath = file_.path
+            indexData['filePath'] = filePath
+            _, fileExtension = os.path.splitext(filePath)
+            if fileExtension:
+                indexData['fileExtension'] = fileExtension[1:].lower()
 
-        # Reset fileData['METS']['amdSec'], since it is updated in the loop
-        # above. See http://stackoverflow.com/a/3975388 for explanation
-        fileData['METS']['amdSec'] = {}
+            yield indexData
+
+    wait_for_cluster_yellow_status(client)
+    files_indexed = bulk_index(client, documents(), index, type_)
 
     print('Indexed AIP files and corresponding METS XML.')
 
-    return len(files)
+    return files_indexed
 
 
 # To avoid Elasticsearch schema collisions, if a dict value is itself a
@@ -658,13 +859,19 @@ def normalize_list_dict_elements(data):
     return data
 
 
-def _get_file_formats(f):
-    formats = []
-    fields = ['format_version__pronom_id',
+def _get_file_formats(transfer_uuid):
+    """
+    Return the formats of the files of a transfer, as lists of dicts by file
+    UUID.
+    """
+    formats = {}
+    fields = ['file_uuid_id',
+              'format_version__pronom_id',
               'format_version__description',
               'format_version__format__group__description']
-    for puid, format, group in f.fileformatversion_set.all().values_list(*fields):
-        formats.append({
+    file_formats = FileFormatVersion.objects.filter(file_uuid__transfer_id=transfer_uuid)
+    for file_uuid, puid, format, group in file_formats.values_list(*fields):
+        formats.setdefault(file_uuid, []).append({
             'puid': puid,
             'format': format,
             'group': group,
@@ -727,7 +934,6 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
         trailing / but not including objects/
     index, type: index and type in ElasticSearch
     """
-    files_indexed = 0
     ingest_date = str(datetime.datetime.today())[0:10]
 
     # Some files should not be indexed
@@ -747,18 +953,21 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
     # Get dashboard UUID
     dashboard_uuid = get_dashboard_uuid()
 
-    for filepath in list_files_in_dir(pathToTransfer):
-        if os.path.isfile(filepath):
+    # Look up the UUIDs and formats of all the transfer's files at once
+    file_uuids = dict(File.objects.filter(transfer_id=uuid).values_list('currentlocation', 'uuid'))
+    file_formats = _get_file_formats(uuid)
+
+    def documents():
+        for filepath in list_files_in_dir(pathToTransfer, []):
+            if not os.path.isfile(filepath):
+                continue
             # Get file UUID
-            file_uuid = ''
             relative_path = filepath.replace(pathToTransfer, '%transferDirectory%')
-            try:
-                f = File.objects.get(currentlocation=relative_path,
-                                     transfer_id=uuid)
-                file_uuid = f.uuid
-                formats = _get_file_formats(f)
+            file_uuid = file_uuids.get(relative_path)
+            if file_uuid:
+                formats = file_formats.get(file_uuid, [])
                 bulk_extractor_reports = _list_bulk_extractor_reports(pathToTransfer, file_uuid)
-            except File.DoesNotExist:
+            else:
                 file_uuid = ''
                 formats = []
                 bulk_extractor_reports = []
@@ -767,15 +976,16 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
             relative_path = relative_path.replace('%transferDirectory%', transfer_name+'/')
             file_extension = os.path.splitext(filepath)[1][1:].lower()
             filename = os.path.basename(filepath)
+            stat = os.stat(filepath)
             # Size in megabytes
-            size = os.path.getsize(filepath) / (1024 * 1024)
-            create_time = os.stat(filepath).st_ctime
+            size = stat.st_size / (1024 * 1024)
+            create_time = stat.st_ctime
 
             if filename not in ignore_files:
                 print('Indexing {} (UUID: {})'.format(relative_path, file_uuid))
 
                 # TODO Index Backlog Location UUID?
-                indexData = {
+                yield {
                   'filename'     : filename,
                   'relative_path': relative_path,
                   'fileuuid'     : file_uuid,
@@ -791,14 +1001,12 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
                   'bulk_extractor_reports': bulk_extractor_reports,
                   'format'       : formats,
                 }
-
-                wait_for_cluster_yellow_status(client)
-                try_to_index(client, indexData, index, type_)
-
-                files_indexed = files_indexed + 1
             else:
                 print('Skipping indexing {}'.format(relative_path))
 
+    wait_for_cluster_yellow_status(client)
+    files_indexed = bulk_index(client, documents(), index, type_)
+
     if files_indexed > 0:
         client.indices.refresh()
 
@@ -820,8 +1028,6 @@ def list_files_in_dir(path, filepaths=[]):
 
 
 def _document_ids_from_field_query(client, index, doc_types, field, value):
-    document_ids = []
-
     # Escape /'s with \\
     searchvalue = value.replace('/', '\\/')
     query = {
@@ -831,16 +1037,15 @@ def _document_ids_from_field_query(client, index, doc_types, field, value):
             }
         }
     }
-    documents = search_all_results(
+    documents = scan_all_results(
         client,
         body=query,
-        doc_type=doc_types
+        index=index,
+        doc_type=doc_types,
+        _source=False,
     )
 
-    if len(documents['hits']['hits']) > 0:
-        document_ids = [d['_id'] for d in documents['hits']['hits']]
-
-    return document_ids
+    return [d['_id'] for d in documents]
 
 
 def document_id_from_field_query(client, index, doc_types, field, value):
@@ -852,12 +1057,15 @@ def document_id_from_field_query(client, index, doc_types, field, value):
             }
         }
     }
-    documents = search_all_results(
-        client,
+    # Only whether there is exactly one match matters
+    documents = client.search(
         body=query,
-        doc_type=doc_types
+        index=index,
+        doc_type=','.join(doc_types),
+        size=1,
+        _source=False,
     )
-    if len(documents['hits']['hits']) == 1:
+    if documents['hits']['total'] == 1:
         document_id = documents['hits']['hits'][0]['_id']
     return document_id
 
@@ -942,15 +1150,15 @@ def get_transfer_file_info(client, field, value):
             }
         }
     }
-    documents = search_all_results(client, body=query, index=indicies)
-    result_count = len(documents['hits']['hits'])
+    documents = list(scan_all_results(client, body=query, index=indicies))
+    result_count = len(documents)
     if result_count == 1:
-        results = documents['hits']['hits'][0]['_source']
+        results = documents[0]['_source']
     elif result_count > 1:
         # Elasticsearch was sometimes ranking results for a different filename above
         # the actual file being queried for; in that case only consider results
         # where the value is an actual precise match.
-        filtered_results = [results for results in documents['hits']['hits']
+        filtered_results = [results for results in documents
                             if results['_source'][field] == value]
 
         result_count = len(filtered_results)
@@ -982,6 +1190,12 @@ def remove_sip_transfer_files(client, uuid):
 
 
 def remove_transfer_files(client, uuid, unit_type=None):
+    """
+    Remove the transferfile documents of a transfer, or of the transfers the
+    files of a SIP come from.
+
+    Returns the number of documents deleted.
+    """
     if unit_type == 'transfer':
         transfers = {uuid}
     else:
@@ -989,15 +1203,71 @@ def remove_transfer_files(client, uuid, unit_type=None):
         transfers = {f[0] for f in File.objects.filter(condition).values_list('transfer_id')}
 
     if len(transfers) > 0:
-        for transfer in transfers:
-            files = _document_ids_from_field_query(client, 'transfers', ['transferfile'], 'sipuuid', transfer)
-            if len(files) > 0:
-                for f in files:
-                    client.delete('transfers', 'transferfile', f)
+        query = {
+            'query': {
+                'terms': {
+                    'sipuuid': sorted(transfers)
+                }
+            }
+        }
+        return delete_documents(client, 'transfers', 'transferfile', query)
     else:
         if not unit_type:
             unit_type = 'transfer or SIP'
         logger.warning("No transfers found for %s %s", unit_type, uuid)
+        return 0
+
+
+def delete_documents(client, index, doc_type, query, chunk_size=None):
+    """
+    Deletes all documents in index & doc_type matching query.
+
+    Delete-by-query is used if the cluster supports it. Otherwise, or if it
+    fails on some shards, the matching documents are deleted with _bulk
+    requests of chunk_size documents, logging progress after each of them.
+
+    :param Elasticsearch client: Elasticsearch client
+    :param str index: Name of the index. E.g. 'transfers'
+    :param str doc_type: Document type in the index. E.g. 'transferfile'
+    :param dict query: Body of the search for the documents to delete
+    :return: Number of documents deleted
+    """
+    total = client.count(index=index, doc_type=doc_type, body=query)['count']
+    if total == 0:
+        return 0
+    logger.info('Deleting %d documents from %s/%s', total, index, doc_type)
+
+    try:
+        results = client.delete_by_query(index=index, doc_type=doc_type, body=query)
+    except TransportError as e:
+        # Delete-by-query is a plugin from Elasticsearch 2.0
+        logger.info('Delete by query failed, deleting documents in bulk: %s', e)
+    else:
+        shards = results['_indices'][index]['_shards']
+        if shards['successful'] == shards['total']:
+            logger.info('Deleted %d documents from %s/%s', total, index, doc_type)
+            return total
+        logger.warning('Delete by query failed on %d of %d shards, deleting the remaining documents in bulk',
+                       shards['total'] - shards['successful'], shards['total'])
+
+    chunk_size = chunk_size or _bulk_chunk_size
+    done = 0
+    errors = []
+    hits = scan_all_results(client, query, index=index, doc_type=doc_type, _source=False)
+    for chunk in _chunks(hits, chunk_size):
+        body = [{'delete': {'_index': hit['_index'], '_type': hit['_type'], '_id': hit['_id']}} for hit in chunk]
+        for item in client.bulk(body=body)['items']:
+            result = item['delete']
+            # 404: already deleted, e.g. by the delete-by-query
+            if result.get('status', 500) >= 300 and result.get('status') != 404:
+                errors.append(result.get('error'))
+        done += len(chunk)
+        logger.info('Deleted %d of %d documents from %s/%s', done - len(errors), total, index, doc_type)
+
+    if errors:
+        logger.error('Failed to delete %d documents from %s/%s, first error: %s', len(errors), index, doc_type, errors[0])
+        raise ElasticsearchError('Failed to delete %d documents from %s/%s' % (len(errors), index, doc_type))
+    return total
 
 
 def delete_aip(client, uuid):
@@ -1079,16 +1349,16 @@ def normalize_results_dict(d):
     return {k: v[0] for k, v in d['fields'].items()}
 
 
-def augment_raw_search_results(raw_results):
+def augment_raw_search_results(hits):
     """
-    This function takes JSON returned by an ES query and returns the source document for each result.
+    This function takes the hits of an ES query and returns the source document for each result.
 
-    :param raw_results: the raw JSON result from an elastic search query
+    :param hits: the hits of an elastic search query, e.g. from scan_all_results
     :return: JSON result simplified, with document_id set
     """
     modifiedResults = []
 
-    for item in raw_results['hits']['hits']:
+    for item in hits:
         clone = item['_source'].copy()
         clone['document_id'] = item[u'_id']
         modifiedResults.append(clone)
@@ -21,14 +21,154 @@
 # @author Joseph Perry <joseph@artefactual.com>
 
 from __future__ import print_function
+import collections
+import shutil
 import subprocess
 import shlex
+import tempfile
+import threading
+import time
 import uuid
 import os
 import sys
 
+# Bytes read from a process's output at a time when capturing it
+CHUNK_SIZE = 64 * 1024
 
-def launchSubProcess(command, stdIn="", printing=True, arguments=[], env_updates={}):
+
+class OutputCapture(object):
+    """
+    Collects the output of a stream, keeping at most `limit` bytes of it in
+    memory: the first and last limit / 2 bytes. Output longer than that is
+    returned by getvalue() with the middle cut out.
+
+    If `path` is set, output longer than `limit` is saved there in full, and
+    getvalue() says so. Until it is known to be needed, the full output is
+    kept in a temporary file, in memory up to `limit` bytes and on disk past
+    that.
+    """
+
+    def __init__(self, limit, path=None):
+        self.limit = limit
+        self.path = path
+        self.size = 0
+        self.head = []
+        self.head_size = 0
+        self.tail = collections.deque()
+        self.tail_size = 0
+        self.spool = None
+        if path:
+            self.spool = tempfile.SpooledTemporaryFile(max_size=limit)
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.size += len(data)
+        if self.spool is not None:
+            self.spool.write(data)
+        half = self.limit // 2
+        if self.head_size < half:
+            chunk = data[:half - self.head_size]
+            self.head.append(chunk)
+            self.head_size += len(chunk)
+            data = data[len(chunk):]
+        if data:
+            self.tail.append(data)
+            self.tail_size += len(data)
+            while self.tail_size - len(self.tail[0]) >= half:
+                self.tail_size -= len(self.tail.popleft())
+
+    def read_from(self, stream):
+        """Write everything read from stream until it is closed."""
+        for data in iter(lambda: stream.read(CHUNK_SIZE), ''):
+            self.write(data)
+
+    def truncated(self):
+        return self.size > self.limit
+
+    def getvalue(self):
+        head = ''.join(self.head)
+        tail = ''.join(self.tail)
+        if not self.truncated():
+            return head + tail
+        tail = tail[len(tail) - (self.limit - len(head)):]
+        omitted = self.size - len(head) - len(tail)
+        note = '{0} bytes omitted'.format(omitted)
+        if self.spool is not None:
+            self.save()
+            note += '; full output saved to {0}'.format(self.path)
+        return '{0}\n[... {1} ...]\n{2}'.format(head, note, tail)
+
+    def save(self):
+        if self.spool is None:
+            return
+        self.spool.seek(0)
+        with open(self.path, 'wb') as f:
+            shutil.copyfileobj(self.spool, f)
+        self.close()
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
+def purgeOutputFiles(directory, max_age):
+    """
+    Delete the files in directory, such as output saved by OutputCapture,
+    last modified more than max_age seconds ago. Returns how many were
+    deleted.
+    """
+    cutoff = time.time() - max_age
+    deleted = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                deleted += 1
+        except OSError:
+            # Removed by another client sharing the directory
+            pass
+    return deleted
+
+
+def _communicate(p, stdin_string, output_limit, output_paths):
+    """
+    Like p.communicate(stdin_string), but with stdout and stderr collected by
+    OutputCapture instances, so that no more than output_limit bytes of each
+    are held in memory.
+    """
+    stdout_path, stderr_path = output_paths or (None, None)
+    captures = [
+        (p.stdout, OutputCapture(output_limit, stdout_path)),
+        (p.stderr, OutputCapture(output_limit, stderr_path)),
+    ]
+    readers = []
+    for stream, capture in captures:
+        t = threading.Thread(target=capture.read_from, args=(stream,))
+        t.daemon = True
+        t.start()
+        readers.append(t)
+    if p.stdin is not None:
+        try:
+            if stdin_string:
+                p.stdin.write(stdin_string)
+        except IOError:
+            # The process exited without reading all of its input
+            pass
+        p.stdin.close()
+    for t in readers:
+        t.join()
+    p.wait()
+    try:
+        return tuple(capture.getvalue() for _, capture in captures)
+    finally:
+        for _, capture in captures:
+            capture.close()
+
+
+def launchSubProcess(command, stdIn="", printing=True, arguments=[], env_updates={}, output_limit=None, output_paths=None):
     """
     Launches a subprocess using ``command``, where ``command`` is either:
     a) a single string containing a commandline statement, or
@@ -49,6 +189,12 @@ def launchSubProcess(command, stdIn="", printing=True, arguments=[], env_updates
                 only honoured if ``command`` is an array, and will be ignored
                 if ``command`` is a string.
     env_updates: Dict of changes to apply to the started process' environment.
+    output_limit: Maximum number of bytes of each of standard output and
+                standard error to return. Past it, only the beginning and
+                end of the output are returned, and no more than this is
+                held in memory at once. Default is None, for no limit.
+    output_paths: Tuple of the paths to save standard output and standard
+                error to, if longer than output_limit. Default is None.
     """
     stdError = ""
     stdOut = ""
@@ -78,7 +224,10 @@ def launchSubProcess(command, stdIn="", printing=True, arguments=[], env_updates
             raise Exception("stdIn must be a string or a file object")
 
         p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=stdin_pipe, env=my_env)
-        stdOut, stdError = p.communicate(input=stdin_string)
+        if output_limit:
+            stdOut, stdError = _communicate(p, stdin_string, output_limit, output_paths)
+        else:
+            stdOut, stdError = p.communicate(input=stdin_string)
         #append the output to stderror and stdout
         if printing:
             print(stdOut)
@@ -113,7 +262,7 @@ def createAndRunScript(text, stdIn="", printing=True, arguments=[], env_updates=
     return ret
 
 
-def executeOrRun(type, text, stdIn="", printing=True, arguments=[], env_updates={}):
+def executeOrRun(type, text, stdIn="", printing=True, arguments=[], env_updates={}, output_limit=None, output_paths=None):
     """
     Attempts to run the provided command on the shell, with the text of
     "stdIn" passed as standard input if provided. The type parameter
@@ -141,9 +290,11 @@ def executeOrRun(type, text, stdIn="", printing=True, arguments=[], env_updates=
                 honoured if ``command`` is an array, and will be ignored if ``command``
                 is a string.
     env_updates: Dict of changes to apply to the started process' environment.
+    output_limit, output_paths: See launchSubProcess. Only honoured for the
+                "command" type.
     """
     if type == "command":
-        return launchSubProcess(text, stdIn=stdIn, printing=printing, arguments=arguments, env_updates=env_updates)
+        return launchSubProcess(text, stdIn=stdIn, printing=printing, arguments=arguments, env_updates=env_updates, output_limit=output_limit, output_paths=output_paths)
     if type == "bashScript":
         text = "#!/bin/bash\n" + text
         return createAndRunScript(text, stdIn=stdIn, printing=printing, arguments=arguments, env_updates=env_updates)
@@ -34,6 +34,9 @@ import MySQLdb
 from archivematicaFunctions import unicodeToStr, get_setting, get_file_checksum
 
 sys.path.append("/usr/share/archivematica/dashboard")
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from main.models import File, Transfer
 
 def updateSizeAndChecksum(fileUUID, filePath, date, eventIdentifierUUID, fileSize=None, checksum=None, checksumType=None, add_event=True):
@@ -137,23 +140,41 @@ def updateDirectoryLocation(src, dst, unitPath, unitIdentifier, unitIdentifierTy
     if not dstDB.endswith("/") and dstDB != unitPathReplaceWith:
         dstDB += "/"
 
-    kwargs = {
-        "removedtime__isnull": True,
-        "currentlocation__startswith": srcDB,
-        unitIdentifierType: unitIdentifier
-    }
-    files = File.objects.filter(**kwargs)
-
-    for f in files:
-        f.currentlocation = f.currentlocation.replace(srcDB, dstDB)
-        f.save()
     if os.path.isdir(dst):
         if dst.endswith("/"):
             dst += "."
         else:
             dst += "/."
-    print("moving: ", src, dst)
-    shutil.move(src, dst)
+    # The new locations are only committed if the move succeeds
+    with transaction.atomic():
+        updateLocationPrefix(srcDB, dstDB, unitIdentifier, unitIdentifierType)
+        print("moving: ", src, dst)
+        shutil.move(src, dst)
+
+def updateLocationPrefix(srcDB, dstDB, unitIdentifier, unitIdentifierType):
+    """
+    Updates the location of every file of a unit under srcDB to be under dstDB
+    instead, with a single UPDATE. Does not move anything on disk.
+
+    :param str srcDB: Prefix of the current locations, e.g. "%SIPDirectory%objects/old/"
+    :param str dstDB: Prefix to replace it with
+    :param str unitIdentifier: UUID of the SIP or transfer
+    :param str unitIdentifierType: Field with the unit's UUID, e.g. "sip_id" or "transfer_id"
+    :returns: The number of files updated
+    """
+    srcDB = unicodeToStr(srcDB)
+    dstDB = unicodeToStr(dstDB)
+    kwargs = {
+        "removedtime__isnull": True,
+        "currentlocation__startswith": srcDB,
+        unitIdentifierType: unitIdentifier
+    }
+    # currentLocation is a blob, so SUBSTRING counts bytes, like len() of the
+    # encoded prefix
+    new_location = Concat(Value(dstDB), Substr('currentlocation', len(srcDB) + 1),
+                          output_field=models.TextField())
+    with transaction.atomic():
+        return File.objects.filter(**kwargs).update(currentlocation=new_location)
 
 def updateFileLocation2(src, dst, unitPath, unitIdentifier, unitIdentifierType, unitPathReplaceWith):
     """Dest needs to be the actual full destination path with filename."""
@@ -162,18 +183,17 @@ def updateFileLocation2(src, dst, unitPath, unitIdentifier, unitIdentifierType,
     # Fetch the file UUID
     kwargs = {
         "removedtime__isnull": True,
-        "currentlocation": srcDB,
         unitIdentifierType: unitIdentifier
     }
 
     try:
-        f = File.objects.get(**kwargs)
+        f = File.objects.at_location(srcDB).get(**kwargs)
     except (File.DoesNotExist, File.MultipleObjectsReturned) as e:
         if isinstance(e, File.DoesNotExist):
             message = "no results found"
         else:
             message = "multiple results found"
-        print('ERROR: file information not found:', message, "for arguments:", repr(kwargs), file=sys.stderr)
+        print('ERROR: file information not found:', message, "for location:", repr(srcDB), "and arguments:", repr(kwargs), file=sys.stderr)
         exit(4)
 
     # Move the file
@@ -197,7 +217,6 @@ def updateFileLocation(src, dst, eventType="", eventDateTime="", eventDetail="",
     if not fileUUID or fileUUID == "None":
         kwargs = {
             "removedtime__isnull": True,
-            "currentlocation": src
         }
 
         if sipUUID:
@@ -207,7 +226,7 @@ def updateFileLocation(src, dst, eventType="", eventDateTime="", eventDetail="",
         else:
             raise ValueError("One of fileUUID, sipUUID, or transferUUID must be provided")
 
-        f = File.objects.get(**kwargs)
+        f = File.objects.at_location(src).get(**kwargs)
     else:
         f = File.objects.get(uuid=fileUUID)
 
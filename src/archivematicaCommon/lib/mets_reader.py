@@ -0,0 +1,205 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2016 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage archivematicaCommon
+
+"""
+Streaming reader for the METS files of large AIPs.
+
+Most of a METS file is made of amdSecs, one or more per file, holding the
+file's techMDs (with the output of characterization tools), rightsMDs and
+digiprovMDs. METSReader reads those one at a time with iterparse and drops
+each one once it has been used, so memory use depends on the size of one
+file's metadata rather than on the size of the package. The rest of the
+document (metsHdr, dmdSecs, structMap) is small and kept as a tree, the
+`tree` attribute, which can be queried like the tree from etree.parse().
+"""
+
+from collections import namedtuple
+import logging
+
+from lxml import etree
+
+import namespaces as ns
+
+logger = logging.getLogger('archivematica.common')
+
+METS_AMDSEC = ns.metsBNS + 'amdSec'
+METS_FILE = ns.metsBNS + 'file'
+METS_FILESEC = ns.metsBNS + 'fileSec'
+METS_FLOCAT = ns.metsBNS + 'FLocat'
+XLINK_HREF = ns.xlinkBNS + 'href'
+
+_METSFileBase = namedtuple('METSFile', ['id', 'use', 'admid', 'path', 'amdsec'])
+
+
+class METSFile(_METSFileBase):
+    """
+    A mets:file entry of the fileSec, with the amdSec it refers to.
+
+    `use` is the USE of the entry's fileGrp and `path` its FLocat. `amdsec`
+    is the amdSec Element, or None if the file has none; it is only valid
+    until the next file is read.
+    """
+    __slots__ = ()
+
+    def _subsections(self, name):
+        if self.amdsec is None:
+            return []
+        return self.amdsec.findall('mets:' + name, namespaces=ns.NSMAP)
+
+    @property
+    def techmds(self):
+        return self._subsections('techMD')
+
+    @property
+    def current_techmd(self):
+        """The techMD that has not been superseded, or None."""
+        for techmd in self.techmds:
+            if techmd.get('STATUS') != 'superseded':
+                return techmd
+        return None
+
+    @property
+    def rightsmds(self):
+        return self._subsections('rightsMD')
+
+    @property
+    def digiprovmds(self):
+        return self._subsections('digiprovMD')
+
+
+def _file_entry(element):
+    flocat = element.find(METS_FLOCAT)
+    return METSFile(
+        id=element.get('ID'),
+        use=element.getparent().get('USE'),
+        admid=element.get('ADMID'),
+        path=flocat.get(XLINK_HREF) if flocat is not None else None,
+        amdsec=None)
+
+
+def file_records(root):
+    """
+    Yield the METSFile of every file in the fileSec of an already parsed
+    METS, in document order.
+    """
+    amdsecs = {amdsec.get('ID'): amdsec for amdsec in root.findall('mets:amdSec', namespaces=ns.NSMAP)}
+    for element in root.findall('mets:fileSec//mets:file', namespaces=ns.NSMAP):
+        entry = _file_entry(element)
+        if entry.admid:
+            entry = entry._replace(amdsec=amdsecs.get(entry.admid.split()[0]))
+        yield entry
+
+
+class METSReader(object):
+    """
+    Reads the METS file at `path`, one amdSec at a time.
+
+    Creating the reader reads the file once, keeping the fileSec entries and
+    everything but the amdSecs; the amdSec subsections named in `keep` (e.g.
+    'sourceMD') are kept in `tree` as well. files() and amdsecs() read the
+    amdSecs again each time they are called.
+    """
+
+    def __init__(self, path, keep=()):
+        self.path = path
+        self.keep = set(keep)
+        self.entries = []
+        self.tree = self._scan()
+
+    def _scan(self):
+        context = etree.iterparse(self.path, events=('end',), tag=(METS_AMDSEC, METS_FILE))
+        for _, element in context:
+            parent = element.getparent()
+            if element.tag == METS_FILE:
+                self.entries.append(_file_entry(element))
+                parent.remove(element)
+                continue
+            for subsection in list(element):
+                if not isinstance(subsection.tag, basestring) or etree.QName(subsection).localname not in self.keep:
+                    element.remove(subsection)
+            if len(element) == 0:
+                parent.remove(element)
+        return context.root.getroottree()
+
+    @property
+    def root(self):
+        return self.tree.getroot()
+
+    def amdsecs(self):
+        """
+        Yield the amdSec Elements of the METS in document order.
+
+        Each amdSec is cleared when the next one is read, so it must not be
+        used afterwards; one that is kept by stopping the iteration stays
+        whole.
+        """
+        context = etree.iterparse(self.path, events=('start', 'end'), tag=(METS_AMDSEC, METS_FILESEC))
+        for event, element in context:
+            # The amdSecs all come before the fileSec
+            if element.tag == METS_FILESEC:
+                break
+            if event != 'end':
+                continue
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        del context
+
+    def find_amdsec(self, path):
+        """Return the first amdSec containing a match for `path`, or None."""
+        for amdsec in self.amdsecs():
+            if amdsec.find(path, namespaces=ns.NSMAP) is not None:
+                return amdsec
+        return None
+
+    def files(self, uses=None):
+        """
+        Yield the METSFile of every file in the fileSec, or of those in
+        fileGrps with a USE in `uses`.
+
+        Files are read in the order of their amdSecs; those without one come
+        last.
+        """
+        by_amdsec = {}
+        without_amdsec = []
+        for entry in self.entries:
+            if uses is not None and entry.use not in uses:
+                continue
+            if entry.admid:
+                by_amdsec.setdefault(entry.admid.split()[0], []).append(entry)
+            else:
+                without_amdsec.append(entry)
+
+        if by_amdsec:
+            for amdsec in self.amdsecs():
+                for entry in by_amdsec.pop(amdsec.get('ID'), ()):
+                    yield entry._replace(amdsec=amdsec)
+                if not by_amdsec:
+                    break
+
+        for entries in by_amdsec.values():
+            for entry in entries:
+                logger.warning('amdSec %s of file %s not found in %s', entry.admid, entry.id, self.path)
+                without_amdsec.append(entry)
+        for entry in without_amdsec:
+            yield entry
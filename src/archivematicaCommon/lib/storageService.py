@@ -1,10 +1,17 @@
 from __future__ import absolute_import
 import base64
+import copy
+import itertools
 import logging
 import os
 import platform
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
+from requests.packages.urllib3.util.retry import Retry
 import slumber
 import urllib
 
@@ -13,6 +20,28 @@ from archivematicaFunctions import get_setting
 
 LOGGER = logging.getLogger("archivematica.common")
 
+# Seconds the pipeline, locations and spaces are reused for before being
+# fetched again
+CACHE_TTL = 300
+# Times idempotent requests are retried after a connection error or a read
+# timeout, waiting RETRY_BACKOFF * 2 ** (retry - 1) seconds in between
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+# Files fetched per request by iter_file_info, and requests made at a time
+# once the number of files is known
+FILE_INFO_PAGE_SIZE = 100
+FILE_INFO_THREADS = 4
+
+# The slumber API shared by all callers in this process, and the (pid,
+# settings) it was created for
+_api = None
+_api_for = None
+_api_lock = threading.Lock()
+
+# key: (expiry time, value)
+_cache = {}
+_cache_lock = threading.Lock()
+
 
 class ResourceNotFound(Exception):
     pass
@@ -37,6 +66,34 @@ class TastypieApikeyAuth(AuthBase):
         return r
 
 
+def _cached(key, fetch):
+    """
+    Return the value cached under `key`, calling fetch() to get it if it is
+    not cached or is older than CACHE_TTL seconds. None is not cached.
+
+    Callers get their own copy of the value, which they may modify.
+    """
+    now = time.time()
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and entry[0] > now:
+        return copy.deepcopy(entry[1])
+    value = fetch()
+    if value is not None:
+        with _cache_lock:
+            _cache[key] = (now + CACHE_TTL, value)
+    return copy.deepcopy(value)
+
+
+def invalidate_cache():
+    """
+    Forget the cached pipeline, locations and spaces, e.g. after changing
+    the storage service settings.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
 def _storage_service_url():
     # Get storage service URL from DashboardSetting model
     storage_service_url = get_setting('storage_service_url', None)
@@ -51,20 +108,58 @@ def _storage_service_url():
     return storage_service_url
 
 
+def _storage_settings():
+    """
+    Returns the storage API URL, username and API key.
+
+    They are read every time, as invalidate_cache() only affects the
+    process that changed them.
+    """
+    return (
+        _storage_service_url(),
+        get_setting('storage_service_user', 'test'),
+        get_setting('storage_service_apikey', None),
+    )
+
+
+def _storage_session(username, api_key):
+    """ Returns a requests session with pooled connections and retries. """
+    session = requests.Session()
+    session.auth = TastypieApikeyAuth(username, api_key)
+    # Only idempotent methods are retried; error responses are not, so they
+    # reach the caller as slumber exceptions
+    adapter = HTTPAdapter(max_retries=Retry(total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 def _storage_api():
-    """ Returns slumber access to storage API. """
-    storage_service_url = _storage_service_url()
-    username = get_setting('storage_service_user', 'test')
-    api_key = get_setting('storage_service_apikey', None)
-    api = slumber.API(storage_service_url, auth=TastypieApikeyAuth(username, api_key))
-    return api
+    """
+    Returns slumber access to storage API.
+
+    The API, and the connections of its session, are shared by all callers
+    in the process. A new one is created when the settings change, and in
+    processes forked after it was created.
+    """
+    global _api, _api_for
+    settings = _storage_settings()
+    key = (os.getpid(), settings)
+    with _api_lock:
+        if _api is None or _api_for != key:
+            storage_service_url, username, api_key = settings
+            _api = slumber.API(storage_service_url, session=_storage_session(username, api_key))
+            _api_for = key
+        return _api
 
 def _storage_api_params():
     """ Returns API GET params username=USERNAME&api_key=KEY """
-    username = get_setting('storage_service_user', 'test')
-    api_key = get_setting('storage_service_apikey', None)
+    _, username, api_key = _storage_settings()
     return urllib.urlencode({'username': username, 'api_key': api_key})
 
+def _dashboard_uuid():
+    return _cached('dashboard_uuid', lambda: get_setting('dashboard_uuid'))
+
 def _storage_relative_from_absolute(location_path, space_path):
     """ Strip space_path and next / from location_path. """
     location_path = os.path.normpath(location_path)
@@ -80,7 +175,7 @@ def _storage_relative_from_absolute(location_path, space_path):
 def create_pipeline(create_default_locations=False, shared_path=None, api_username=None, api_key=None):
     api = _storage_api()
     pipeline = {
-        'uuid': get_setting('dashboard_uuid'),
+        'uuid': _dashboard_uuid(),
         'description': "Archivematica on {}".format(platform.node()),
         'create_default_locations': create_default_locations,
         'shared_path': shared_path,
@@ -99,9 +194,15 @@ def create_pipeline(create_default_locations=False, shared_path=None, api_userna
             pass
         else:
             raise
+    finally:
+        invalidate_cache()
     return True
 
 def _get_pipeline(uuid):
+    """ Returns the pipeline with `uuid`, or None. Cached for CACHE_TTL seconds. """
+    return _cached(('pipeline', uuid), lambda: _fetch_pipeline(uuid))
+
+def _fetch_pipeline(uuid):
     api = _storage_api()
     try:
         pipeline = api.pipeline(uuid).get()
@@ -124,16 +225,22 @@ def get_location(path=None, purpose=None, space=None):
         purposes, found in storage_service.locations.models.py
     path: Path to location.  If a space is passed in, paths starting with /
         have the space's path stripped.
+
+    Results are cached for CACHE_TTL seconds.
     """
-    api = _storage_api()
-    offset = 0
-    return_locations = []
     if space and path:
         path = _storage_relative_from_absolute(path, space['path'])
         space = space['uuid']
-    pipeline = _get_pipeline(get_setting('dashboard_uuid'))
+    pipeline = _get_pipeline(_dashboard_uuid())
     if pipeline is None:
         return None
+    return _cached(('location', pipeline['uuid'], path, purpose, space),
+                   lambda: _fetch_locations(pipeline, path, purpose, space))
+
+def _fetch_locations(pipeline, path, purpose, space):
+    api = _storage_api()
+    offset = 0
+    return_locations = []
     while True:
         locations = api.location.get(pipeline__uuid=pipeline['uuid'],
                                      relative_path=path,
@@ -151,9 +258,8 @@ def get_location(path=None, purpose=None, space=None):
 
 def get_location_by_uri(uri):
     """ Get a specific location by the URI.  Only returns one location. """
-    api = _storage_api()
     # TODO check that location is associated with this pipeline
-    return api.location(uri).get()
+    return _cached(('location_uri', uri), lambda: _storage_api().location(uri).get())
 
 def browse_location(uuid, path):
     """
@@ -179,7 +285,7 @@ def copy_files(source_location, destination_location, files, api=None):
     """
     if api is None:
         api = _storage_api()
-    pipeline = _get_pipeline(get_setting('dashboard_uuid'))
+    pipeline = _get_pipeline(_dashboard_uuid())
     move_files = {
         'origin_location': source_location['resource_uri'],
         'files': files,
@@ -237,7 +343,13 @@ def get_space(access_protocol=None, path=None):
 
     access_protocol: How the storage is accessed.  Should reference storage
         service purposes, in storage_service.locations.models.py
+
+    Results are cached for CACHE_TTL seconds.
     """
+    return _cached(('space', access_protocol, path),
+                   lambda: _fetch_spaces(access_protocol, path))
+
+def _fetch_spaces(access_protocol, path):
     api = _storage_api()
     offset = 0
     return_spaces = []
@@ -264,7 +376,7 @@ def create_file(uuid, origin_location, origin_path, current_location,
     """
 
     api = _storage_api()
-    pipeline = _get_pipeline(get_setting('dashboard_uuid'))
+    pipeline = _get_pipeline(_dashboard_uuid())
     if pipeline is None:
         return (None, 'Pipeline not available, see logs.')
     new_file = {
@@ -306,32 +418,82 @@ def get_file_info(uuid=None, origin_location=None, origin_path=None,
     """
     # TODO Need a better way to deal with mishmash of relative and absolute
     # paths coming in
+    return_files = list(iter_file_info(uuid=uuid,
+                                       origin_location=origin_location,
+                                       origin_path=origin_path,
+                                       current_location=current_location,
+                                       current_path=current_path,
+                                       package_type=package_type,
+                                       status=status))
+    LOGGER.info("Files returned: {}".format(len(return_files)))
+    LOGGER.debug("Files returned: {}".format(return_files))
+    return return_files
+
+def iter_file_info(fields=None, page_size=None, threads=None, **filters):
+    """ Yields the files matching `filters`, one page at a time.
+
+    Takes the same filters as get_file_info. Once the first page has given
+    the number of files, the following pages are fetched `threads` at a time.
+    With `fields`, a list of field names, only those fields of each file are
+    kept.
+    """
+    page_size = page_size or FILE_INFO_PAGE_SIZE
+    threads = threads or FILE_INFO_THREADS
     api = _storage_api()
-    offset = 0
-    return_files = []
-    while True:
-        files = api.file.get(uuid=uuid,
-                             origin_location=origin_location,
-                             origin_path=origin_path,
-                             current_location=current_location,
-                             current_path=current_path,
-                             package_type=package_type,
-                             status=status,
-                             offset=offset)
-        LOGGER.debug("Files retrieved: {}".format(files))
-        return_files += files['objects']
-        if not files['meta']['next']:
-            break
-        offset += files['meta']['limit']
 
-    LOGGER.info("Files returned: {}".format(return_files))
-    return return_files
+    def fetch(offset, limit=page_size):
+        return api.file.get(offset=offset, limit=limit, **filters)
+
+    def objects(page):
+        if fields is None:
+            return page['objects']
+        return [{field: file_.get(field) for field in fields} for file_ in page['objects']]
+
+    page = fetch(0)
+    for file_ in objects(page):
+        yield file_
+    # The storage service may return fewer files per page than asked for
+    limit = page['meta']['limit']
+    if not limit:
+        return
+    offsets = iter(xrange(limit, page['meta']['total_count'], limit))
+
+    pool = ThreadPool(threads) if threads > 1 else None
+    try:
+        while True:
+            batch = list(itertools.islice(offsets, threads))
+            if not batch:
+                break
+            if pool is None:
+                pages = [fetch(offset, limit) for offset in batch]
+            else:
+                pages = pool.map(lambda offset: fetch(offset, limit), batch)
+            for page in pages:
+                for file_ in objects(page):
+                    yield file_
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Files added since the first page was fetched
+    while page['meta']['next']:
+        page = fetch(page['meta']['offset'] + limit, limit)
+        for file_ in objects(page):
+            yield file_
+
+def get_file_status(uuid):
+    """ Returns the status of the package with `uuid`, or None if the storage service does not know it. """
+    files = _storage_api().file.get(uuid=uuid, limit=1)['objects']
+    if not files:
+        return None
+    return files[0]['status']
 
 def download_file_url(file_uuid):
     """
     Returns URL to storage service for downloading `file_uuid`.
     """
-    storage_service_url = _storage_service_url()
+    storage_service_url = _storage_settings()[0]
     params = _storage_api_params()
     download_url = "{base_url}file/{uuid}/download/?{params}".format(
         base_url=storage_service_url, uuid=file_uuid, params=params)
@@ -341,7 +503,7 @@ def extract_file_url(file_uuid, relative_path):
     """
     Returns URL to storage service for `relative_path` in `file_uuid`.
     """
-    storage_service_url = _storage_service_url()
+    storage_service_url = _storage_settings()[0]
     api_params = _storage_api_params()
     download_url = "{base_url}file/{uuid}/extract_file/?relative_path_to_file={path}&{params}".format(
         base_url=storage_service_url, uuid=file_uuid, path=relative_path, params=api_params)
@@ -360,7 +522,7 @@ def pointer_file_url(file_uuid):
     """
     Returns URL to storage service for pointer file for `file_uuid`.
     """
-    storage_service_url = _storage_service_url()
+    storage_service_url = _storage_settings()[0]
     params = _storage_api_params()
     download_url = "{base_url}file/{uuid}/pointer_file/?{params}".format(
         base_url=storage_service_url, uuid=file_uuid, params=params)
@@ -378,7 +540,7 @@ def request_reingest(package_uuid, reingest_type, processing_config):
     """
     api = _storage_api()
     api_request = {
-        'pipeline': get_setting('dashboard_uuid'),
+        'pipeline': _dashboard_uuid(),
         'reingest_type': reingest_type,
         'processing_config': processing_config,
     }
@@ -402,7 +564,7 @@ def request_file_deletion(uuid, user_id, user_email, reason_for_deletion):
     api = _storage_api()
     api_request = {
         'event_reason': reason_for_deletion,
-        'pipeline':     get_setting('dashboard_uuid'),
+        'pipeline':     _dashboard_uuid(),
         'user_email':   user_email,
         'user_id':      user_id
     }
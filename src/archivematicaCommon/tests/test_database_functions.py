@@ -1,4 +1,6 @@
 # -*- coding: UTF-8 -*-
+import datetime
+import json
 import os
 import sys
 
@@ -6,9 +8,11 @@ sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import databaseFunctions
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import Agent, Event, File
+from main.models import Agent, Event, File, Job, SIP, Task, UnitStatus
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 import pytest
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -81,6 +85,46 @@ class TestDatabaseFunctions(TestCase):
         assert agents.get(id=2)
         assert agents.get(id=5)
 
+    # bulkInsertIntoEvents
+
+    def _event_agents(self, event_id):
+        return set(Event.objects.get(event_id=event_id).agents.values_list('id', flat=True))
+
+    def test_bulk_insert_into_events(self):
+        files = ["88c8f115-80bc-4da4-a1e6-0158f5df13b9", "1f4af873-8d60-4907-a92e-d1889e643524", "d4e599bd-f9ab-48d4-9ae7-9e87d4ac1619"] * 2
+        events = [{'fileUUID': f, 'eventIdentifierUUID': 'bulk_event_%d' % i, 'eventType': 'fixity check'}
+                  for i, f in enumerate(files)]
+        assert databaseFunctions.bulkInsertIntoEvents(events, batch_size=4) == 6
+        for i, f in enumerate(files):
+            event = Event.objects.get(event_id='bulk_event_%d' % i)
+            assert event.file_uuid_id == f
+            assert event.event_type == 'fixity check'
+        assert self._event_agents('bulk_event_0') == self._event_agents('bulk_event_3') == {1, 2, 5}
+        assert self._event_agents('bulk_event_1') == {1, 2, 10}
+        assert self._event_agents('bulk_event_2') == {1, 2}
+
+    def test_bulk_insert_into_events_fetches_agents_once_per_unit(self):
+        events = ({'fileUUID': "88c8f115-80bc-4da4-a1e6-0158f5df13b9"} for _ in range(10))
+        with CaptureQueriesContext(connection) as queries:
+            databaseFunctions.bulkInsertIntoEvents(events, batch_size=3)
+        assert len([q for q in queries.captured_queries if 'UnitVariables' in q['sql']]) == 1
+        assert Event.objects.filter(file_uuid_id="88c8f115-80bc-4da4-a1e6-0158f5df13b9", agents=5).count() == 10
+
+    def test_bulk_insert_into_events_with_agents(self):
+        events = [{'fileUUID': "88c8f115-80bc-4da4-a1e6-0158f5df13b9", 'eventIdentifierUUID': 'bulk_agent'}]
+        databaseFunctions.bulkInsertIntoEvents(events, agents=[3])
+        assert self._event_agents('bulk_agent') == {3}
+
+    # filesWereRemoved
+
+    def test_files_were_removed(self):
+        files = ["88c8f115-80bc-4da4-a1e6-0158f5df13b9", "1f4af873-8d60-4907-a92e-d1889e643524"]
+        databaseFunctions.filesWereRemoved(files, eventDetail="removed")
+        for f in File.objects.filter(uuid__in=files):
+            assert f.removedtime is not None
+            assert f.currentlocation is None
+        assert Event.objects.filter(file_uuid_id__in=files, event_type="file removed", event_detail="removed").count() == 2
+
     # getAccessionNumberFromTransfer
 
     def test_get_accession_number_from_transfer(self):
@@ -91,3 +135,130 @@ class TestDatabaseFunctions(TestCase):
         with pytest.raises(ValueError) as excinfo:
             databaseFunctions.getAccessionNumberFromTransfer("no such transfer")
         assert "No Transfer found" in str(excinfo.value)
+
+    # logJobCreatedSQL, logJobStepSQL
+
+    def _job_chain_link(self, uuid, unit_uuid, created):
+        class unitSIP(object):
+            UUID = unit_uuid
+            owningUnit = None
+            currentPath = "%sharedPath%currentlyProcessing/sip-" + unit_uuid + "/"
+
+        class FakeJobChainLink(object):
+            UUID = uuid
+            unit = unitSIP()
+            description = "Job " + uuid
+            microserviceGroup = "Group"
+            createdDate = created
+            pk = "d9e3e6d5-5b4b-4c3a-9a5c-7c1f7b3d0e11"
+            subJobOf = ""
+
+        return FakeJobChainLink()
+
+    def test_job_changes_update_unit_status(self):
+        sip_uuid = "b266cd28-108c-41b3-9a49-a3d775ee6e76"
+        first = self._job_chain_link("3b2b6f1c-0000-4000-8000-000000000001", sip_uuid, datetime.datetime(2016, 1, 1, 0, 0, 0, 100))
+        second = self._job_chain_link("3b2b6f1c-0000-4000-8000-000000000002", sip_uuid, datetime.datetime(2016, 1, 1, 0, 0, 5, 200))
+        databaseFunctions.logJobCreatedSQL(first)
+        databaseFunctions.logJobCreatedSQL(second)
+        databaseFunctions.logJobStepSQL(first, "Completed successfully")
+
+        status = UnitStatus.objects.get(unituuid=sip_uuid)
+        assert status.unittype == "unitSIP"
+        assert status.directory == "sip"
+        assert status.latestjobtime == Job.objects.get(jobuuid=second.UUID).createdtime
+        jobs = json.loads(status.jobs)
+        assert [(job["uuid"], job["currentstep"]) for job in jobs] == [
+            (second.UUID, "Executing command(s)"), (first.UUID, "Completed successfully")]
+        assert not status.hidden
+
+        SIP.objects.filter(uuid=sip_uuid).update(hidden=True)
+        SIP.objects.get(uuid=sip_uuid).save()
+        assert UnitStatus.objects.get(unituuid=sip_uuid).hidden
+
+    # TaskJournal
+
+    def _journal_task_manager(self):
+        class FakeJobChainLink(object):
+            UUID = "0fd4a7a4-7ab3-4b88-b5a1-2b7cd6f1d1f1"
+
+        class FakeTaskManager(object):
+            jobChainLink = FakeJobChainLink()
+            execute = "test_v0.0"
+
+        return FakeTaskManager()
+
+    def _journal_completed_task(self, uuid, exit_code, stdout):
+        class FakeTask(object):
+            UUID = uuid
+            results = {"exitCode": exit_code, "stdOut": stdout, "stdError": ""}
+
+        return FakeTask()
+
+    def test_task_journal_buffers_created_tasks_until_flushed(self):
+        journal = databaseFunctions.TaskJournal(batch_size=10, flush_interval=None)
+        replacements = {"%fileUUID%": "88c8f115-80bc-4da4-a1e6-0158f5df13b9", "%relativeLocation%": "%SIPDirectory%objects/file.txt"}
+        journal.task_created(self._journal_task_manager(), replacements, "journal_task", "args")
+        assert Task.objects.filter(taskuuid="journal_task").count() == 0
+
+        journal.flush()
+        task = Task.objects.get(taskuuid="journal_task")
+        assert task.filename == "file.txt"
+        assert task.exitcode is None
+
+    def test_task_journal_flushes_at_batch_size(self):
+        journal = databaseFunctions.TaskJournal(batch_size=2, flush_interval=None)
+        replacements = {"%relativeLocation%": "%SIPDirectory%"}
+        journal.task_created(self._journal_task_manager(), replacements, "journal_task_1", "args")
+        assert Task.objects.filter(taskuuid__startswith="journal_task").count() == 0
+        journal.task_created(self._journal_task_manager(), replacements, "journal_task_2", "args")
+        assert Task.objects.filter(taskuuid__startswith="journal_task").count() == 2
+
+    def test_task_journal_updates_completed_tasks(self):
+        journal = databaseFunctions.TaskJournal(batch_size=10, flush_interval=None)
+        replacements = {"%relativeLocation%": "%SIPDirectory%"}
+        for uuid in ("journal_task_1", "journal_task_2"):
+            journal.task_created(self._journal_task_manager(), replacements, uuid, "args")
+        journal.flush()
+
+        journal.task_completed(self._journal_completed_task("journal_task_1", 0, "first"))
+        journal.task_completed(self._journal_completed_task("journal_task_2", 1, "second"))
+        journal.flush()
+        first = Task.objects.get(taskuuid="journal_task_1")
+        second = Task.objects.get(taskuuid="journal_task_2")
+        assert (first.exitcode, first.stdout) == (0, "first")
+        assert (second.exitcode, second.stdout) == (1, "second")
+        assert first.endtime is not None
+
+    def test_task_journal_inserts_completion_with_pending_task(self):
+        journal = databaseFunctions.TaskJournal(batch_size=10, flush_interval=None)
+        replacements = {"%relativeLocation%": "%SIPDirectory%"}
+        journal.task_created(self._journal_task_manager(), replacements, "journal_task", "args")
+        journal.task_completed(self._journal_completed_task("journal_task", 0, "done"))
+        journal.flush()
+        task = Task.objects.get(taskuuid="journal_task")
+        assert (task.exitcode, task.stdout) == (0, "done")
+
+    def test_task_journal_keeps_entries_when_flush_fails(self):
+        journal = databaseFunctions.TaskJournal(batch_size=10, flush_interval=None)
+        replacements = {"%relativeLocation%": "%SIPDirectory%"}
+        journal.task_created(self._journal_task_manager(), replacements, "journal_task_1", "args")
+        journal.flush()
+        journal.task_created(self._journal_task_manager(), replacements, "journal_task_2", "args")
+        journal.task_completed(self._journal_completed_task("journal_task_1", 0, "first"))
+        journal.task_completed(self._journal_completed_task("journal_task_2", 1, "second"))
+
+        def fail(chunk):
+            raise Exception("Lost connection")
+        journal._update = fail
+        with pytest.raises(Exception):
+            journal.flush()
+        assert Task.objects.filter(taskuuid="journal_task_2").count() == 0
+        assert Task.objects.get(taskuuid="journal_task_1").exitcode is None
+
+        del journal._update
+        journal.flush()
+        first = Task.objects.get(taskuuid="journal_task_1")
+        second = Task.objects.get(taskuuid="journal_task_2")
+        assert (first.exitcode, first.stdout) == (0, "first")
+        assert (second.exitcode, second.stdout) == (1, "second")
@@ -115,3 +115,21 @@ def test_replacementdict_replace_returns_bytestring():
     d = ReplacementDict({'%originalLocation%': '\x82\xdb\x82\xc1\x82\xd5\x82\xe9\x83\x81\x83C\x83\x8b'})
     out_str = d.replace(in_str)[0]
     assert type(out_str) == str
+
+
+def test_replacementdict_replace_single_pass():
+    d = ReplacementDict({'%SIPDirectory%': '/sip/', '%SIPDirectoryBasename%': 'sip', '%foo%': '%SIPDirectory%'})
+    assert d.replace('%SIPDirectory%%SIPDirectoryBasename%', '%foo%', None) == ['/sip/sip', '%SIPDirectory%', None]
+
+
+class FakeQuerySet(list):
+    def select_related(self, *fields):
+        return self
+
+    def iterator(self):
+        return iter(self)
+
+
+def test_replacementdict_model_constructor_many_files():
+    rds = dict(ReplacementDict.frommodels(FakeQuerySet([FILE]), type_='file'))
+    assert rds == {FILE.uuid: ReplacementDict.frommodel(file_=FILE, type_='file')}
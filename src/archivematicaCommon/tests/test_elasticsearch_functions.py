@@ -1,5 +1,6 @@
 import os
 import sys
+from xml.etree import ElementTree
 
 from elasticsearch import Elasticsearch
 import pytest
@@ -8,6 +9,7 @@ import vcr
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import elasticSearchFunctions
+from externals import xmltodict
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -90,3 +92,117 @@ class TestElasticSearchFunctions(unittest.TestCase):
     def test_set_tags_fails_when_file_cant_be_found(self):
         with pytest.raises(elasticSearchFunctions.EmptySearchResultError):
             elasticSearchFunctions.set_file_tags(self.client, 'no_such_file', [])
+
+
+class FakeBulkClient(object):
+    """Answers _bulk requests with the statuses given for each document."""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = []
+
+    def bulk(self, body):
+        documents = body[1::2]
+        self.requests.append(documents)
+        items = []
+        for document in documents:
+            status = self.statuses[document['n']].pop(0)
+            items.append({'index': {'status': status, 'error': 'error %d' % status}})
+        return {'items': items}
+
+
+def test_bulk_index_chunks_and_retries():
+    client = FakeBulkClient({0: [201], 1: [429, 201], 2: [201], 3: [503, 503, 201]})
+    documents = ({'n': n} for n in range(4))
+    indexed = elasticSearchFunctions.bulk_index(client, documents, 'transfers', 'transferfile', chunk_size=3, wait_between_tries=0)
+    assert indexed == 4
+    # Only the documents that failed are sent again
+    assert client.requests == [
+        [{'n': 0}, {'n': 1}, {'n': 2}],
+        [{'n': 1}],
+        [{'n': 3}],
+        [{'n': 3}],
+        [{'n': 3}],
+    ]
+
+
+def test_bulk_index_raises_on_failures():
+    client = FakeBulkClient({0: [400], 1: [201], 2: [503, 503]})
+    documents = [{'n': n} for n in range(3)]
+    with pytest.raises(elasticSearchFunctions.ElasticsearchError):
+        elasticSearchFunctions.bulk_index(client, documents, 'aips', 'aipfile', chunk_size=2, threads=2, wait_between_tries=0, max_tries=2)
+    # Every document was sent before the error was raised
+    assert sorted(d['n'] for r in client.requests for d in r) == [0, 1, 2, 2]
+
+
+class FakeScrollClient(object):
+    """Returns the given pages of hits from the scroll API."""
+
+    def __init__(self, pages):
+        self.pages = list(pages) + [[]]
+        self.searches = []
+
+    def _response(self, hits):
+        return {'_scroll_id': 'scroll', '_shards': {'failed': 0}, 'hits': {'hits': hits}}
+
+    def search(self, **kwargs):
+        self.searches.append(kwargs)
+        return self._response([])
+
+    def scroll(self, scroll_id, scroll):
+        return self._response(self.pages.pop(0))
+
+
+def test_scan_all_results_reads_every_page():
+    client = FakeScrollClient([[{'_id': 1}, {'_id': 2}], [{'_id': 3}]])
+    hits = elasticSearchFunctions.scan_all_results(client, {'query': {'match_all': {}}}, index=['aips', 'transfers'], doc_type='aip', page_size=2, fields='uuid')
+    assert [h['_id'] for h in hits] == [1, 2, 3]
+    assert client.pages == []
+    search = client.searches[0]
+    assert search['index'] == 'aips,transfers'
+    assert search['size'] == 2
+    assert search['fields'] == 'uuid'
+    assert search['search_type'] == 'scan'
+
+
+class FakeDeleteClient(FakeScrollClient):
+    """Deletes documents with _bulk requests, or by query if supported."""
+
+    def __init__(self, ids, delete_by_query=True):
+        hits = [{'_index': 'transfers', '_type': 'transferfile', '_id': i} for i in ids]
+        super(FakeDeleteClient, self).__init__([hits[:2], hits[2:]])
+        self.count_ = len(ids)
+        self.supports_delete_by_query = delete_by_query
+        self.bulk_requests = []
+
+    def count(self, **kwargs):
+        return {'count': self.count_}
+
+    def delete_by_query(self, index, doc_type, body):
+        if not self.supports_delete_by_query:
+            raise elasticSearchFunctions.TransportError(404, 'Not found')
+        return {'_indices': {index: {'_shards': {'total': 5, 'successful': 5, 'failed': 0}}}}
+
+    def bulk(self, body):
+        self.bulk_requests.append([action['delete']['_id'] for action in body])
+        return {'items': [{'delete': {'status': 200, 'found': True}} for _ in body]}
+
+
+def test_delete_documents_by_query():
+    client = FakeDeleteClient(['a', 'b', 'c'])
+    assert elasticSearchFunctions.delete_documents(client, 'transfers', 'transferfile', {'query': {'match_all': {}}}) == 3
+    assert client.bulk_requests == []
+
+
+def test_delete_documents_in_bulk():
+    client = FakeDeleteClient(['a', 'b', 'c'], delete_by_query=False)
+    assert elasticSearchFunctions.delete_documents(client, 'transfers', 'transferfile', {'query': {'match_all': {}}}, chunk_size=2) == 3
+    assert client.bulk_requests == [['a', 'b'], ['c']]
+
+
+def test_xml_element_to_dict_matches_xmltodict():
+    path = os.path.join(THIS_DIR, 'fixtures', 'test-identifiers-islandora-METS.xml')
+    root = ElementTree.parse(path).getroot()
+    for element in [root] + root.findall('{http://www.loc.gov/METS/}amdSec'):
+        expected = xmltodict.parse(ElementTree.tostring(element))
+        assert elasticSearchFunctions.xml_element_to_dict(element) == expected
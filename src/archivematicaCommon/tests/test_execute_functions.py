@@ -0,0 +1,61 @@
+import os
+import sys
+
+import executeOrRunSubProcess
+from executeOrRunSubProcess import OutputCapture, launchSubProcess
+
+
+def test_output_capture_under_limit():
+    capture = OutputCapture(10)
+    capture.write('abc')
+    capture.write('defg')
+    assert not capture.truncated()
+    assert capture.getvalue() == 'abcdefg'
+
+
+def test_output_capture_keeps_head_and_tail():
+    capture = OutputCapture(10)
+    for c in 'abcdefghijklmnopqrstuvwxyz':
+        capture.write(c * 3)
+    assert capture.truncated()
+    assert capture.head_size + capture.tail_size < 20
+    assert capture.getvalue() == 'aaabb\n[... 68 bytes omitted ...]\nyyzzz'
+
+
+def test_output_capture_saves_full_output(tmpdir):
+    path = os.path.join(str(tmpdir), 'stdout')
+    capture = OutputCapture(4, path)
+    capture.write('0123456789')
+    assert capture.getvalue() == '01\n[... 6 bytes omitted; full output saved to {0} ...]\n89'.format(path)
+    with open(path) as f:
+        assert f.read() == '0123456789'
+
+
+def test_output_capture_does_not_save_short_output(tmpdir):
+    path = os.path.join(str(tmpdir), 'stdout')
+    capture = OutputCapture(20, path)
+    capture.write('0123456789')
+    assert capture.getvalue() == '0123456789'
+    assert not os.path.exists(path)
+
+
+def test_launch_subprocess_output_limit(monkeypatch):
+    monkeypatch.setattr(executeOrRunSubProcess, 'CHUNK_SIZE', 7)
+    command = [sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read() * 1000); sys.stderr.write("err")']
+    rc, stdout, stderr = launchSubProcess(command, stdIn='0123456789', printing=False, output_limit=100)
+    assert rc == 0
+    assert stdout.startswith('01234567890123456789')
+    assert stdout.endswith('01234567890123456789')
+    assert '[... 9900 bytes omitted ...]' in stdout
+    assert stderr == 'err'
+
+
+def test_purge_output_files(tmpdir):
+    old = tmpdir.join('old.stdout')
+    old.write('output')
+    os.utime(str(old), (0, 0))
+    new = tmpdir.join('new.stdout')
+    new.write('output')
+    assert executeOrRunSubProcess.purgeOutputFiles(str(tmpdir), 60 * 60) == 1
+    assert not old.exists()
+    assert new.exists()
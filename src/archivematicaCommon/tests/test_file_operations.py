@@ -0,0 +1,87 @@
+# -*- coding: UTF-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+import fileOperations
+
+sys.path.append("/usr/share/archivematica/dashboard")
+from main.models import File
+
+from django.test import TestCase
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SIP_UUID = "742b0443-cf18-442a-94f9-6d5b4948227d"
+OTHER_SIP_UUID = "01cf9fb8-bc01-40b4-b830-feb66e912f40"
+
+
+class TestUpdateLocationPrefix(TestCase):
+
+    fixture_files = ['test_database_functions.json']
+    fixtures = [os.path.join(THIS_DIR, 'fixtures', p) for p in fixture_files]
+
+    def _file(self, uuid, location, sip=SIP_UUID):
+        File.objects.create(uuid=uuid, sip_id=sip, originallocation=location, currentlocation=location)
+
+    def _location(self, uuid):
+        return File.objects.get(uuid=uuid).currentlocation
+
+    def test_updates_files_under_the_prefix(self):
+        self._file("a0000000-0000-0000-0000-000000000001", "%SIPDirectory%objects/old/a.txt")
+        self._file("a0000000-0000-0000-0000-000000000002", "%SIPDirectory%objects/old/sub/old/b.txt")
+        self._file("a0000000-0000-0000-0000-000000000003", "%SIPDirectory%objects/older/c.txt")
+        self._file("a0000000-0000-0000-0000-000000000004", "%SIPDirectory%objects/old/d.txt", sip=OTHER_SIP_UUID)
+
+        count = fileOperations.updateLocationPrefix("%SIPDirectory%objects/old/", "%SIPDirectory%objects/new dir/", SIP_UUID, "sip_id")
+
+        assert count == 2
+        assert self._location("a0000000-0000-0000-0000-000000000001") == "%SIPDirectory%objects/new dir/a.txt"
+        # Only the prefix is replaced
+        assert self._location("a0000000-0000-0000-0000-000000000002") == "%SIPDirectory%objects/new dir/sub/old/b.txt"
+        assert self._location("a0000000-0000-0000-0000-000000000003") == "%SIPDirectory%objects/older/c.txt"
+        assert self._location("a0000000-0000-0000-0000-000000000004") == "%SIPDirectory%objects/old/d.txt"
+        # The indexed hash of the location is updated too
+        assert File.objects.at_location("%SIPDirectory%objects/new dir/sub/old/b.txt").get().uuid == "a0000000-0000-0000-0000-000000000002"
+        assert not File.objects.at_location("%SIPDirectory%objects/old/a.txt").exists()
+
+    def test_skips_removed_files(self):
+        self._file("a0000000-0000-0000-0000-000000000005", "%SIPDirectory%objects/old/e.txt")
+        File.objects.filter(uuid="a0000000-0000-0000-0000-000000000005").update(removedtime="2016-01-01T00:00:00Z")
+
+        assert fileOperations.updateLocationPrefix("%SIPDirectory%objects/old/", "%SIPDirectory%objects/new/", SIP_UUID, "sip_id") == 0
+        assert self._location("a0000000-0000-0000-0000-000000000005") == "%SIPDirectory%objects/old/e.txt"
+
+
+class TestUpdateDirectoryLocation(TestCase):
+
+    fixture_files = ['test_database_functions.json']
+    fixtures = [os.path.join(THIS_DIR, 'fixtures', p) for p in fixture_files]
+
+    def setUp(self):
+        self.unit_path = tempfile.mkdtemp() + '/'
+        os.makedirs(os.path.join(self.unit_path, 'objects', 'old'))
+        File.objects.create(uuid="b0000000-0000-0000-0000-000000000001", sip_id=SIP_UUID,
+                            originallocation="%SIPDirectory%objects/old/a.txt",
+                            currentlocation="%SIPDirectory%objects/old/a.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.unit_path)
+
+    def _move(self, src):
+        fileOperations.updateDirectoryLocation(
+            os.path.join(self.unit_path, src), os.path.join(self.unit_path, 'objects', 'new'),
+            self.unit_path, SIP_UUID, "sip_id", "%SIPDirectory%")
+
+    def test_moves_directory_and_files(self):
+        self._move('objects/old')
+        assert os.path.isdir(os.path.join(self.unit_path, 'objects', 'new'))
+        assert File.objects.get(uuid="b0000000-0000-0000-0000-000000000001").currentlocation == "%SIPDirectory%objects/new/a.txt"
+
+    def test_locations_are_kept_if_the_move_fails(self):
+        shutil.rmtree(os.path.join(self.unit_path, 'objects', 'old'))
+        with self.assertRaises(IOError):
+            self._move('objects/old')
+        assert File.objects.get(uuid="b0000000-0000-0000-0000-000000000001").currentlocation == "%SIPDirectory%objects/old/a.txt"
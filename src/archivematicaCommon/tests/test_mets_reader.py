@@ -0,0 +1,93 @@
+import os
+import sys
+
+from lxml import etree
+
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+import mets_reader
+import namespaces as ns
+
+METS = """<?xml version="1.0" encoding="UTF-8"?>
+<mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:premis="info:lc/xmlns/premis-v2" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <mets:dmdSec ID="dmdSec_1"/>
+  <mets:amdSec ID="amdSec_1">
+    <mets:techMD ID="techMD_1" STATUS="superseded"><mets:mdWrap><mets:xmlData><premis:object>old</premis:object></mets:xmlData></mets:mdWrap></mets:techMD>
+    <mets:techMD ID="techMD_2" STATUS="current"><mets:mdWrap><mets:xmlData><premis:object>new</premis:object></mets:xmlData></mets:mdWrap></mets:techMD>
+    <mets:sourceMD ID="sourceMD_1"/>
+    <mets:digiprovMD ID="digiprovMD_1"/>
+    <mets:digiprovMD ID="digiprovMD_2"/>
+  </mets:amdSec>
+  <mets:amdSec ID="amdSec_2">
+    <mets:techMD ID="techMD_3"/>
+    <mets:rightsMD ID="rightsMD_1"/>
+  </mets:amdSec>
+  <mets:fileSec>
+    <mets:fileGrp USE="original">
+      <mets:file ID="file-1" ADMID="amdSec_2"><mets:FLocat xlink:href="objects/b.txt"/></mets:file>
+      <mets:file ID="file-2" ADMID="amdSec_1"><mets:FLocat xlink:href="objects/a.txt"/></mets:file>
+    </mets:fileGrp>
+    <mets:fileGrp USE="metadata">
+      <mets:file ID="file-3"><mets:FLocat xlink:href="objects/metadata/c.csv"/></mets:file>
+    </mets:fileGrp>
+  </mets:fileSec>
+  <mets:structMap ID="structMap_1"/>
+</mets:mets>
+"""
+
+
+def write_mets(tmpdir):
+    path = os.path.join(str(tmpdir), 'METS.xml')
+    with open(path, 'w') as f:
+        f.write(METS)
+    return path
+
+
+def test_files_in_amdsec_order(tmpdir):
+    reader = mets_reader.METSReader(write_mets(tmpdir))
+    files = [(f.id, f.use, f.path, f.amdsec.get('ID') if f.amdsec is not None else None)
+             for f in reader.files()]
+    assert files == [
+        ('file-2', 'original', 'objects/a.txt', 'amdSec_1'),
+        ('file-1', 'original', 'objects/b.txt', 'amdSec_2'),
+        ('file-3', 'metadata', 'objects/metadata/c.csv', None),
+    ]
+
+
+def test_file_subsections(tmpdir):
+    reader = mets_reader.METSReader(write_mets(tmpdir))
+    for f in reader.files(uses=['original']):
+        if f.id == 'file-2':
+            assert f.current_techmd.get('ID') == 'techMD_2'
+            assert [d.get('ID') for d in f.digiprovmds] == ['digiprovMD_1', 'digiprovMD_2']
+            assert f.rightsmds == []
+        else:
+            assert f.current_techmd.get('ID') == 'techMD_3'
+            assert [r.get('ID') for r in f.rightsmds] == ['rightsMD_1']
+
+
+def test_tree_without_amdsecs(tmpdir):
+    reader = mets_reader.METSReader(write_mets(tmpdir), keep=['sourceMD'])
+    root = reader.root
+    assert root.find('mets:dmdSec', namespaces=ns.NSMAP) is not None
+    assert root.find('mets:structMap', namespaces=ns.NSMAP) is not None
+    assert root.findall('mets:fileSec//mets:file', namespaces=ns.NSMAP) == []
+    # Only the subsections that were asked for are kept
+    amdsecs = root.findall('mets:amdSec', namespaces=ns.NSMAP)
+    assert [a.get('ID') for a in amdsecs] == ['amdSec_1']
+    assert [s.get('ID') for s in amdsecs[0]] == ['sourceMD_1']
+
+
+def test_find_amdsec(tmpdir):
+    reader = mets_reader.METSReader(write_mets(tmpdir))
+    amdsec = reader.find_amdsec('mets:rightsMD')
+    assert amdsec.get('ID') == 'amdSec_2'
+    assert len(amdsec) == 2
+    assert reader.find_amdsec('mets:sourceMD/mets:mdWrap') is None
+
+
+def test_file_records(tmpdir):
+    root = etree.parse(write_mets(tmpdir))
+    files = list(mets_reader.file_records(root))
+    assert [f.id for f in files] == ['file-1', 'file-2', 'file-3']
+    assert files[1].current_techmd.get('ID') == 'techMD_2'
+    assert files[2].amdsec is None
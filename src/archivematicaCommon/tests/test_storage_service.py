@@ -0,0 +1,112 @@
+import sys
+
+import pytest
+
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+import storageService
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    values = {
+        'storage_service_url': 'http://localhost:8000',
+        'storage_service_user': 'test',
+        'storage_service_apikey': 'key',
+        'dashboard_uuid': 'b6e4c7ee-7bd4-4c11-9ac6-3f3c4f0e2ae8',
+    }
+    monkeypatch.setattr(storageService, 'get_setting', lambda setting, default='': values.get(setting, default))
+    storageService.invalidate_cache()
+    return values
+
+
+def test_cached_values_are_reused_until_they_expire(monkeypatch):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'objects': ['a']}
+
+    now = [1000.0]
+    monkeypatch.setattr(storageService.time, 'time', lambda: now[0])
+    storageService.invalidate_cache()
+    value = storageService._cached('key', fetch)
+    # Callers get a copy
+    value['objects'].append('b')
+    assert storageService._cached('key', fetch) == {'objects': ['a']}
+    assert len(calls) == 1
+    now[0] += storageService.CACHE_TTL
+    storageService._cached('key', fetch)
+    assert len(calls) == 2
+    storageService.invalidate_cache()
+    storageService._cached('key', fetch)
+    assert len(calls) == 3
+
+
+def test_none_is_not_cached():
+    calls = []
+    storageService.invalidate_cache()
+    for _ in range(2):
+        assert storageService._cached('key', lambda: calls.append(1)) is None
+    assert len(calls) == 2
+
+
+def test_api_is_shared_until_settings_change(settings):
+    api = storageService._storage_api()
+    assert storageService._storage_api() is api
+    # Settings changed by another process are used right away
+    settings['storage_service_apikey'] = 'new key'
+    new_api = storageService._storage_api()
+    assert new_api is not api
+    assert new_api._store['session'].auth.apikey == 'new key'
+    assert new_api._store['base_url'] == 'http://localhost:8000/api/v2/'
+
+
+class FakeFileResource(object):
+    """Pages through `count` files like the storage service file API."""
+
+    def __init__(self, count, max_limit=3):
+        self.files = [{'uuid': str(n), 'status': 'UPLOADED', 'size': n} for n in range(count)]
+        self.max_limit = max_limit
+        self.requests = []
+
+    def get(self, offset=0, limit=20, **filters):
+        self.requests.append((offset, limit))
+        limit = min(limit, self.max_limit)
+        files = self.files
+        if filters.get('uuid'):
+            files = [f for f in files if f['uuid'] == filters['uuid']]
+        next_ = '/next/' if offset + limit < len(files) else None
+        return {
+            'meta': {'offset': offset, 'limit': limit, 'total_count': len(files), 'next': next_},
+            'objects': files[offset:offset + limit],
+        }
+
+
+class FakeAPI(object):
+    def __init__(self, count):
+        self.file = FakeFileResource(count)
+
+
+def test_iter_file_info_reads_every_page(monkeypatch):
+    api = FakeAPI(10)
+    monkeypatch.setattr(storageService, '_storage_api', lambda: api)
+    files = list(storageService.iter_file_info(fields=['uuid'], page_size=5, threads=2, status='UPLOADED'))
+    assert files == [{'uuid': str(n)} for n in range(10)]
+    # Later pages are fetched with the page size used by the storage service
+    assert sorted(api.file.requests) == [(0, 5), (3, 3), (6, 3), (9, 3)]
+
+
+def test_iter_file_info_follows_files_added_while_paging(monkeypatch):
+    api = FakeAPI(4)
+    monkeypatch.setattr(storageService, '_storage_api', lambda: api)
+    files = storageService.iter_file_info(threads=1)
+    assert next(files)['uuid'] == '0'
+    api.file.files.extend({'uuid': str(n), 'status': 'UPLOADED'} for n in range(4, 8))
+    assert [f['uuid'] for f in files] == [str(n) for n in range(1, 8)]
+
+
+def test_get_file_status(monkeypatch):
+    api = FakeAPI(3)
+    monkeypatch.setattr(storageService, '_storage_api', lambda: api)
+    assert storageService.get_file_status('1') == 'UPLOADED'
+    assert storageService.get_file_status('missing') is None
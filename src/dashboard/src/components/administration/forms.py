@@ -95,6 +95,10 @@ class StorageSettingsForm(SettingsForm):
         help_text='API key of the storage service user. E.g. 45f7684483044809b2de045ba59dc876b11b9810'
     )
 
+    def save(self, *args, **kwargs):
+        super(StorageSettingsForm, self).save(*args, **kwargs)
+        storage_service.invalidate_cache()
+
 class ChecksumSettingsForm(SettingsForm):
     CHOICES = (
         ('md5', 'MD5'),
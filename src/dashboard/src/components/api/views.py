@@ -445,6 +445,7 @@ def reingest(request, target):
     # TODO Clear DB of residual stuff related to SIP
     models.Task.objects.filter(job__sipuuid=sip_uuid).delete()
     models.Job.objects.filter(sipuuid=sip_uuid).delete()
+    models.UnitStatus.objects.refresh(sip_uuid)
     models.SIP.objects.filter(uuid=sip_uuid).delete()  # Delete is cascading
     models.RightsStatement.objects.filter(metadataappliestoidentifier=sip_uuid).delete()  # Not actually a foreign key
     models.DublinCore.objects.filter(metadataappliestoidentifier=sip_uuid).delete()
@@ -21,10 +21,14 @@ import httplib
 import json
 import logging
 import os
+import threading
+import time
 import uuid
 
 from django.contrib import messages
 from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
 from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render, redirect
 from elasticsearch import ElasticsearchException
@@ -48,6 +52,15 @@ AIP_STATUS_DESCRIPTIONS = {
     'DEL_REQ':  'Deletion requested'
 }
 
+# The UUIDs of AIPs pending deletion are kept in the archival_storage cache
+# (see settings.CACHES), shared by all dashboard processes. They are
+# refreshed in the background once older than AIPS_PENDING_DELETION_REFRESH
+# seconds, and dropped if not refreshed for AIPS_PENDING_DELETION_TIMEOUT
+AIPS_PENDING_DELETION_CACHE = 'archival_storage'
+AIPS_PENDING_DELETION_CACHE_KEY = 'archival_storage:aips_pending_deletion'
+AIPS_PENDING_DELETION_REFRESH = 60
+AIPS_PENDING_DELETION_TIMEOUT = 60 * 60
+
 
 def overview(request):
     return list_display(request)
@@ -265,12 +278,12 @@ def create_aic(request, *args, **kwargs):
             }
         }
         es_client = elasticSearchFunctions.get_client()
-        results = es_client.search(
+        results = elasticSearchFunctions.scan_all_results(
+            es_client,
             body=query,
             index='aips',
             doc_type='aip',
             fields='uuid,name',
-            size=elasticSearchFunctions.MAX_QUERY_SIZE,  # return all records
         )
 
         # Create files in staging directory with AIP information
@@ -293,7 +306,7 @@ def create_aic(request, *args, **kwargs):
         databaseFunctions.createSIP(mcp_destination, UUID=temp_uuid, sip_type='AIC')
 
         # Create files with filename = AIP UUID, and contents = AIP name
-        for aip in results['hits']['hits']:
+        for aip in results:
             filepath = os.path.join(destination, aip['fields']['uuid'][0])
             with open(filepath, 'w') as f:
                 os.chmod(filepath, 0o660)
@@ -373,31 +386,77 @@ def send_thumbnail(request, fileuuid):
     return helpers.send_file(request, thumbnail_path)
 
 
-def aips_pending_deletion():
-    aip_uuids = []
+def _cache():
+    return caches[AIPS_PENDING_DELETION_CACHE]
+
+
+def _fetch_aips_pending_deletion():
+    """
+    Fetch the UUIDs of AIPs pending deletion from the storage service and
+    cache them. Returns None if they could not be fetched.
+    """
     try:
-        aips = storage_service.get_file_info(status='DEL_REQ')
+        aip_uuids = [aip['uuid'] for aip in storage_service.iter_file_info(status='DEL_REQ', fields=['uuid'])]
     except Exception as e:
         # TODO this should be messages.warning, but we need 'request' here
         logger.warning("Error retrieving AIPs pending deletion: is the storage server running?  Error: {}".format(e))
-    else:
-        for aip in aips:
-            aip_uuids.append(aip['uuid'])
+        return None
+    _cache().set(AIPS_PENDING_DELETION_CACHE_KEY, (time.time(), aip_uuids), AIPS_PENDING_DELETION_TIMEOUT)
     return aip_uuids
 
 
-def elasticsearch_query_excluding_aips_pending_deletion(uuid_field_name):
-    # add UUIDs of AIPs pending deletion, if any, to boolean query
-    must_not_haves = []
+def _refresh_aips_pending_deletion():
+    try:
+        _fetch_aips_pending_deletion()
+    finally:
+        _cache().delete(AIPS_PENDING_DELETION_CACHE_KEY + ':refreshing')
+        # This thread's database connection is not closed by Django
+        connection.close()
 
-    for aip_uuid in aips_pending_deletion():
-        must_not_haves.append({'term': {uuid_field_name: aip_uuid}})
 
-    if len(must_not_haves):
+def aips_pending_deletion():
+    """
+    Return the UUIDs of AIPs pending deletion.
+
+    They are cached, and the storage service is only asked for them on the
+    first call, or in the background once they are older than
+    AIPS_PENDING_DELETION_REFRESH seconds.
+    """
+    cached = _cache().get(AIPS_PENDING_DELETION_CACHE_KEY)
+    if cached is None:
+        return _fetch_aips_pending_deletion() or []
+    fetched, aip_uuids = cached
+    if time.time() - fetched > AIPS_PENDING_DELETION_REFRESH:
+        # Only one process refreshes them at a time
+        if _cache().add(AIPS_PENDING_DELETION_CACHE_KEY + ':refreshing', True, AIPS_PENDING_DELETION_REFRESH):
+            thread = threading.Thread(target=_refresh_aips_pending_deletion)
+            thread.daemon = True
+            thread.start()
+    return aip_uuids
+
+
+def add_aip_pending_deletion(aip_uuid):
+    """ Add an AIP whose deletion was just requested to the cached UUIDs. """
+    cached = _cache().get(AIPS_PENDING_DELETION_CACHE_KEY)
+    if cached is not None and aip_uuid not in cached[1]:
+        _cache().set(AIPS_PENDING_DELETION_CACHE_KEY, (cached[0], cached[1] + [aip_uuid]), AIPS_PENDING_DELETION_TIMEOUT)
+
+
+def elasticsearch_query_excluding_aips_pending_deletion(uuid_field_name):
+    # exclude UUIDs of AIPs pending deletion, if any, with a single filter
+    aip_uuids = aips_pending_deletion()
+
+    if aip_uuids:
         query = {
             "query": {
-                "bool": {
-                    "must_not": must_not_haves
+                "filtered": {
+                    "filter": {
+                        "bool": {
+                            "must_not": {
+                                "terms": {uuid_field_name: aip_uuids}
+                            }
+                        }
+                    }
                 }
             }
         }
@@ -515,10 +574,8 @@ def list_display(request):
         # If an AIP was deleted or is pending deletion, react if status changed
         if aip['uuid'] in aips_deleted_or_pending_deletion:
             # check with storage server to see current status
-            api_results = storage_service.get_file_info(uuid=aip['uuid'])
-            try:
-                aip_status = api_results[0]['status']
-            except IndexError:
+            aip_status = storage_service.get_file_status(aip['uuid'])
+            if aip_status is None:
                 # Storage service does not know about this AIP
                 # TODO what should happen here?
                 logger.info("AIP not found in storage service: {}".format(aip))
@@ -634,6 +691,7 @@ def view_aip(request, uuid):
             messages.info(request, response['message'])
             es_client = elasticSearchFunctions.get_client()
             elasticSearchFunctions.mark_aip_deletion_requested(es_client, uuid)
+            add_aip_pending_deletion(uuid)
             return redirect('archival_storage_index')
 
     context = {
@@ -67,16 +67,15 @@ def check_and_remove_deleted_transfers(es_client):
     for hit in deletion_pending_results['hits']['hits']:
         transfer_uuid = hit['fields']['uuid'][0]
 
-        api_results = storage_service.get_file_info(uuid=transfer_uuid)
-        try:
-            status = api_results[0]['status']
-        except IndexError:
+        status = storage_service.get_file_status(transfer_uuid)
+        if status is None:
             logger.info('Transfer not found in storage service: {}'.format(transfer_uuid))
             continue
 
         if status == 'DELETED':
-            elasticSearchFunctions.remove_backlog_transfer_files(es_client, transfer_uuid)
+            deleted = elasticSearchFunctions.remove_backlog_transfer_files(es_client, transfer_uuid)
             elasticSearchFunctions.remove_backlog_transfer(es_client, transfer_uuid)
+            logger.info('Removed deleted transfer %s and its %d files from the backlog index', transfer_uuid, deleted)
 
 
 def execute(request):
@@ -22,11 +22,16 @@ import mimetypes
 import os
 import pprint
 import requests
+import time
 import urllib
 from urlparse import urljoin
+import datetime
 import json
 
+from django.conf import settings as django_settings
 from django.utils.dateformat import format
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger, InvalidPage
 from django.core.urlresolvers import reverse
 from django.db.models import Max
@@ -34,12 +39,17 @@ from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpRespons
 from django.core.servers.basehttp import FileWrapper
 from django.shortcuts import render
 
-from contrib import utils
 from main import models
 from mcpserver import Client as MCPServerClient
 
 logger = logging.getLogger('archivematica.dashboard')
 
+# Seconds between checks for changed units while a status poll waits
+STATUS_WAIT_INTERVAL = 1
+# How far back a status poll looks before its cursor, for changes committed
+# out of order
+STATUS_CURSOR_OVERLAP = datetime.timedelta(seconds=5)
+
 class AtomError(Exception):
     pass
 
@@ -151,22 +161,6 @@ def task_duration_in_seconds(task):
         duration = '< 1'
     return duration
 
-def get_jobs_by_sipuuid(uuid):
-    jobs = models.Job.objects.filter(sipuuid=uuid,subjobof='').order_by('-createdtime', 'subjobof')
-    priorities = {
-        'completedUnsuccessfully': 0,
-        'requiresAprroval': 1,
-        'requiresApproval': 1,
-        'exeCommand': 2,
-        'verificationCommand': 3,
-        'completedSuccessfully': 4,
-        'cleanupSuccessfulCommand': 5,
-    }
-    def get_priority(job):
-        try: return priorities[job.currentstep]
-        except Exception: return 0
-    return sorted(jobs, key = get_priority) # key = lambda job: priorities[job.currentstep]
-
 def get_metadata_type_id_by_description(description):
     return models.MetadataAppliesToType.objects.get(description=description)
 
@@ -352,47 +346,81 @@ def stream_file_from_storage_service(url, error_message='Remote URL returned {}'
         return json_response(response, status_code=400)
 
 
-def units_status(objects, unit_type):
-    jobs_awaiting = MCPServerClient().list_jobs_awaiting_approval().jobs
-    data = {'mcp': True, 'objects': list()}
-    model = {'ingest': models.SIP, 'transfer': models.Transfer}
-    unit_model = model[unit_type]
-    for item in objects:
-        if unit_model.objects.is_hidden(item['sipuuid']):
-            continue
-
-        jobs = get_jobs_by_sipuuid(item['sipuuid'])
-
-        # Add new unit to list
-        unit = {
-            'directory': utils.get_directory_name_from_job(jobs),
-            'timestamp': calendar.timegm(item['timestamp'].timetuple()),
-            'uuid': item['sipuuid'],
-            'id': item['sipuuid'],
-            'jobs': list(),
-        }
-        data['objects'].append(unit)
+def units_status(unit_type, since=None, timeout=0):
+    """
+    Return the status of the units shown on the transfer or ingest tab.
+
+    Without `since`, all the units shown are returned. With `since`, the cursor
+    of a previous response, only those that changed after it are, along with
+    the UUIDs of the units that are no longer shown; if none changed, this
+    waits for a change for up to `timeout` seconds.
 
-        # Include in the unit the list of jobs
+    :param str unit_type: 'unitTransfer' or 'unitSIP'
+    :param datetime since: Cursor of a previous response
+    :param int timeout: Seconds to wait for a change, when since is given
+    """
+    if since is None:
+        statuses = list(models.UnitStatus.objects.filter(unittype=unit_type, hidden=False).order_by('-latestjobtime'))
+        cursor = models.UnitStatus.objects.aggregate(latest=Max('updatedtime'))['latest']
+    else:
+        deadline = time.time() + timeout
+        while True:
+            # Rows committed slightly out of order are fetched again, so
+            # that none is missed
+            changed = list(models.UnitStatus.objects.filter(
+                updatedtime__gt=since - STATUS_CURSOR_OVERLAP).order_by('-latestjobtime'))
+            if any(status.updatedtime > since for status in changed) or time.time() >= deadline:
+                break
+            time.sleep(STATUS_WAIT_INTERVAL)
+        cursor = max([since] + [status.updatedtime for status in changed])
+        statuses = [status for status in changed if status.unittype == unit_type and not status.hidden]
+        removed = [status.unituuid for status in changed
+                   if status.unittype in (unit_type, '') and status not in statuses]
+
+    units = [(status, json.loads(status.jobs)) for status in statuses]
+
+    # Only ask MCPServer for the choices if a job is awaiting one
+    choices = {}
+    if any(job['currentstep'] == 'Awaiting decision' for _, jobs in units for job in jobs):
+        for job_awaiting in MCPServerClient().list_jobs_awaiting_approval().jobs:
+            job_choices = dict((ch.value, ch.description) for ch in job_awaiting.choices)
+            if job_choices:
+                choices[job_awaiting.UUID] = job_choices
+
+    data = {'mcp': True, 'objects': list(), 'cursor': cursor.isoformat() if cursor else None}
+    if since is not None:
+        data['removed'] = removed
+    for status, jobs in units:
         for job in jobs:
-            new_job = {
-                'uuid': job.jobuuid,
-                'type': job.jobtype,
-                'microservicegroup': job.microservicegroup,
-                'subjobof': = job.subjobof,
-                'currentstep': = job.currentstep,
-                'timestamp': '%d.%s' % (calendar.timegm(job.createdtime.timetuple()), str(job.createdtimedec).split('.')[-1]),
-            }
-            unit['jobs'].append(new_job)
-
-            # We should find a better way to do this!
-            for job_awaiting in jobs_awaiting:
-                if job_awaiting.UUID != job.jobuuid:
-                    continue
-                choices = dict()
-                for ch in job_awaiting.choices:
-                    choices[ch.value] = ch.description
-                if choices:
-                    new_job['choices'] = choices
+            if job['uuid'] in choices:
+                job['choices'] = choices[job['uuid']]
+        data['objects'].append({
+            'directory': status.directory,
+            'timestamp': calendar.timegm(status.latestjobtime.timetuple()),
+            'uuid': status.unituuid,
+            'id': status.unituuid,
+            'jobs': jobs,
+        })
 
     return data
+
+
+def units_status_response(request, unit_type):
+    """
+    Respond to a poll of the transfer or ingest tab; see units_status. The
+    optional `since` and `timeout` GET parameters are the cursor of a previous
+    response, and the seconds to wait for a change, up to
+    STATUS_LONG_POLL_TIMEOUT.
+    """
+    since = request.GET.get('since')
+    try:
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None:
+                raise ValueError(since)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, timezone.utc)
+        timeout = min(max(int(request.GET.get('timeout', 0)), 0), django_settings.STATUS_LONG_POLL_TIMEOUT)
+    except ValueError:
+        return json_response({'error': True, 'message': 'Invalid "since" or "timeout".'}, status_code=400)
+    return json_response(units_status(unit_type, since=since, timeout=timeout))
@@ -30,7 +30,6 @@ import uuid
 from django.conf import settings as django_settings
 from django.contrib import messages
 from django.core.urlresolvers import reverse
-from django.db.models import Max
 from django.forms.models import modelformset_factory
 from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
@@ -59,6 +58,7 @@ logger = logging.getLogger('archivematica.dashboard')
 
 def ingest_grid(request):
     polling_interval = django_settings.POLLING_INTERVAL
+    long_poll_timeout = django_settings.STATUS_LONG_POLL_TIMEOUT
     microservices_help = django_settings.MICROSERVICES_HELP
     uid = request.user.id
 
@@ -82,10 +82,7 @@ class SipsView(View):
 
 
 def ingest_status(request, uuid=None):
-    # Equivalent to: "SELECT SIPUUID, MAX(createdTime) AS latest FROM Jobs WHERE unitType='unitSIP' GROUP BY SIPUUID
-    objects = models.Job.objects.filter(hidden=False, subjobof='').values('sipuuid').annotate(timestamp=Max('createdtime')).exclude(sipuuid__icontains = 'None').filter(unittype__exact = 'unitSIP')
-    status = helpers.units_status(objects, unit_type='ingest')
-    return helpers.json_response(status)
+    return helpers.units_status_response(request, 'unitSIP')
 
 
 def ingest_sip_metadata_type_id():
@@ -467,19 +464,18 @@ def transfer_backlog(request, ui):
 
     # perform search
     try:
-        results = elasticSearchFunctions.search_all_results(
+        hits = elasticSearchFunctions.scan_all_results(
             es_client,
             body=query,
             index='transfers',
             doc_type='transferfile',
         )
+        # Convert results into a more workable form
+        results = elasticSearchFunctions.augment_raw_search_results(hits)
     except:
         logger.exception('Error accessing index.')
         return HttpResponse('Error accessing index.')
 
-    # Convert results into a more workable form
-    results = elasticSearchFunctions.augment_raw_search_results(results)
-
     # Convert to a form JS can use:
     # [{'name': <filename>,
     #   'properties': {'not_draggable': False}},
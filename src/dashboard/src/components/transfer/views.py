@@ -19,7 +19,6 @@ import json
 import logging
 from uuid import uuid4
 
-from django.db.models import Max
 from django.conf import settings as django_settings
 from django.shortcuts import render, redirect
 from django.http import HttpResponse
@@ -40,6 +39,7 @@ logger = logging.getLogger('archivematica.dashboard')
 
 def grid(request):
     polling_interval = django_settings.POLLING_INTERVAL
+    long_poll_timeout = django_settings.STATUS_LONG_POLL_TIMEOUT
     microservices_help = django_settings.MICROSERVICES_HELP
     uid = request.user.id
     hide_features = helpers.hidden_features()
@@ -121,10 +121,7 @@ def component(request, uuid):
 
 
 def status(request, uuid=None):
-    # Equivalent to: "SELECT SIPUUID, MAX(createdTime) AS latest FROM Jobs GROUP BY SIPUUID
-    objects = models.Job.objects.filter(hidden=False, subjobof='', unittype__exact='unitTransfer').values('sipuuid').annotate(timestamp=Max('createdtime')).exclude(sipuuid__icontains = 'None').order_by('-timestamp')
-    status = helpers.units_status(objects, unit_type='transfer')
-    return helpers.json_response(status)
+    return helpers.units_status_response(request, 'unitTransfer')
 
 
 def transfer_metadata_type_id():
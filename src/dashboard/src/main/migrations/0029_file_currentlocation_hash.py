@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+import main.models
+
+# Files whose hash is computed per query, on databases without SHA1()
+BATCH_SIZE = 1000
+
+
+def data_migration(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('UPDATE Files SET currentLocationHash = SHA1(currentLocation) WHERE currentLocation IS NOT NULL')
+        return
+
+    File = apps.get_model('main', 'File')
+    files = File.objects.filter(currentlocation__isnull=False).order_by('uuid').values_list('uuid', 'currentlocation')
+    last = ''
+    while True:
+        batch = list(files.filter(uuid__gt=last)[:BATCH_SIZE])
+        if not batch:
+            break
+        for uuid, location in batch:
+            File.objects.filter(uuid=uuid).update(currentlocation_hash=main.models.path_hash(location))
+        last = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0028_version_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='currentlocation_hash',
+            field=main.models.PathHashField(source='currentlocation', null=True, editable=False, db_column='currentLocationHash'),
+        ),
+        migrations.RunPython(data_migration),
+        migrations.AlterIndexTogether(
+            name='file',
+            index_together=set([('sip', 'currentlocation_hash', 'removedtime'), ('transfer', 'currentlocation_hash', 'removedtime')]),
+        ),
+    ]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import calendar
+import itertools
+import json
+import re
+
+from django.db import models, migrations
+
+# UnitStatus rows inserted per query
+BATCH_SIZE = 500
+
+# The status computation below is a copy of main.models.unit_status_values as
+# of this migration, so that later changes to it do not change the migration
+STATUS_UNIT_TYPES = ('unitSIP', 'unitTransfer')
+
+
+def directory_name(jobs):
+    if not jobs:
+        return '(Unnamed)'
+    directory = jobs[0].directory
+    for pattern in (r'^.*/(?P<directory>.*)-[\w]{8}(-[\w]{4}){3}-[\w]{12}[/]{0,1}$', r'^.*/(?P<directory>.*)/$'):
+        match = re.search(pattern, directory)
+        if match:
+            return match.group('directory')
+    return directory or jobs[0].sipuuid
+
+
+def job_status(job):
+    return {
+        'uuid': job.jobuuid,
+        'type': job.jobtype,
+        'microservicegroup': job.microservicegroup,
+        'subjobof': job.subjobof,
+        'currentstep': job.currentstep,
+        'timestamp': '%d.%s' % (calendar.timegm(job.createdtime.timetuple()), str(job.createdtimedec).split('.')[-1]),
+    }
+
+
+def unit_status_values(jobs):
+    visible = [job for job in jobs if not job.hidden]
+    unittypes = set(job.unittype for job in visible)
+    unittype = next((t for t in STATUS_UNIT_TYPES if t in unittypes), '')
+    times = [job.createdtime for job in visible if job.unittype == unittype]
+    return {
+        'unittype': unittype,
+        'directory': directory_name(jobs),
+        'latestjobtime': max(times) if times else None,
+        'jobs': json.dumps([job_status(job) for job in jobs]),
+    }
+
+
+def data_migration(apps, schema_editor):
+    Job = apps.get_model('main', 'Job')
+    SIP = apps.get_model('main', 'SIP')
+    Transfer = apps.get_model('main', 'Transfer')
+    UnitStatus = apps.get_model('main', 'UnitStatus')
+
+    hidden = set(SIP.objects.filter(hidden=True).values_list('uuid', flat=True))
+    hidden.update(Transfer.objects.filter(hidden=True).values_list('uuid', flat=True))
+
+    jobs = Job.objects.filter(subjobof='').exclude(sipuuid__icontains='None').order_by('sipuuid', '-createdtime', '-createdtimedec')
+    statuses = []
+    for unit_uuid, unit_jobs in itertools.groupby(jobs.iterator(), lambda job: job.sipuuid):
+        values = unit_status_values(list(unit_jobs))
+        statuses.append(UnitStatus(unituuid=unit_uuid, hidden=unit_uuid in hidden, **values))
+        if len(statuses) == BATCH_SIZE:
+            UnitStatus.objects.bulk_create(statuses)
+            statuses = []
+    UnitStatus.objects.bulk_create(statuses)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0029_file_currentlocation_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='currentstep',
+            field=models.CharField(db_index=True, max_length=50, db_column='currentStep', blank=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('sipuuid', 'subjobof', 'createdtime'), ('unittype', 'hidden', 'subjobof', 'createdtime')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='task',
+            index_together=set([('job', 'exitcode')]),
+        ),
+        migrations.CreateModel(
+            name='UnitStatus',
+            fields=[
+                ('unituuid', models.CharField(max_length=36, serialize=False, primary_key=True, db_column='unitUUID')),
+                ('unittype', models.CharField(max_length=50, db_column='unitType', blank=True)),
+                ('directory', models.TextField(blank=True)),
+                ('latestjobtime', models.DateTimeField(default=None, null=True, db_column='latestJobTime')),
+                ('jobs', models.TextField(blank=True)),
+                ('hidden', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'UnitStatus',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='unitstatus',
+            index_together=set([('unittype', 'hidden', 'latestjobtime')]),
+        ),
+        migrations.RunPython(data_migration),
+    ]
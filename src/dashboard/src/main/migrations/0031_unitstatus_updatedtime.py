@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0030_unit_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unitstatus',
+            name='updatedtime',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True, db_column='updatedTime', db_index=True),
+            preserve_default=False,
+        ),
+    ]
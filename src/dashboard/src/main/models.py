@@ -21,14 +21,19 @@
 
 # stdlib, alphabetical by import source
 import ast
+import calendar
+import hashlib
+import json
 import logging
 
 # Core Django, alphabetical by import source
 from django import forms
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 # Third party dependencies, alphabetical by import source
 from django_extensions.db.fields import UUIDField
@@ -69,8 +74,69 @@ class BlobTextField(models.TextField):
         return 'longblob'
 
 
+def path_hash(path):
+    """ Return the SHA-1 hex digest of path, as stored by PathHashField. """
+    if path is None:
+        return None
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return hashlib.sha1(path).hexdigest()
+
+
+class SHA1(models.Func):
+    """ SHA-1 hex digest of an expression, computed by the database. """
+    function = 'SHA1'
+
+    def __init__(self, expression, **extra):
+        extra.setdefault('output_field', models.CharField(max_length=40))
+        super(SHA1, self).__init__(expression, **extra)
+
+
+class PathHashField(models.CharField):
+    """
+    SHA-1 hash of another field of the model, e.g. a BlobTextField path, that
+    can be indexed. It is updated whenever the model is saved.
+
+    QuerySet.update() bypasses the field, so the model's QuerySet must update
+    the hash as well; see FileQuerySet.
+    """
+
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        kwargs['max_length'] = 40
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('editable', False)
+        super(PathHashField, self).__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(PathHashField, self).contribute_to_class(cls, name, *args, **kwargs)
+        # Fixtures are saved raw, which skips pre_save() but still sends the
+        # pre_save signal
+        pre_save.connect(self._set_hash, sender=cls, weak=False)
+
+    def _set_hash(self, sender, instance, **kwargs):
+        self.pre_save(instance, False)
+
+    def pre_save(self, model_instance, add):
+        value = path_hash(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(PathHashField, self).deconstruct()
+        del kwargs['max_length']
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
+
+
 # SIGNALS
 
+@receiver(connection_created)
+def add_sqlite_functions(sender, connection, **kwargs):
+    """ Provide SHA1(), which SQLite (used in tests) lacks. """
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('SHA1', 1, path_hash)
+
 @receiver(post_save, sender=User)
 def create_user_agent(sender, instance, **kwargs):
     LOGGER.debug('Caught post_save signal from %s with instance %r', sender, instance)
@@ -341,6 +407,26 @@ class SIPArrangeAccessMapping(models.Model):
         return 'arrange_path={s.arrange_path}, system={s.system}, identifier={s.identifier}'.format(s=self)
 
 
+class FileQuerySet(models.QuerySet):
+    def at_location(self, location):
+        """
+        Return the Files whose current location is location, found through
+        the indexed currentlocation_hash rather than by scanning the
+        (unindexable) currentlocation.
+        """
+        return self.filter(currentlocation_hash=path_hash(location), currentlocation=location)
+
+    def update(self, **kwargs):
+        # Keep currentlocation_hash in step with currentlocation
+        if 'currentlocation' in kwargs:
+            location = kwargs['currentlocation']
+            if hasattr(location, 'resolve_expression'):
+                kwargs['currentlocation_hash'] = SHA1(location)
+            else:
+                kwargs['currentlocation_hash'] = path_hash(location)
+        return super(FileQuerySet, self).update(**kwargs)
+
+
 class File(models.Model):
     """ Information about Files in units (Transfers, SIPs). """
     uuid = models.CharField(max_length=36, primary_key=True, db_column='fileUUID')
@@ -349,6 +435,8 @@ class File(models.Model):
     # both actually `longblob` in the database
     originallocation = BlobTextField(db_column='originalLocation')
     currentlocation = BlobTextField(db_column='currentLocation', null=True)
+    # Lookups by path go through this, see FileQuerySet.at_location
+    currentlocation_hash = PathHashField('currentlocation', db_column='currentLocationHash')
     filegrpuse = models.CharField(max_length=50, db_column='fileGrpUse', default='Original')
     filegrpuuid = models.CharField(max_length=36, db_column='fileGrpUUID', blank=True)
     checksum = models.CharField(max_length=128, db_column='checksum', blank=True)
@@ -358,8 +446,20 @@ class File(models.Model):
     enteredsystem = models.DateTimeField(db_column='enteredSystem', auto_now_add=True)
     removedtime = models.DateTimeField(db_column='removedTime', null=True, default=None)
 
+    objects = FileQuerySet.as_manager()
+
     class Meta:
         db_table = u'Files'
+        index_together = (
+            ('sip', 'currentlocation_hash', 'removedtime'),
+            ('transfer', 'currentlocation_hash', 'removedtime'),
+        )
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'currentlocation' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['currentlocation_hash']
+        super(File, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return u'{uuid}: {originallocation} now at {currentlocation}'.format(
@@ -393,7 +493,7 @@ class Job(models.Model):
     directory = models.TextField(blank=True)
     sipuuid = models.CharField(max_length=36, db_column='SIPUUID')  # Foreign key to SIPs or Transfers
     unittype = models.CharField(max_length=50, db_column='unitType', blank=True)
-    currentstep = models.CharField(max_length=50, db_column='currentStep', blank=True)
+    currentstep = models.CharField(max_length=50, db_column='currentStep', blank=True, db_index=True)
     microservicegroup = models.CharField(max_length=50, db_column='microserviceGroup', blank=True)
     hidden = models.BooleanField(default=False)
     microservicechainlink = models.ForeignKey('MicroServiceChainLink', db_column='MicroServiceChainLinksPK', null=True, blank=True)
@@ -401,6 +501,10 @@ class Job(models.Model):
 
     class Meta:
         db_table = u'Jobs'
+        index_together = (
+            ('sipuuid', 'subjobof', 'createdtime'),
+            ('unittype', 'hidden', 'subjobof', 'createdtime'),
+        )
 
 
 class Task(models.Model):
@@ -427,6 +531,103 @@ class Task(models.Model):
 
     class Meta:
         db_table = u'Tasks'
+        index_together = (
+            ('job', 'exitcode'),
+        )
+
+
+# Unit types shown on the transfer and ingest tabs, in order of precedence
+# when a unit has jobs of several types
+STATUS_UNIT_TYPES = ('unitSIP', 'unitTransfer')
+
+
+def job_status(job):
+    """ Return the status of job as sent to the transfer and ingest tabs. """
+    return {
+        'uuid': job.jobuuid,
+        'type': job.jobtype,
+        'microservicegroup': job.microservicegroup,
+        'subjobof': job.subjobof,
+        'currentstep': job.currentstep,
+        'timestamp': '%d.%s' % (calendar.timegm(job.createdtime.timetuple()), str(job.createdtimedec).split('.')[-1]),
+    }
+
+
+def unit_status_values(jobs):
+    """
+    Return the UnitStatus fields of a unit, other than its UUID and hidden,
+    from its top-level jobs, newest first.
+    """
+    visible = [job for job in jobs if not job.hidden]
+    unittypes = set(job.unittype for job in visible)
+    unittype = next((t for t in STATUS_UNIT_TYPES if t in unittypes), '')
+    times = [job.createdtime for job in visible if job.unittype == unittype]
+    return {
+        'unittype': unittype,
+        'directory': utils.get_directory_name_from_job(jobs),
+        'latestjobtime': max(times) if times else None,
+        'jobs': json.dumps([job_status(job) for job in jobs]),
+    }
+
+
+class UnitStatusManager(models.Manager):
+    def refresh(self, unit_uuid):
+        """
+        Recompute the status of the unit with unit_uuid from its jobs, and
+        return it. A unit without jobs is kept, but not shown.
+        """
+        # Units whose UUID is not known yet are logged as 'None'
+        if 'None' in unit_uuid:
+            return None
+        self.get_or_create(unituuid=unit_uuid)
+        with transaction.atomic():
+            # Concurrent refreshes of a unit are serialized by the row lock,
+            # so that the last one to commit has read the latest jobs
+            status = self.select_for_update().get(unituuid=unit_uuid)
+            jobs = list(Job.objects.filter(sipuuid=unit_uuid, subjobof='').order_by('-createdtime', '-createdtimedec'))
+            for field, value in unit_status_values(jobs).items():
+                setattr(status, field, value)
+            unit_model = SIP if status.unittype == 'unitSIP' else Transfer
+            status.hidden = unit_model.objects.is_hidden(unit_uuid)
+            status.save()
+        return status
+
+
+class UnitStatus(models.Model):
+    """
+    Summary of the jobs of a unit (Transfer or SIP), as shown on the transfer
+    and ingest tabs.
+
+    It is maintained by MCPServer as jobs are created and change step, with
+    UnitStatus.objects.refresh(), so that the tabs can be polled with a single
+    query. updatedtime lets them fetch only the units changed since their last
+    poll.
+    """
+    unituuid = models.CharField(max_length=36, primary_key=True, db_column='unitUUID')
+    # One of STATUS_UNIT_TYPES, or blank if the unit is not shown
+    unittype = models.CharField(max_length=50, db_column='unitType', blank=True)
+    directory = models.TextField(blank=True)
+    # Time the latest job of unittype was created
+    latestjobtime = models.DateTimeField(db_column='latestJobTime', null=True, default=None)
+    # JSON list of the job_status() of its top-level jobs, newest first
+    jobs = models.TextField(blank=True)
+    hidden = models.BooleanField(default=False)
+    updatedtime = models.DateTimeField(db_column='updatedTime', auto_now=True, db_index=True)
+
+    objects = UnitStatusManager()
+
+    class Meta:
+        db_table = u'UnitStatus'
+        index_together = (
+            ('unittype', 'hidden', 'latestjobtime'),
+        )
+
+
+@receiver(post_save, sender=SIP)
+@receiver(post_save, sender=Transfer)
+def update_unit_status_hidden(sender, instance, **kwargs):
+    UnitStatus.objects.filter(unituuid=instance.uuid).exclude(hidden=instance.hidden).update(
+        hidden=instance.hidden, updatedtime=timezone.now())
 
 
 class Agent(models.Model):
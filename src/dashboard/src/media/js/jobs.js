@@ -843,6 +843,10 @@ BaseAppView = Backbone.View.extend({
       this.statusUrl = options.statusUrl;
       this.uid       = options.uid;
 
+      // Seconds the server may wait for a change before answering a poll,
+      // if it allows long polling (STATUS_LONG_POLL_TIMEOUT)
+      this.longPollTimeout = window.longPollTimeout || 0;
+
       _.bindAll(this, 'add', 'remove');
       Sips.bind('add', this.add);
       Sips.bind('remove', this.remove);
@@ -1055,11 +1059,23 @@ BaseAppView = Backbone.View.extend({
     {
       this.firstPoll = undefined !== start;
 
+      // Once the full list is loaded, only ask for the units changed since
+      // the previous poll; paged grids need the full list
+      var url = this.statusUrl + '?' + new Date().getTime();
+      if (this.cursor && !getURLParameter('paged'))
+        {
+          url += '&since=' + encodeURIComponent(this.cursor);
+          if (this.longPollTimeout)
+            {
+              url += '&timeout=' + this.longPollTimeout;
+            }
+        }
+
       $.ajax({
         context: this,
         dataType: 'json',
         type: 'GET',
-        url: this.statusUrl + '?' + new Date().getTime(),
+        url: url,
         beforeSend: function()
           {
             window.statusWidget.startPoll();
@@ -1071,6 +1087,7 @@ BaseAppView = Backbone.View.extend({
         success: function(response)
           {
             var objects = response.objects;
+            this.cursor = response.cursor;
 
             if (getURLParameter('paged'))
               {
@@ -1099,7 +1116,16 @@ BaseAppView = Backbone.View.extend({
               }
 
             // Delete sips
-            if (Sips.length > objects.length)
+            if (undefined !== response.removed)
+            {
+              var removedSips = Sips.filter(function(sip)
+                  {
+                    return -1 < $.inArray(sip.get('uuid'), response.removed);
+                  });
+
+              Sips.remove(removedSips);
+            }
+            else if (Sips.length > objects.length)
             {
               var unusedSips = Sips.reject(function(sip)
                   {
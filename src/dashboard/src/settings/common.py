@@ -279,10 +279,27 @@ else:
         'INTERCEPT_REDIRECTS': False,
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # AIPs pending deletion in the archival storage tab, shared by all the
+    # dashboard processes
+    'archival_storage': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/archivematica-dashboard-cache',
+    },
+}
+
 # Dashboard internal settings
 MCP_SERVER = ('127.0.0.1', 4730) # localhost:4730
 POLLING_INTERVAL = 5 # Seconds
 STATUS_POLLING_INTERVAL = 5 # Seconds
+# Seconds a transfer or ingest status poll may wait for a change before
+# answering. Each waiting poll holds a server worker for that long, so only
+# set this when the dashboard runs with an asynchronous worker class (e.g.
+# gunicorn's gevent workers); with 0, polls answer at once.
+STATUS_LONG_POLL_TIMEOUT = 0
 TASKS_PER_PAGE = 10 # for paging in tasks dialog
 UUID_REGEX = '[\w]{8}(-[\w]{4}){3}-[\w]{12}'
 
@@ -13,6 +13,16 @@ DATABASES = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'archival_storage': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'archival_storage',
+    },
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
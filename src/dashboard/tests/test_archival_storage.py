@@ -0,0 +1,105 @@
+#!/usr/bin/env python2
+
+import time
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from components.archival_storage import views
+
+
+class FakeThread(object):
+    """Records background refreshes instead of running them."""
+    started = []
+
+    def __init__(self, target):
+        self.target = target
+
+    def start(self):
+        FakeThread.started.append(self)
+
+
+class FakeConnection(object):
+    def close(self):
+        pass
+
+
+class TestAIPsPendingDeletion(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches[views.AIPS_PENDING_DELETION_CACHE]
+        self.cache.clear()
+        self.requests = 0
+        self.error = None
+        self.aips = [{'uuid': 'aip-1'}]
+        FakeThread.started = []
+        self._patch(views.storage_service, 'iter_file_info', self._iter_file_info)
+        self._patch(views.threading, 'Thread', FakeThread)
+        self._patch(views, 'connection', FakeConnection())
+
+    def _patch(self, obj, name, value):
+        original = getattr(obj, name)
+        setattr(obj, name, value)
+        self.addCleanup(setattr, obj, name, original)
+
+    def _iter_file_info(self, status, fields):
+        assert status == 'DEL_REQ'
+        self.requests += 1
+        if self.error:
+            raise self.error
+        return iter(self.aips)
+
+    def _make_stale(self):
+        fetched, aip_uuids = self.cache.get(views.AIPS_PENDING_DELETION_CACHE_KEY)
+        fetched -= views.AIPS_PENDING_DELETION_REFRESH + 1
+        self.cache.set(views.AIPS_PENDING_DELETION_CACHE_KEY, (fetched, aip_uuids))
+
+    def test_first_fetch(self):
+        assert views.aips_pending_deletion() == ['aip-1']
+        assert self.requests == 1
+        # Cached afterwards
+        assert views.aips_pending_deletion() == ['aip-1']
+        assert self.requests == 1
+        assert FakeThread.started == []
+
+    def test_first_fetch_failing(self):
+        self.error = Exception('Connection refused')
+        assert views.aips_pending_deletion() == []
+        self.error = None
+        assert views.aips_pending_deletion() == ['aip-1']
+        assert self.requests == 2
+
+    def test_stale_list_refreshed_once_in_background(self):
+        views.aips_pending_deletion()
+        self._make_stale()
+        self.aips = [{'uuid': 'aip-1'}, {'uuid': 'aip-2'}]
+
+        # The stale list is returned while a single refresh runs
+        assert views.aips_pending_deletion() == ['aip-1']
+        assert views.aips_pending_deletion() == ['aip-1']
+        assert len(FakeThread.started) == 1
+        assert self.requests == 1
+
+        FakeThread.started[0].target()
+        assert self.requests == 2
+        assert views.aips_pending_deletion() == ['aip-1', 'aip-2']
+        assert len(FakeThread.started) == 1
+
+    def test_failed_refresh_keeps_old_list(self):
+        views.aips_pending_deletion()
+        self._make_stale()
+        self.error = Exception('Connection refused')
+
+        assert views.aips_pending_deletion() == ['aip-1']
+        FakeThread.started[0].target()
+        assert views.aips_pending_deletion() == ['aip-1']
+        # The next request tries again
+        assert len(FakeThread.started) == 2
+
+    def test_add_aip_pending_deletion(self):
+        views.aips_pending_deletion()
+        views.add_aip_pending_deletion('aip-2')
+        views.add_aip_pending_deletion('aip-2')
+        assert views.aips_pending_deletion() == ['aip-1', 'aip-2']
+        fetched, _ = self.cache.get(views.AIPS_PENDING_DELETION_CACHE_KEY)
+        assert time.time() - fetched < views.AIPS_PENDING_DELETION_REFRESH
@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+
+import datetime
+import json
+import os
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+from django.utils import timezone
+
+from main import models
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TRANSFER_1 = '7e4a9a3d-ff5d-4b85-8c4a-1a4c4b0bbf6a'
+TRANSFER_2 = 'c2a5b7b8-7a1a-4e5f-9d45-7d1c6e7c3b20'
+SIP_1 = '1b7a5a9c-2c47-4f5e-8f0e-7c8f4f8a9d11'
+
+
+class TestUnitStatus(TestCase):
+
+    fixture_files = ['test_user.json']
+    fixtures = [os.path.join(THIS_DIR, 'fixtures', p) for p in fixture_files]
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username='test', password='test')
+        self.an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        for uuid, unittype in ((TRANSFER_1, 'unitTransfer'), (TRANSFER_2, 'unitTransfer'), (SIP_1, 'unitSIP')):
+            self._status(uuid, unittype)
+        models.UnitStatus.objects.update(updatedtime=self.an_hour_ago)
+
+    def _status(self, uuid, unittype, **kwargs):
+        job = {'uuid': uuid[::-1], 'type': 'Job', 'microservicegroup': 'Group', 'subjobof': '',
+               'currentstep': 'Completed successfully', 'timestamp': '1451606400.0000000000'}
+        kwargs.setdefault('latestjobtime', self.an_hour_ago)
+        models.UnitStatus.objects.update_or_create(unituuid=uuid, defaults=dict(
+            unittype=unittype, directory='Unit', jobs=json.dumps([job]), **kwargs))
+
+    def _get(self, **params):
+        response = self.client.get(reverse('components.transfer.views.status'), params)
+        return response.status_code, json.loads(response.content)
+
+    def test_lists_all_units_shown(self):
+        models.UnitStatus.objects.filter(unituuid=TRANSFER_2).update(hidden=True)
+        status, data = self._get()
+        assert status == 200
+        assert [unit['uuid'] for unit in data['objects']] == [TRANSFER_1]
+        assert data['objects'][0]['jobs'][0]['uuid'] == TRANSFER_1[::-1]
+        assert 'removed' not in data
+        assert data['cursor'] == self.an_hour_ago.isoformat()
+
+    def test_lists_units_changed_since_cursor(self):
+        _, data = self._get()
+        self._status(TRANSFER_1, 'unitTransfer', latestjobtime=timezone.now())
+        self._status(TRANSFER_2, 'unitTransfer', hidden=True)
+        self._status(SIP_1, 'unitSIP')
+
+        status, data = self._get(since=data['cursor'])
+        assert status == 200
+        assert [unit['uuid'] for unit in data['objects']] == [TRANSFER_1]
+        assert data['removed'] == [TRANSFER_2]
+
+        # Nothing changed since
+        models.UnitStatus.objects.update(updatedtime=self.an_hour_ago)
+        _, data = self._get(since=data['cursor'])
+        assert data['objects'] == []
+        assert data['removed'] == []
+
+    def test_rejects_invalid_cursor(self):
+        status, data = self._get(since='yesterday')
+        assert status == 400
+        assert data['error']